@@ -0,0 +1,286 @@
+import os
+import shlex
+import shutil
+import tempfile
+import contextlib
+import threading
+import functools
+import subprocess
+from datetime import timedelta
+from cablewatch import config, ffmetadata, scheduler, tracing
+
+
+class IngestDetection:
+    def __init__(self, *, kind, begin, offset, duration):
+        self.kind = kind
+        self.begin = begin
+        self.offset = offset
+        self.duration = duration
+
+    @property
+    def end(self):
+        return self.begin + self.duration
+
+    @property
+    def middle(self):
+        return self.begin + self.duration / 2
+
+    def asDict(self):
+        return dict(
+            kind = self.kind,
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            offset = self.offset.total_seconds(),
+            duration = self.duration.total_seconds(),
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestAnalyzer:
+    MEDIA = 'v'
+    CHUNK_SIZE = 64 * 1024
+
+    def prepareFilters(self):
+        return 'null' if self.MEDIA == 'v' else 'anull'
+
+    def prepareOutput(self, filename):
+        return '-f null -'
+
+    def prepareChain(self, source, sink, filename):
+        return f'[{source}]{self.prepareFilters()}[{sink}]'
+
+    def consume(self, slice, f):
+        while len(f.read(self.CHUNK_SIZE)) > 0:
+            pass
+
+
+class IngestDetector(IngestAnalyzer):
+    KIND = None
+    START_KEY = None
+    END_KEY = None
+
+    def __init__(self):
+        self.detections = []
+
+    def prepareChain(self, source, sink, filename):
+        return f'[{source}]{self.prepareFilters()},{ffmetadata.prepareFilter(filename, self.MEDIA)}[{sink}]'
+
+    def prepareOutput(self, filename):
+        return '-f null -'
+
+    def addDetection(self, slice, start, end):
+        offset = timedelta(seconds=start)
+        self.detections.append(IngestDetection(kind=self.KIND, begin=slice.getTimestamp(offset), offset=offset,
+            duration=timedelta(seconds=end - start)))
+
+    def consume(self, slice, f):
+        start = None
+        for event in ffmetadata.IngestMetadataReader(f):
+            if self.START_KEY in event:
+                start = event.getFloat(self.START_KEY)
+            if self.END_KEY in event and start is not None:
+                self.addDetection(slice, start, event.getFloat(self.END_KEY))
+                start = None
+        # no end is reported when the detection lasts until the end of the slice
+        if start is not None:
+            self.addDetection(slice, start, slice.effective_duration.total_seconds())
+
+
+class IngestFreezeDetector(IngestDetector):
+    KIND = 'freeze'
+    START_KEY = 'lavfi.freezedetect.freeze_start'
+    END_KEY = 'lavfi.freezedetect.freeze_end'
+
+    def __init__(self, *, crop=None, noise=0.003, duration=2):
+        super().__init__()
+        self._crop = config.Config().INGEST_BANNER_CROP if crop is None else crop
+        self._noise = noise
+        self._duration = duration
+
+    def prepareFilters(self):
+        filters = f'freezedetect=n={self._noise}:d={self._duration}'
+        if self._crop:
+            filters = f'{self._crop},{filters}'
+        return filters
+
+
+class IngestSilenceDetector(IngestDetector):
+    MEDIA = 'a'
+    KIND = 'silence'
+    START_KEY = 'lavfi.silence_start'
+    END_KEY = 'lavfi.silence_end'
+
+    def __init__(self, *, noise='-30dB', duration=0.5):
+        super().__init__()
+        self._noise = noise
+        self._duration = duration
+
+    def prepareFilters(self):
+        return f'silencedetect=noise={self._noise}:d={self._duration}'
+
+
+class IngestPCMExtractor(IngestAnalyzer):
+    MEDIA = 'a'
+    SAMPLE_WIDTH = 2
+    NUM_CHANNELS = 1
+
+    def __init__(self, filename, *, sample_rate=16000):
+        self._filename = filename
+        self._sample_rate = sample_rate
+        self.number_of_frames = 0
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    def prepareFilters(self):
+        return f'aresample={self._sample_rate},aformat=sample_fmts=s16:channel_layouts=mono'
+
+    def prepareOutput(self, filename):
+        return f'-f s16le {shlex.quote(filename)}'
+
+    def consume(self, slice, f):
+        import wave
+        with wave.open(self._filename, 'wb') as wav:
+            wav.setnchannels(self.NUM_CHANNELS)
+            wav.setsampwidth(self.SAMPLE_WIDTH)
+            wav.setframerate(self._sample_rate)
+            size = 0
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if len(chunk) == 0:
+                    break
+                wav.writeframes(chunk)
+                size += len(chunk)
+        self.number_of_frames = size // self.SAMPLE_WIDTH // self.NUM_CHANNELS
+
+
+class IngestFrameSampler(IngestAnalyzer):
+    def __init__(self, *, period=5, crop=None, callback=None):
+        self._period = period
+        self._crop = crop
+        self._callback = callback
+        self.frames = []
+
+    def prepareFilters(self):
+        filters = f'fps=1/{self._period}'
+        if self._crop:
+            filters = f'{self._crop},{filters}'
+        return filters
+
+    def prepareOutput(self, filename):
+        return f'-f image2pipe -c:v ppm {shlex.quote(filename)}'
+
+    def consume(self, slice, f):
+        count = 0
+        while True:
+            magic = f.readline()
+            if len(magic) == 0:
+                break
+            if magic.strip() != b'P6':
+                raise AssertionError(f'invalid PPM frame: {magic!r}')
+            header = f.readline()
+            width, height = (int(x) for x in header.split())
+            maxval = f.readline()
+            data = magic + header + maxval + f.read(width * height * 3)
+            timestamp = slice.getTimestamp(timedelta(seconds=count * self._period))
+            if self._callback is None:
+                self.frames.append((timestamp, data))
+            else:
+                self._callback(timestamp, data)
+            count += 1
+
+
+class IngestAnalysisPass:
+    def __init__(self, *, slice, analyzers, input=None, priority=scheduler.BATCH):
+        if len(analyzers) == 0:
+            raise AssertionError('no analyzer')
+        self._slice = slice
+        self._analyzers = list(analyzers)
+        self._input = input
+        self._priority = priority
+
+    def prepareGraph(self, fifos):
+        graph = []
+        sources = {}
+        for media, split in (('v', 'split'), ('a', 'asplit')):
+            n = sum(1 for analyzer in self._analyzers if analyzer.MEDIA == media)
+            if n == 0:
+                continue
+            labels = [f'{media}{i}' for i in range(n)]
+            graph.append(f"[0:{media}]{split}={n}" + ''.join(f'[{label}]' for label in labels))
+            sources[media] = labels
+        for i, (analyzer, fifo) in enumerate(zip(self._analyzers, fifos)):
+            graph.append(analyzer.prepareChain(sources[analyzer.MEDIA].pop(0), f'out{i}', fifo))
+        return ';'.join(graph)
+
+    def prepareCommand(self, concat_filename, fifos):
+        cmd = 'ffmpeg -nostdin -y -loglevel error'
+        if self._input is None:
+            cmd += f' -f concat -safe 0 -i {shlex.quote(concat_filename)}'
+        else:
+            cmd += f' -i {shlex.quote(self._input)}'
+        cmd += f' -filter_complex {shlex.quote(self.prepareGraph(fifos))}'
+        for i, (analyzer, fifo) in enumerate(zip(self._analyzers, fifos)):
+            cmd += f" -map {shlex.quote(f'[out{i}]')} {analyzer.prepareOutput(fifo)}"
+        return cmd
+
+    def runConsumer(self, analyzer, fd, errors):
+        with os.fdopen(fd, 'rb') as f:
+            try:
+                analyzer.consume(self._slice, f)
+            except Exception as e:
+                errors.append(e)
+                # keep draining so that ffmpeg is never blocked on this output
+                while len(f.read(64 * 1024)) > 0:
+                    pass
+
+    @tracing.traced('analysis.pass')
+    def run(self):
+        conf = config.Config()
+        tmpdir = tempfile.mkdtemp(dir=f'{conf.INGEST_DATADIR}/tmp/', prefix='analysis_')
+        keepers = []
+        threads = []
+        errors = []
+        try:
+            fifos = []
+            for i, analyzer in enumerate(self._analyzers):
+                fifo = f'{tmpdir}/{i}.fifo'
+                os.mkfifo(fifo)
+                fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                os.set_blocking(fd, True)
+                # a write end is held until ffmpeg exits, so that consumers only see EOF once ffmpeg is done
+                # even if an output is never opened
+                keepers.append(os.open(fifo, os.O_WRONLY | os.O_NONBLOCK))
+                thread = threading.Thread(target=self.runConsumer, args=(analyzer, fd, errors), daemon=True)
+                thread.start()
+                threads.append(thread)
+                fifos.append(fifo)
+            with contextlib.ExitStack() as stack:
+                concat_filename = None
+                if self._input is None:
+                    concat_filename = stack.enter_context(self._slice.concatFile()).name
+                cmd = self.prepareCommand(concat_filename, fifos)
+                proc = subprocess.run(cmd, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE, preexec_fn=functools.partial(scheduler.applyPriority, self._priority))
+        finally:
+            for fd in keepers:
+                os.close(fd)
+            for thread in threads:
+                thread.join()
+            shutil.rmtree(tmpdir)
+        if proc.returncode != 0:
+            raise AssertionError(f'analysis failed: {proc.stderr.decode().strip()}')
+        if len(errors) > 0:
+            raise errors[0]
+        return self._analyzers
@@ -1,28 +1,32 @@
-import asyncio
 import signal
 import sys
 import os
 import subprocess
-import re
-import select
-import fcntl
 from datetime import datetime, timedelta
-import wave
-import requests
+import argparse
+import tempfile
+import shutil
 from rich import print
-from loguru import logger
-from bs4 import BeautifulSoup
-from cablewatch import config, http, loghlp, ingest
+from rich.table import Table
+from cablewatch import config, tracing
+from cablewatch.timeline import AUDIO_SAMPLE_RATE, IngestTimeLine, IngestTimeLineTool
+
+
+# Only the modules needed by every entry point are imported above. asyncio, the
+# web stack, loguru, requests and bs4 are imported by the entry points using
+# them so that the timeline tools start fast.
 
 
 def make_synchrone(async_func):
     def inner():
+        import asyncio
         return asyncio.run(async_func())
     return inner
 
 
 class Aborter:
     def __init__(self):
+        import asyncio
         ev = asyncio.Event()
         loop = asyncio.get_running_loop()
         for sig in (signal.SIGINT, signal.SIGTERM):
@@ -30,11 +34,13 @@ class Aborter:
         self._interrupt_event = ev
 
     def onSignal(self):
+        from loguru import logger
         logger.warning("aborted by user (UNIX signal)")
         ev = self._interrupt_event
         ev.set()
 
     def abort(self):
+        from loguru import logger
         logger.error("aborted from code")
         ev = self._interrupt_event
         ev.set()
@@ -46,18 +52,26 @@ class Aborter:
 
 @make_synchrone
 async def main_ingest():
+    from cablewatch import http, ingest, loghlp
     loghlp.setup()
     aborter = Aborter()
     http_service = http.HTTPService()
     ingest_service = ingest.IngestService(http_service=http_service, aborter=aborter)
+    ingest.IngestTimeLineService(http_service=http_service, ingest_service=ingest_service)
+    ingest.IngestSearchService(http_service=http_service)
+    conf = config.Config()
+    http_service.addFileRoute('/data/derived', conf.INGEST_DERIVATIVES_DIR, cache_control='public, max-age=86400')
     await http_service.start()
     await ingest_service.start()
     await aborter.wait()
     await ingest_service.stop()
     await http_service.stop()
+    await loghlp.shutdown()
 
 
 def main_download_roadmap():
+    import requests
+    from bs4 import BeautifulSoup
     conf = config.Config()
     response = requests.get(f'{conf.ROADMAP_HACKMD_URL}')
     response.raise_for_status()
@@ -70,19 +84,140 @@ def main_download_roadmap():
 
 
 def main_timeline():
-    tool = ingest.IngestTimeLineTool(sys.argv)
+    tool = IngestTimeLineTool(sys.argv)
     tool()
 
 
+def main_bench_ingest():
+    import asyncio
+    from cablewatch import replay
+    p = argparse.ArgumentParser()
+    p.add_argument('--hours', type=float, default=1.0, help="simulated hours of ingest")
+    p.add_argument('--speed', type=float, default=600.0, help="simulation speed factor")
+    p.add_argument('--payload-size', type=int, default=188 * 64, help="size of the generated segments")
+    p.add_argument('--ts', default=None, help="recorded MPEG-TS file used as segment payload")
+    p.add_argument('--stderr', default=None, help="recorded command output replayed as noise lines")
+    p.add_argument('--noise-burst', type=int, default=1, help="noise lines replayed with each progress line")
+    p.add_argument('--logs', choices=['default', 'sync', 'enqueue'], default='default',
+        help="log sinks of the ingest service: loguru defaults, or loghlp sinks written synchronously or enqueued")
+    ns = p.parse_args()
+    conf = config.Config()
+    with tempfile.TemporaryDirectory(prefix='cablewatch-bench-') as datadir:
+        for sub in ('timelines', 'tmp'):
+            os.makedirs(f'{datadir}/{sub}')
+        conf.INGEST_DATADIR = datadir
+        conf.LOGS_DIR = f'{datadir}/logs'
+        if ns.logs != 'default':
+            from cablewatch import loghlp
+            loghlp.setup(enqueue=ns.logs == 'enqueue')
+        bench = replay.IngestReplayBenchmark(hours=ns.hours, speed=ns.speed, payload_size=ns.payload_size,
+            ts_filename=ns.ts, stderr_filename=ns.stderr, noise_burst=ns.noise_burst)
+        report = asyncio.run(bench.run())
+        if ns.logs != 'default':
+            asyncio.run(loghlp.shutdown())
+    table = Table()
+    table.add_column("METRIC")
+    table.add_column("VALUE")
+    for k,v in report.items():
+        table.add_row(k, f'{v:.6g}' if isinstance(v, float) else f'{v}')
+    print(table)
+
+
+def main_fingerprint():
+    from cablewatch import fingerprint
+    p = argparse.ArgumentParser()
+    p.add_argument('action', choices=['update', 'query'])
+    p.add_argument('clips', nargs='*', help="reference clips (WAV) to look for")
+    p.add_argument('--begin', type=datetime.fromisoformat, default=None)
+    p.add_argument('--end', type=datetime.fromisoformat, default=None)
+    p.add_argument('--min-matches', type=int, default=None, help="minimum number of matching hashes")
+    ns = p.parse_args()
+    fp_index = fingerprint.IngestFingerprintIndex()
+    if ns.action == 'update':
+        for seg in fp_index.update(begin=ns.begin, end=ns.end):
+            print(f'indexed {seg.basename}')
+        return
+    table = Table()
+    for hdr in ["CLIP", "BEGIN", "END", "SCORE"]:
+        table.add_column(hdr)
+    for clip in ns.clips:
+        for match in fp_index.queryFile(clip, begin=ns.begin, end=ns.end, min_matches=ns.min_matches):
+            table.add_row(os.path.basename(clip), match.begin.isoformat(), match.end.isoformat(), f'{match.score}')
+    print(table)
+
+
+def main_phash():
+    from cablewatch import phash
+    p = argparse.ArgumentParser()
+    p.add_argument('action', choices=['update', 'match'])
+    p.add_argument('timeline', nargs='?', default=None, help="timeline whose slices are matched")
+    p.add_argument('--begin', type=datetime.fromisoformat, default=None)
+    p.add_argument('--end', type=datetime.fromisoformat, default=None)
+    p.add_argument('--min-score', type=float, default=0.5, help="minimum ratio of matching frames")
+    p.add_argument('--copy-results', action='store_true', help="copy the banner and speech results of the originals")
+    ns = p.parse_args()
+    hash_index = phash.IngestFrameHashIndex()
+    if ns.action == 'update':
+        added, failed = hash_index.update(begin=ns.begin, end=ns.end)
+        for seg in added:
+            print(f'hashed {seg.basename}')
+        for seg in failed:
+            print(f'[red]cannot hash {seg.basename}[/red]')
+        return
+    if ns.timeline is None:
+        p.error('please specify a timeline')
+    hash_index.load(begin=ns.begin, end=ns.end)
+    search_index = None
+    if ns.copy_results:
+        from cablewatch import search
+        search_index = search.IngestSearchIndex()
+    table = Table()
+    for hdr in ["SLICE_BEGIN", "SLICE_END", "SOURCE_BEGIN", "SCORE", "COPIED"]:
+        table.add_column(hdr)
+    for slice in IngestTimeLine(name=ns.timeline).slices():
+        match = hash_index.findRebroadcast(slice, min_score=ns.min_score)
+        if match is not None:
+            copied = '-' if search_index is None else str(match.copyResults(search_index))
+            table.add_row(match.begin.isoformat(), match.end.isoformat(), match.source_begin.isoformat(),
+                f'{match.score:.2f}', copied)
+    print(table)
+
+
+def main_search():
+    from cablewatch import search
+    p = argparse.ArgumentParser()
+    p.add_argument('action', choices=['import', 'query'])
+    p.add_argument('args', nargs='+', help="CSV files to import or words to search")
+    p.add_argument('--begin', type=datetime.fromisoformat, default=None)
+    p.add_argument('--end', type=datetime.fromisoformat, default=None)
+    p.add_argument('--type', action='append', default=None, help="banner type or 'speech', repeatable")
+    p.add_argument('--limit', type=int, default=None)
+    ns = p.parse_args()
+    search_index = search.IngestSearchIndex()
+    if ns.action == 'import':
+        for filename in ns.args:
+            print(f'{filename}: {search_index.importCSV(filename)} new result(s)')
+        return
+    table = Table()
+    for hdr in ["BEGIN", "TYPE", "SCORE", "CONTENT"]:
+        table.add_column(hdr)
+    for record in search_index.search(' '.join(ns.args), begin=ns.begin, end=ns.end, types=ns.type, limit=ns.limit):
+        table.add_row(record.begin.isoformat(), record.type, f'{record.score:.2f}', record.snippet)
+    print(table)
+
+
 # -----------------------------------------------------------------------------
 # some examples using timeline
 # -----------------------------------------------------------------------------
 
-TLEX_CROP = 'crop=890:54:68:ih-145'
+TLEX_CROP = config.Config().INGEST_BANNER_CROP
+TLEX_BANNER_TYPE = 'banner'
 
 
 def tlex_extract_skeleton():
-    timeline = ingest.IngestTimeLine(name="skeleton", duration=timedelta(minutes=3))
+    timeline = IngestTimeLine(name="skeleton", duration=timedelta(minutes=3))
+    if IngestTimeLine.loadState("skeleton") is None:
+        timeline.save()
     try:
         for i,slice in enumerate(timeline.slices()):
             with slice.concatFile() as concat:
@@ -90,16 +225,36 @@ def tlex_extract_skeleton():
                 cmd = f'ffmpeg -f concat -safe 0 -i {concat.name}'
                 cmd += ' -f null -'
                 print(f'[red]* {cmd}[/red]')
-                subprocess.run(cmd, shell=True, check=True)
+                with tracing.span('tlex.ffmpeg', slice=i):
+                    subprocess.run(cmd, shell=True, check=True)
     finally:
-        timeline.advance()
-        timeline.save()
+        timeline.compareAndAdvance()
+
+
+def tlex_extract_skeleton_worker():
+    from cablewatch import jobs, scheduler
+    # the worker and its ffmpeg children yield the CPU and the disk to the ingest
+    scheduler.applyPriority(scheduler.BATCH)
+    queue = jobs.IngestJobQueue()
+
+    def process(job):
+        timeline = job.getTimeLine()
+        for i,slice in enumerate(timeline.slices()):
+            with slice.concatFile() as concat:
+                print(f'[red]* {job.begin} SLICE #{i} - begin={slice.begin} duration={slice.effective_duration}[/red]')
+                cmd = f'ffmpeg -f concat -safe 0 -i {concat.name}'
+                cmd += ' -f null -'
+                print(f'[red]* {cmd}[/red]')
+                with tracing.span('tlex.ffmpeg', slice=i):
+                    subprocess.run(cmd, shell=True, check=True)
+    n = queue.work('skeleton', process)
+    print(f'[green]* {n} window(s) processed[/green]')
 
 
 def tlex_play_slice():
     timeline_name = sys.argv[1]
     slice_index = int(sys.argv[2])
-    timeline = ingest.IngestTimeLine(name=timeline_name)
+    timeline = IngestTimeLine(name=timeline_name)
     slice = list(timeline.slices())[slice_index]
     with slice.concatFile() as concat:
         cmd = f'ffplay -autoexit -f concat -safe 0 {concat.name}'
@@ -108,162 +263,99 @@ def tlex_play_slice():
 
 
 def tlex_detect_freeze_in_slices():
+    from cablewatch import analysis
     timeline_name = sys.argv[1]
-    timeline = ingest.IngestTimeLine(name=timeline_name)
-    freezedetect = 'freezedetect=n=0.003:d=2'
+    timeline = IngestTimeLine(name=timeline_name)
+    conf = config.Config()
     unix_ts_fh = open(f'{timeline_name}-freezedetect.txt','w')
     for i,slice in enumerate(timeline.slices()):
-        with slice.concatFile() as concat:
-            print(f'[red]* SLICE #{i}[/red]')
-            cmd = f'ffmpeg -f concat -safe 0 -i {concat.name}'
-            cmd += f' -vf {TLEX_CROP},{freezedetect} '
-            cmd += ' -f null -'
-            print(f'[red]* {cmd}[/red]')
-            p = subprocess.Popen(
-                cmd,
-                shell = True,
-                stdout = subprocess.PIPE,
-                stderr = subprocess.STDOUT,
-            )
-            start = None
-            end = None
-            duration = 0
-            while True:
-                ln = p.stdout.readline()
-                if len(ln) == 0:
-                    break
-                ln = ln.decode()
-                if ln[-1] == '\n':
-                    ln=ln[:-1]
-                print(ln)
-                m = re.search(r'avfi.freezedetect.freeze_start: (.+)$', ln)
-                if m:
-                    start = float(m.group(1))
-                m = re.search(r'avfi.freezedetect.freeze_duration: (.+)$', ln)
-                if m:
-                    duration = float(m.group(1))
-                m = re.search(r'avfi.freezedetect.freeze_end: (.+)$', ln)
-                if m:
-                    end = float(m.group(1))
-                if start and duration and end:
-                    ts_start = slice.begin + timedelta(seconds=start)
-                    ts_end = slice.begin + timedelta(seconds=end)
-                    ts_mid = slice.begin + timedelta(seconds=start+duration/2)
-                    unix_ts_mid = ts_mid.strftime('%s')
-                    unix_ts_fh.write(f'{unix_ts_mid}\n')
-                    unix_ts_fh.flush()
-                    fields = f"start={start:.2f} duration={duration:.2f}s ts_start='{ts_start}' ts_end='{ts_end}' ts_mid='{ts_mid}' unix_ts_mid={unix_ts_mid}"
-                    print(f'[red]* freeze detected: {fields}[/red]')
-                    duration = 0
-                    start = None
-                    end = None
-            print()
+        print(f'[red]* SLICE #{i}[/red]')
+        freeze = analysis.IngestFreezeDetector(crop=TLEX_CROP, noise=0.003, duration=2)
+        with tempfile.TemporaryDirectory(dir=f'{conf.INGEST_DATADIR}/tmp/') as tmpdir:
+            # the banner frames are sampled by the same decode, a frozen banner lasts longer than the period;
+            # they are spooled to disk, only the ones in the middle of a freeze are kept
+            sampled = []
+
+            def spool(timestamp, data):
+                sampled.append((timestamp, f'{tmpdir}/{len(sampled)}.ppm'))
+                with open(sampled[-1][1], 'wb') as f:
+                    f.write(data)
+            slice.analyze([freeze, analysis.IngestFrameSampler(period=1, crop=TLEX_CROP, callback=spool)])
+            for det in freeze.detections:
+                _, frame_filename = min(sampled, key=lambda frame: abs(frame[0] - det.middle))
+                shutil.copyfile(frame_filename, f"frame_{det.middle.strftime('%s')}.ppm")
+        for det in freeze.detections:
+            unix_ts_mid = det.middle.strftime('%s')
+            unix_ts_fh.write(f'{unix_ts_mid}\n')
+            unix_ts_fh.flush()
+            fields = f"start={det.offset.total_seconds():.2f} duration={det.duration.total_seconds():.2f}s ts_start='{det.begin}' ts_end='{det.end}' ts_mid='{det.middle}' unix_ts_mid={unix_ts_mid}"
+            print(f'[red]* freeze detected: {fields}[/red]')
+        print()
 
 
 def tlex_apply_ocr_on_frames():
-    timeline = ingest.IngestTimeLine(name='glob')
-    for a in sys.argv[1:]:
-        unix_timestamp = int(a)
-        timestamp = datetime.fromtimestamp(unix_timestamp)
-        seg = timeline.lookupSegmentFromTimestamp(timestamp)
-        offset = timestamp - seg.begin
-        cmd = f'ffmpeg -y -i {seg.filename} '
-        cmd += f"-vf {TLEX_CROP} "
-        cmd += f"-ss {offset} -vframes 1 frame_{unix_timestamp}.png"
-        print(f'[red]* {cmd}[/red]')
-        subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        cmd = f"tesseract -l fra+eng frame_{unix_timestamp}.png -" # " hocr"
-        print(f'[red]* {cmd}[/red]')
-        p = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
-        print(f'[green]{p.stdout.decode()}[green]')
+    from cablewatch import search
+    timeline = IngestTimeLine(name='glob')
+    with search.IngestResultWriter('banners.csv') as writer:
+        for a in sys.argv[1:]:
+            unix_timestamp = int(a)
+            timestamp = datetime.fromtimestamp(unix_timestamp)
+            # the frames sampled by cablewatch-tlex-detect-freeze-in-slices are not decoded again
+            frame_filename = f'frame_{unix_timestamp}.ppm'
+            if not os.path.exists(frame_filename):
+                frame_filename = f'frame_{unix_timestamp}.png'
+                seg = timeline.lookupSegmentFromTimestamp(timestamp)
+                offset = timestamp - seg.begin
+                cmd = f'ffmpeg -y -i {seg.filename} '
+                cmd += f"-vf {TLEX_CROP} "
+                cmd += f"-ss {offset} -vframes 1 {frame_filename}"
+                print(f'[red]* {cmd}[/red]')
+                with tracing.span('tlex.ffmpeg', timestamp=unix_timestamp):
+                    subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            cmd = f"tesseract -l fra+eng {frame_filename} -" # " hocr"
+            print(f'[red]* {cmd}[/red]')
+            with tracing.span('tlex.ocr', timestamp=unix_timestamp):
+                p = subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE)
+            content = ' '.join(p.stdout.decode().split())
+            print(f'[green]{content}[green]')
+            if content:
+                # the frame is sampled at a one second resolution
+                writer.writeRow(dict(timestamp_begin=timestamp, timestamp_end=timestamp + timedelta(seconds=1),
+                    banner_type=TLEX_BANNER_TYPE, banner_content=content))
 
 
 def tlex_process_slice_audio():
+    import wave
+    from cablewatch import analysis
     timeline_name = sys.argv[1]
     slice_index = int(sys.argv[2])
-    timeline = ingest.IngestTimeLine(name=timeline_name)
+    timeline = IngestTimeLine(name=timeline_name)
     slice = list(timeline.slices())[slice_index]
-    sample_rate = 16000
-    sample_width = 2
-    num_channels = 1 # mono
-    with slice.concatFile() as concat:
-        fdr, fdw = os.pipe()
-        cmd = f'ffmpeg -f concat -safe 0 -i {concat.name}'
-        cmd += ' -af silencedetect=noise=-30dB:d=0.5'
-        cmd += f' -vn -ac 1 -ar {sample_rate} -f wav '
-        cmd += ' pipe:1 '
-        print(f'[red]* {cmd}[/red]')
-        proc = subprocess.Popen(
-            cmd,
-            shell = True,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.PIPE,
-        )
-        poller = select.poll()
-        active_fds = {proc.stdout.fileno(), proc.stderr.fileno()}
-        for fd in active_fds:
-            poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
-            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-        wav_buffer =b''
-        wav_header = None
-        start = None
-        end = None
-        duration = 0
+    conf = config.Config()
+    with tempfile.NamedTemporaryFile(dir=f'{conf.INGEST_DATADIR}/tmp/', suffix='.wav') as tmp:
+        silence = analysis.IngestSilenceDetector(noise='-30dB', duration=0.5)
+        if slice.hasAudio():
+            # audio sidecars of the ingest, no video decode
+            number_of_frames = slice.writeAudio(tmp.name)
+            slice.analyze([silence], input=tmp.name)
+        else:
+            pcm = analysis.IngestPCMExtractor(tmp.name, sample_rate=AUDIO_SAMPLE_RATE)
+            slice.analyze([silence, pcm])
+            number_of_frames = pcm.number_of_frames
         cut_positions = []
-        wav_buffer_size = 0
-        wav_buffer_offset = 0
-        count = 0
-        while len(active_fds) > 0 or len(cut_positions) > 0:
-            for fd, ev in poller.poll():
-                if ev & select.POLLERR:
-                    raise AssertionError
-                elif ev & select.POLLHUP:
-                    poller.unregister(fd)
-                    active_fds.remove(fd)
-                    if fd == proc.stderr.fileno():
-                        cut_positions.append(wav_buffer_size)
-                elif ev & select.POLLIN:
-                    if fd == proc.stderr.fileno(): # ffmpeg log output
-                        ln = proc.stderr.readline()
-                        if ln.endswith(b'\n'):
-                            ln = ln[:-1]
-                        ln = ln.decode()
-                        print(ln)
-                        m = re.search(r'silence_start: (.+)$', ln)
-                        if m:
-                            start = float(m.group(1))
-                        m = re.search(r'silence_end: (.+) \| silence_duration: (.+)$', ln)
-                        if m:
-                            end = float(m.group(1))
-                            duration = float(m.group(2))
-                        if start and duration and end:
-                            print(f'[red] silencedetect: #{count} start={start:.2f}s duration={duration:.2f}s end={end:.2f}s[/red]')
-                            pos = int((start+duration/2) * sample_rate) * sample_width
-                            cut_positions.append(pos)
-                            duration = 0
-                            start = None
-                            end = None
-                            count += 1
-                        print(ln)
-                    else: # ffmpeg wav output
-                        if wav_header is None:
-                            wav_header = os.read(fd, 44)
-                        else:
-                            wav_chunk = os.read(fd, 256)
-                            wav_buffer += wav_chunk
-                            wav_buffer_size += len(wav_chunk)
-            try:
-                pos = cut_positions[0]
-            except IndexError:
-                continue
-            if pos <= wav_buffer_size:
-                pos = cut_positions.pop(0)
-                with wave.open(f'{timeline_name}_{slice_index}_{pos:08d}.wav', 'wb') as wav:
-                    wav.setnchannels(num_channels)
-                    wav.setsampwidth(sample_width)
-                    wav.setframerate(sample_rate)
-                    wav_frames = wav_buffer[:pos-wav_buffer_offset]
-                    wav_buffer = wav_buffer[pos-wav_buffer_offset:]
-                    wav_buffer_offset = pos
-                    wav.writeframes(wav_frames)
+        for count, det in enumerate(silence.detections):
+            start = det.offset.total_seconds()
+            duration = det.duration.total_seconds()
+            print(f'[red] silencedetect: #{count} start={start:.2f}s duration={duration:.2f}s end={start+duration:.2f}s[/red]')
+            cut_positions.append(int((start+duration/2) * AUDIO_SAMPLE_RATE))
+        cut_positions.append(number_of_frames)
+        with wave.open(tmp.name, 'rb') as src:
+            offset = 0
+            for pos in cut_positions:
+                pos = min(pos, number_of_frames)
+                if pos <= offset:
+                    continue
+                with wave.open(f'{timeline_name}_{slice_index}_{pos * src.getsampwidth():08d}.wav', 'wb') as wav:
+                    wav.setparams(src.getparams())
+                    wav.writeframes(src.readframes(pos - offset))
+                offset = pos
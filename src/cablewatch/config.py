@@ -14,6 +14,41 @@ class Config:
     INGEST_YOUTUBE_STREAM_URL = 'https://www.youtube.com/watch?v=Z-Nwo-ypKtM'
     PROJECT_DIR = f"{str(pathlib.Path(__file__).parent.parent.parent)}"
     YT_DLP_EXTRA_ARGS = ''
+    WEB_MAX_REQUESTS_PER_CLIENT = 8
+    INGEST_RESTART_DELAY_MIN = 1.0
+    INGEST_RESTART_DELAY_MAX = 300.0
+    INGEST_RESTART_JITTER = 0.5
+    INGEST_CIRCUIT_BREAKER_THRESHOLD = 8
+    INGEST_CIRCUIT_BREAKER_COOLDOWN = 900.0
+    INGEST_HALT_TIMEOUT = 5.0
+    INGEST_DRIFT_ALPHA = 0.2
+    INGEST_DRIFT_OUTLIER = 5.0
+    INGEST_ENGINE = 'relay'
+    INGEST_HLS_PREFETCH = 4
+    INGEST_STANDBY_MODE = 'off'
+    INGEST_PLANNED_RESTART_PERIOD = 4 * 3600.0
+    INGEST_STANDBY_LEAD = 120.0
+    INGEST_JOBS_LEASE_TIMEOUT = 300.0
+    INGEST_JOBS_MAX_ATTEMPTS = 3
+    INGEST_DERIVATIVES = []
+    INGEST_DERIVATIVES_DIR = '{INGEST_DATADIR}/derived'
+    INGEST_DERIVATIVES_WORKERS = 1
+    INGEST_DERIVATIVES_NICENESS = 10
+    INGEST_DERIVATIVES_MAX_PENDING = 20
+    INGEST_BANNER_CROP = 'crop=890:54:68:ih-145'
+    INGEST_LOG_SAMPLING_PERIOD = 10.0
+    INGEST_LOG_SAMPLING_BURST = 5
+    INGEST_CAPTURE_DIR = '{LOGS_DIR}/capture'
+    INGEST_CAPTURE_RETENTION = 50
+    INGEST_TRACING = False
+    INGEST_PROFILES_DIR = '{LOGS_DIR}/profiles'
+    INGEST_SCHEDULER_MAX_JOBS = 2
+    INGEST_BATCH_NICENESS = 19
+    INGEST_BATCH_IOCLASS = 'idle'
+    INGEST_HEALTH_WINDOW = 60.0
+    INGEST_HEALTH_MAX_LOOP_LAG = 0.1
+    INGEST_HEALTH_MAX_RENAME_LATENCY = 2.0
+    INGEST_HEALTH_MAX_DRIFT_GROWTH = 2.0
 
     def __init__(self):
         if self.__class__._state is not None:
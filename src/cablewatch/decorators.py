@@ -2,3 +2,4 @@ from cablewatch import http
 
 
 http_get = http.RouterDecorator('add_get')
+http_post = http.RouterDecorator('add_post')
@@ -0,0 +1,132 @@
+import os
+import asyncio
+import textwrap
+from loguru import logger
+from cablewatch import config, scheduler, timeline, tracing
+
+
+class IngestDerivatives:
+    FFMPEG = 'ffmpeg -nostdin -y -loglevel error -i {input}'
+
+    COMMANDS = dict(
+        thumbnails = f"""
+            {FFMPEG}
+              -vf fps=1/5,scale=160:-2,tile=6x1
+              -frames:v 1
+              -f image2 {{output}}
+        """,
+        proxy = f"""
+            {FFMPEG}
+              -vf fps=5,scale=-2:180
+              -c:v libx264 -preset veryfast -crf 30
+              -c:a aac -b:a 48k -ac 1
+              -f mp4 {{output}}
+        """,
+        banner = f"""
+            {FFMPEG}
+              -vf {{crop}},fps=5
+              -an -c:v libx264 -preset veryfast -crf 28
+              -f mp4 {{output}}
+        """,
+        audio = f"""
+            {FFMPEG}
+              -vn -ac 1 -ar {timeline.AUDIO_SAMPLE_RATE} -c:a pcm_s16le
+              -f wav {{output}}
+        """,
+    )
+
+    EXTENSIONS = dict(
+        thumbnails = 'jpg',
+        proxy = 'mp4',
+        banner = 'mp4',
+        audio = 'wav',
+    )
+
+    def __init__(self, *, kinds=None, workers=None, niceness=None, max_pending=None, commands=None, scheduler=None):
+        conf = config.Config()
+        if kinds is None:
+            kinds = conf.INGEST_DERIVATIVES
+        for kind in kinds:
+            if kind not in self.COMMANDS:
+                raise AssertionError(f'invalid derivative kind: {kind!r}')
+        self._kinds = list(kinds)
+        self._workers = conf.INGEST_DERIVATIVES_WORKERS if workers is None else workers
+        self._niceness = conf.INGEST_DERIVATIVES_NICENESS if niceness is None else niceness
+        max_pending = conf.INGEST_DERIVATIVES_MAX_PENDING if max_pending is None else max_pending
+        self._commands = dict(self.COMMANDS, **(commands or {}))
+        self._crop = conf.INGEST_BANNER_CROP
+        self._dirname = conf.INGEST_DERIVATIVES_DIR
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._tasks = []
+        self._scheduler = scheduler
+        self._own_scheduler = scheduler is None
+        self.stats = dict(processed=0, failed=0, dropped=0)
+
+    @property
+    def number_of_pending(self):
+        return self._queue.qsize()
+
+    @staticmethod
+    def getFileName(dirname, seg, kind):
+        return seg.getDerivativeFileName(kind, IngestDerivatives.EXTENSIONS[kind], dirname)
+
+    def start(self):
+        os.makedirs(self._dirname, exist_ok=True)
+        if self._own_scheduler:
+            self._scheduler = scheduler.IngestScheduler(max_jobs=self._workers)
+            self._scheduler.start()
+        for i in range(self._workers):
+            self._tasks.append(asyncio.create_task(self.runWorker()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._own_scheduler and self._scheduler is not None:
+            await self._scheduler.stop()
+            self._scheduler = None
+
+    async def join(self):
+        await self._queue.join()
+
+    def submit(self, seg):
+        try:
+            self._queue.put_nowait(seg)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            logger.warning(f'derivatives queue full, skip {seg.basename!r}')
+
+    def prepareCommand(self, seg, kind, output):
+        cmd = textwrap.dedent(self._commands[kind])
+        cmd = cmd.format(input=seg.filename, output=output, crop=self._crop)
+        cmd = cmd.replace('\n', ' ')
+        return cmd.strip()
+
+    async def runWorker(self):
+        while True:
+            seg = await self._queue.get()
+            try:
+                for kind in self._kinds:
+                    await self.generate(seg, kind)
+            finally:
+                self._queue.task_done()
+
+    async def generate(self, seg, kind):
+        filename = self.getFileName(self._dirname, seg, kind)
+        tmp_filename = f'{filename}.tmp'
+        cmd = self.prepareCommand(seg, kind, tmp_filename)
+        with tracing.span(f'derivatives.{kind}', track=asyncio.current_task().get_name(), segment=seg.basename):
+            job = await self._scheduler.run(cmd, name=f'{kind} {seg.basename}', niceness=self._niceness)
+        if job.returncode != 0 or not os.path.exists(tmp_filename):
+            self.stats['failed'] += 1
+            logger.error(f'cannot generate {kind} of {seg.basename!r}: {(job.stderr or "").strip()}')
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return
+        os.rename(tmp_filename, filename)
+        self.stats['processed'] += 1
@@ -0,0 +1,79 @@
+import re
+from datetime import timedelta
+
+
+FRAME_PATTERN = re.compile(r'^frame:\s*(\d+)\s+pts:\s*(\S+)\s+pts_time:(\S+)$')
+
+
+def escapeFilterValue(value):
+    value = re.sub(r"([\\':])", r'\\\1', value)
+    return re.sub(r"([\\'\[\],;])", r'\\\1', value)
+
+
+def prepareFilter(filename, media='v'):
+    name = 'metadata' if media == 'v' else 'ametadata'
+    return f'{name}=mode=print:file={escapeFilterValue(filename)}'
+
+
+class IngestMetadataEvent:
+    def __init__(self, *, frame, pts, offset, timestamp=None, metadata=None):
+        self.frame = frame
+        self.pts = pts
+        self.offset = offset
+        self.timestamp = timestamp
+        self.metadata = {} if metadata is None else metadata
+
+    def __contains__(self, key):
+        return key in self.metadata
+
+    def getFloat(self, key):
+        return float(self.metadata[key])
+
+    def asDict(self):
+        return dict(
+            frame = self.frame,
+            pts = self.pts,
+            offset = None if self.offset is None else self.offset.total_seconds(),
+            timestamp = None if self.timestamp is None else self.timestamp.isoformat(),
+            metadata = self.metadata,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestMetadataReader:
+    def __init__(self, f, *, slice=None):
+        self._f = f
+        self._slice = slice
+
+    def createEvent(self, frame, pts, pts_time):
+        pts = None if pts == 'NOPTS' else int(pts)
+        offset = None if pts_time == 'NOPTS' else timedelta(seconds=float(pts_time))
+        timestamp = None
+        if self._slice is not None and offset is not None:
+            timestamp = self._slice.getTimestamp(offset)
+        return IngestMetadataEvent(frame=int(frame), pts=pts, offset=offset, timestamp=timestamp)
+
+    def __iter__(self):
+        event = None
+        for ln in self._f:
+            if isinstance(ln, bytes):
+                ln = ln.decode()
+            ln = ln.rstrip('\n')
+            m = FRAME_PATTERN.match(ln)
+            if m:
+                if event is not None:
+                    yield event
+                event = self.createEvent(*m.groups())
+                continue
+            key, sep, value = ln.partition('=')
+            if event is None or sep == '':
+                continue
+            event.metadata[key] = value
+        if event is not None:
+            yield event
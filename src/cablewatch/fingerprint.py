@@ -0,0 +1,258 @@
+import os
+import math
+import wave
+import sqlite3
+import contextlib
+from datetime import timedelta
+import numpy as np
+from cablewatch import config, timeline
+from cablewatch.timeline import fromMilliseconds, toMilliseconds
+
+
+FINGERPRINTS_FILENAME = 'fingerprints.sqlite'
+
+
+def readSamples(filename, *, duration=None):
+    with wave.open(filename, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise AssertionError(f'unsupported sample width in {filename!r}')
+        n = wav.getnframes()
+        if duration is not None:
+            n = min(n, math.ceil(duration.total_seconds() * wav.getframerate()))
+        samples = np.frombuffer(wav.readframes(n), dtype='<i2').astype(np.float32)
+        samples = samples.reshape(-1, wav.getnchannels()).mean(axis=1)
+        rate = wav.getframerate()
+    if rate != timeline.AUDIO_SAMPLE_RATE:
+        positions = np.arange(0, len(samples) * timeline.AUDIO_SAMPLE_RATE // rate) * rate / timeline.AUDIO_SAMPLE_RATE
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+
+class IngestFingerprinter:
+    WINDOW = 1024
+    HOP = 512
+    NUMBER_OF_BINS = 512
+    PEAK_TIME_NEIGHBORHOOD = 8
+    PEAK_FREQ_NEIGHBORHOOD = 12
+    PEAK_MARGIN = 1.0
+    FAN_OUT = 8
+    MAX_DT = 63
+
+    @property
+    def frame_duration(self):
+        return timedelta(seconds=self.HOP / timeline.AUDIO_SAMPLE_RATE)
+
+    @property
+    def overlap_duration(self):
+        # the farthest target of an anchor, and the neighbourhood deciding whether that target is a peak
+        return self.frame_duration * (self.MAX_DT + self.PEAK_TIME_NEIGHBORHOOD) + timedelta(
+            seconds=self.WINDOW / timeline.AUDIO_SAMPLE_RATE)
+
+    def computeSpectrogram(self, samples):
+        if len(samples) < self.WINDOW:
+            return np.zeros((0, self.NUMBER_OF_BINS), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.WINDOW)[::self.HOP]
+        spectrum = np.abs(np.fft.rfft(frames * np.hanning(self.WINDOW).astype(np.float32), axis=1))
+        return np.log1p(spectrum[:, :self.NUMBER_OF_BINS])
+
+    def maximumFilter(self, a, size, axis):
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (size, size)
+        padded = np.pad(a, pad, constant_values=-np.inf)
+        return np.lib.stride_tricks.sliding_window_view(padded, 2 * size + 1, axis=axis).max(axis=-1)
+
+    def meanFilter(self, a, size, axis):
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (size, size)
+        padded = np.pad(a, pad, mode='edge')
+        return np.lib.stride_tricks.sliding_window_view(padded, 2 * size + 1, axis=axis).mean(axis=-1)
+
+    def findPeaks(self, spectrogram):
+        if len(spectrogram) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        local_max = self.maximumFilter(spectrogram, self.PEAK_TIME_NEIGHBORHOOD, 0)
+        local_max = self.maximumFilter(local_max, self.PEAK_FREQ_NEIGHBORHOOD, 1)
+        # the threshold follows the neighbourhood, loud passages do not hide the peaks of the quiet ones
+        threshold = self.meanFilter(spectrogram, self.PEAK_TIME_NEIGHBORHOOD, 0)
+        threshold = self.meanFilter(threshold, self.PEAK_FREQ_NEIGHBORHOOD, 1) + self.PEAK_MARGIN
+        frames, bins = np.nonzero((spectrogram == local_max) & (spectrogram > threshold))
+        order = np.lexsort((bins, frames))
+        return frames[order], bins[order]
+
+    def computeHashes(self, samples, *, number_of_samples=None):
+        frames, bins = self.findPeaks(self.computeSpectrogram(samples))
+        hashes = []
+        anchor_frames = []
+        for k in range(1, self.FAN_OUT + 1):
+            dt = frames[k:] - frames[:-k]
+            valid = (dt > 0) & (dt <= self.MAX_DT)
+            hashes.append((bins[:-k][valid] << 15) | (bins[k:][valid] << 6) | dt[valid])
+            anchor_frames.append(frames[:-k][valid])
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        hashes, anchor_frames = np.concatenate(hashes), np.concatenate(anchor_frames)
+        if number_of_samples is not None:
+            # the samples past number_of_samples are an overlap, only their peaks are used as targets
+            keep = anchor_frames * self.HOP < number_of_samples
+            hashes, anchor_frames = hashes[keep], anchor_frames[keep]
+        return hashes, anchor_frames
+
+
+class IngestFingerprintMatch:
+    def __init__(self, *, begin, duration, score):
+        self.begin = begin
+        self.duration = duration
+        self.score = score
+
+    @property
+    def end(self):
+        return self.begin + self.duration
+
+    def asDict(self):
+        return dict(
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            duration = self.duration.total_seconds(),
+            score = self.score,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestFingerprintIndex:
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS hashes (
+            hash INTEGER NOT NULL,
+            time INTEGER NOT NULL,
+            PRIMARY KEY (hash, time)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS segments (
+            basename TEXT PRIMARY KEY,
+            number_of_hashes INTEGER NOT NULL
+        )
+        """,
+    ]
+    MIN_MATCHES = 10
+    QUERY_BATCH_SIZE = 500
+
+    def __init__(self, filename=None, *, fingerprinter=None):
+        conf = config.Config()
+        if filename is None:
+            filename = f'{conf.INGEST_DATADIR}/{FINGERPRINTS_FILENAME}'
+        self._filename = filename
+        self._fingerprinter = IngestFingerprinter() if fingerprinter is None else fingerprinter
+        with self.transaction() as db:
+            for query in self.SCHEMA:
+                db.execute(query)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @contextlib.contextmanager
+    def transaction(self):
+        db = sqlite3.connect(self._filename, timeout=60, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def hasSegment(self, seg):
+        with self.transaction() as db:
+            return db.execute('SELECT 1 FROM segments WHERE basename = ?', (seg.basename,)).fetchone() is not None
+
+    def addSegment(self, seg, next_seg=None):
+        filename = seg.getDerivativeFileName('audio', 'wav')
+        if not os.path.exists(filename):
+            return None
+        samples = readSamples(filename)
+        number_of_samples = len(samples)
+        # the segment marked as a hole is the last one before a restart, the next one is discontinuous
+        if next_seg is not None and not seg.hole and abs(next_seg.begin - seg.end) <= timeline.GAP_TOLERANCE:
+            next_filename = next_seg.getDerivativeFileName('audio', 'wav')
+            if os.path.exists(next_filename):
+                overlap = readSamples(next_filename, duration=self._fingerprinter.overlap_duration)
+                samples = np.concatenate([samples, overlap])
+        hashes, frames = self._fingerprinter.computeHashes(samples, number_of_samples=number_of_samples)
+        hop_ms = self._fingerprinter.frame_duration / timedelta(milliseconds=1)
+        times = toMilliseconds(seg.begin) + np.round(frames * hop_ms).astype(np.int64)
+        with self.transaction() as db:
+            if db.execute('SELECT 1 FROM segments WHERE basename = ?', (seg.basename,)).fetchone() is not None:
+                return None
+            db.executemany('INSERT OR IGNORE INTO hashes (hash, time) VALUES (?, ?)',
+                zip(hashes.tolist(), times.tolist()))
+            db.execute('INSERT INTO segments (basename, number_of_hashes) VALUES (?, ?)', (seg.basename, len(hashes)))
+        return len(hashes)
+
+    def update(self, index=None, begin=None, end=None):
+        if index is None:
+            index = timeline.IngestIndex.open()
+        with self.transaction() as db:
+            done = set(basename for basename, in db.execute('SELECT basename FROM segments'))
+        added = []
+        segs = list(index.getSegments(begin).values())
+        for seg, next_seg in zip(segs, segs[1:] + [None]):
+            if end is not None and seg.begin >= end:
+                break
+            # the newest segment is fingerprinted with its overlap once the next one is ingested
+            if seg.basename in done or next_seg is None:
+                continue
+            if self.addSegment(seg, next_seg) is not None:
+                added.append(seg)
+        return added
+
+    def query(self, samples, *, begin=None, end=None, min_matches=None):
+        if min_matches is None:
+            min_matches = self.MIN_MATCHES
+        fp = self._fingerprinter
+        hop_ms = fp.frame_duration / timedelta(milliseconds=1)
+        hashes, frames = fp.computeHashes(samples)
+        refs = {}
+        for h, frame in zip(hashes.tolist(), frames.tolist()):
+            refs.setdefault(h, []).append(frame)
+        begin_ms = -(1 << 62) if begin is None else toMilliseconds(begin)
+        end_ms = 1 << 62 if end is None else toMilliseconds(end)
+        offsets = []
+        keys = list(refs)
+        with self.transaction() as db:
+            for i in range(0, len(keys), self.QUERY_BATCH_SIZE):
+                batch = keys[i:i + self.QUERY_BATCH_SIZE]
+                rows = db.execute(f"""
+                    SELECT hash, time FROM hashes
+                    WHERE hash IN ({','.join('?' * len(batch))}) AND time >= ? AND time < ?
+                """, batch + [begin_ms, end_ms]).fetchall()
+                for h, t in rows:
+                    for frame in refs[h]:
+                        offsets.append(round((t - frame * hop_ms) / hop_ms))
+        if len(offsets) == 0:
+            return []
+        values, counts = np.unique(np.array(offsets, dtype=np.int64), return_counts=True)
+        duration = timedelta(seconds=len(samples) / timeline.AUDIO_SAMPLE_RATE)
+        matches = []
+        # neighbour offsets are merged, a clip occurrence spreads over a couple of frames
+        for value, count in sorted(zip(values.tolist(), counts.tolist()), key=lambda vc: -vc[1]):
+            if count < min_matches:
+                break
+            if any(abs(value - other) * hop_ms < duration / timedelta(milliseconds=1) for other, _ in matches):
+                continue
+            matches.append((value, count))
+        matches.sort()
+        return [IngestFingerprintMatch(begin=fromMilliseconds(round(value * hop_ms)), duration=duration, score=count)
+            for value, count in matches]
+
+    def queryFile(self, filename, **kwargs):
+        return self.query(readSamples(filename), **kwargs)
@@ -0,0 +1,216 @@
+import asyncio
+import collections
+import re
+from datetime import datetime, timedelta
+from urllib.parse import urljoin
+import aiohttp
+from loguru import logger
+
+
+class HLSError(Exception):
+    pass
+
+
+class HLSSegment:
+    def __init__(self, *, sequence, uri, duration, program_date_time=None, discontinuity=False):
+        self.sequence = sequence
+        self.uri = uri
+        self.duration = duration
+        self.program_date_time = program_date_time
+        self.discontinuity = discontinuity
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class HLSPlaylist:
+    EXT_M3U = '#EXTM3U'
+    EXT_INF = '#EXTINF:'
+    EXT_PROGDT = '#EXT-X-PROGRAM-DATE-TIME:'
+    EXT_TARGETDURATION = '#EXT-X-TARGETDURATION:'
+    EXT_MEDIA_SEQUENCE = '#EXT-X-MEDIA-SEQUENCE:'
+    EXT_DISCONTINUITY = '#EXT-X-DISCONTINUITY'
+    EXT_ENDLIST = '#EXT-X-ENDLIST'
+    EXT_STREAM_INF = '#EXT-X-STREAM-INF:'
+
+    def __init__(self):
+        self.target_duration = None
+        self.media_sequence = 0
+        self.segments = []
+        self.variants = []
+        self.endlist = False
+
+    @property
+    def is_master(self):
+        return len(self.variants) > 0
+
+    @classmethod
+    def parse(cls, text, base_url=''):
+        pl = cls()
+        lines = [ln.strip() for ln in text.splitlines()]
+        if len(lines) == 0 or lines[0] != cls.EXT_M3U:
+            raise HLSError('not a m3u8 playlist')
+        duration = None
+        pdt = None
+        discontinuity = False
+        bandwidth = None
+        sequence = None
+        for ln in lines[1:]:
+            if len(ln) == 0:
+                continue
+            if ln.startswith(cls.EXT_TARGETDURATION):
+                pl.target_duration = float(ln[len(cls.EXT_TARGETDURATION):])
+            elif ln.startswith(cls.EXT_MEDIA_SEQUENCE):
+                pl.media_sequence = int(ln[len(cls.EXT_MEDIA_SEQUENCE):])
+            elif ln.startswith(cls.EXT_INF):
+                duration = float(ln[len(cls.EXT_INF):].split(',')[0])
+            elif ln.startswith(cls.EXT_PROGDT):
+                pdt = datetime.fromisoformat(ln[len(cls.EXT_PROGDT):].replace('Z', '+00:00'))
+            elif ln.startswith(cls.EXT_DISCONTINUITY):
+                discontinuity = True
+            elif ln.startswith(cls.EXT_ENDLIST):
+                pl.endlist = True
+            elif ln.startswith(cls.EXT_STREAM_INF):
+                m = re.search(r'(?:^|,)BANDWIDTH=(\d+)', ln[len(cls.EXT_STREAM_INF):])
+                bandwidth = int(m.group(1)) if m else 0
+            elif ln.startswith('#'):
+                continue
+            elif bandwidth is not None:
+                pl.variants.append((bandwidth, urljoin(base_url, ln)))
+                bandwidth = None
+            else:
+                if duration is None:
+                    raise HLSError(f'no duration for segment {ln!r}')
+                if sequence is None:
+                    sequence = pl.media_sequence
+                seg = HLSSegment(sequence=sequence, uri=urljoin(base_url, ln), duration=duration,
+                    program_date_time=pdt, discontinuity=discontinuity)
+                pl.segments.append(seg)
+                sequence += 1
+                if pdt is not None:
+                    pdt = pdt + timedelta(seconds=duration)
+                duration = None
+                discontinuity = False
+        return pl
+
+
+class HLSFetcher:
+    def __init__(self, url, *, on_segment, prefetch=4, live_edge=3, max_retries=3, timeout=10.0):
+        self._url = url
+        self._on_segment = on_segment
+        self._prefetch = prefetch
+        self._live_edge = live_edge
+        self._max_retries = max_retries
+        self._timeout = timeout
+        self._stop_event = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(prefetch)
+        self._session = None
+        self.stats = dict(playlists=0, segments=0, bytes=0, errors=0)
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    async def get(self, url):
+        for attempt in range(self._max_retries):
+            try:
+                async with self._session.get(url) as response:
+                    response.raise_for_status()
+                    return await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.stats['errors'] += 1
+                if attempt == self._max_retries - 1:
+                    raise HLSError(f'cannot fetch {url!r}: {e}')
+                logger.warning(f'fetch {url!r} failed ({e}), retry')
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def fetchPlaylist(self, url):
+        data = await self.get(url)
+        self.stats['playlists'] += 1
+        return HLSPlaylist.parse(data.decode(), url)
+
+    async def fetchSegment(self, seg):
+        async with self._semaphore:
+            try:
+                data = await self.get(seg.uri)
+            except HLSError as e:
+                logger.warning(f'skip segment #{seg.sequence}: {e}')
+                return None
+        self.stats['segments'] += 1
+        self.stats['bytes'] += len(data)
+        return data
+
+    async def resolveMediaPlaylist(self, url):
+        playlist = await self.fetchPlaylist(url)
+        if not playlist.is_master:
+            return url, playlist
+        bandwidth, url = max(playlist.variants)
+        logger.info(f'select variant with bandwidth {bandwidth}')
+        return url, await self.fetchPlaylist(url)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(limit=self._prefetch + 1)
+        timeout = aiohttp.ClientTimeout(total=self._timeout)
+        queue = collections.deque()
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self._session = session
+            try:
+                url, playlist = await self.resolveMediaPlaylist(self._url)
+                last_sequence = None
+                while not self.stopped:
+                    new_segments = playlist.segments
+                    if last_sequence is None:
+                        if not playlist.endlist:
+                            new_segments = new_segments[-self._live_edge:]
+                    else:
+                        new_segments = [seg for seg in new_segments if seg.sequence > last_sequence]
+                    for seg in new_segments:
+                        queue.append((seg, asyncio.create_task(self.fetchSegment(seg))))
+                        last_sequence = seg.sequence
+                    if playlist.endlist:
+                        deadline = None
+                    else:
+                        if len(new_segments) > 0:
+                            interval = playlist.target_duration or 1.0
+                        else:
+                            interval = (playlist.target_duration or 1.0) / 2
+                        deadline = loop.time() + interval
+                    await self.deliver(queue, deadline)
+                    if playlist.endlist:
+                        break
+                    remaining = deadline - loop.time()
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(self._stop_event.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                    if not self.stopped:
+                        playlist = await self.fetchPlaylist(url)
+            finally:
+                for seg, task in queue:
+                    task.cancel()
+                self._session = None
+
+    async def deliver(self, queue, deadline):
+        loop = asyncio.get_running_loop()
+        while len(queue) > 0 and not self.stopped:
+            seg, task = queue[0]
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait([task], timeout=timeout)
+            if len(done) == 0:
+                return
+            queue.popleft()
+            data = task.result()
+            if data is not None:
+                self._on_segment(seg, data)
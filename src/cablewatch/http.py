@@ -1,3 +1,6 @@
+import os
+import gzip
+import contextlib
 import logging
 from aiohttp import web
 from loguru import logger
@@ -17,6 +20,76 @@ class RouterDecorator:
         return inner
 
 
+class FileResponse(web.FileResponse):
+    def __init__(self, path, *, on_done=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self._on_done = on_done
+
+    async def prepare(self, request):
+        try:
+            return await super().prepare(request)
+        finally:
+            if self._on_done is not None:
+                self._on_done()
+                self._on_done = None
+
+
+class FileServer:
+    def __init__(self, rootdir, *, cache_control=None, max_requests_per_client=None):
+        conf = config.Config()
+        self._rootdir = os.path.realpath(rootdir)
+        self._cache_control = cache_control
+        if max_requests_per_client is None:
+            max_requests_per_client = conf.WEB_MAX_REQUESTS_PER_CLIENT
+        self._max_requests_per_client = max_requests_per_client
+        self._active_requests = {}
+        self.stats = dict(requests=0, rejected=0)
+
+    @staticmethod
+    def precompress(filename):
+        tmp_filename = f'{filename}.gz.tmp'
+        with open(filename, 'rb') as f, gzip.open(tmp_filename, 'wb') as gz:
+            while True:
+                data = f.read(1 << 20)
+                if len(data) == 0:
+                    break
+                gz.write(data)
+        os.rename(tmp_filename, f'{filename}.gz')
+
+    def resolve(self, path):
+        filename = os.path.realpath(os.path.join(self._rootdir, path))
+        if os.path.commonpath([filename, self._rootdir]) != self._rootdir or not os.path.isfile(filename):
+            raise web.HTTPNotFound()
+        # a .gz sibling older than the file was not rewritten with it, the file is sent as is
+        with contextlib.suppress(FileNotFoundError):
+            if os.stat(f'{filename}.gz').st_mtime_ns < os.stat(filename).st_mtime_ns:
+                os.remove(f'{filename}.gz')
+        return filename
+
+    async def serve(self, request, path, *, content_type=None, cache_control=None):
+        filename = self.resolve(path)
+        remote = request.remote
+        active = self._active_requests.get(remote, 0)
+        if active >= self._max_requests_per_client:
+            self.stats['rejected'] += 1
+            raise web.HTTPTooManyRequests(headers={'Retry-After': '1'})
+        self._active_requests[remote] = active + 1
+        self.stats['requests'] += 1
+        headers = {}
+        if cache_control is None:
+            cache_control = self._cache_control
+        if cache_control is not None:
+            headers['Cache-Control'] = cache_control
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        return FileResponse(filename, headers=headers, on_done=lambda: self.releaseRequest(remote))
+
+    def releaseRequest(self, remote):
+        self._active_requests[remote] -= 1
+        if self._active_requests[remote] == 0:
+            del self._active_requests[remote]
+
+
 class HTTPService:
     def __init__(self):
         self._app = web.Application()
@@ -38,6 +111,14 @@ class HTTPService:
             f = getattr(router, method)
             f(path, handler, **kwargs)
 
+    def addFileRoute(self, prefix, rootdir, **kwargs):
+        server = FileServer(rootdir, **kwargs)
+
+        async def handler(request):
+            return await server.serve(request, request.match_info['path'])
+        self._app.router.add_get(f"{prefix.rstrip('/')}/{{path:.+}}", handler)
+        return server
+
     async def start(self):
         logger.info("starting web service")
         conf = config.Config()
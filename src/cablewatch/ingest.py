@@ -2,29 +2,24 @@ import os
 import sys
 import signal
 import asyncio
+import random
 import re
 import textwrap
 import time
-import glob
 import json
-import argparse
-import tempfile
-import copy
-from datetime import datetime, timedelta
-from pytimeparse.timeparse import timeparse
+import hashlib
+import shutil
+import collections
+from datetime import datetime, timedelta, timezone
 from loguru import logger
 from aiohttp import web,  WSCloseCode
 import psutil
-from rich import print
-from rich.table import Table
-from cablewatch import config
-from cablewatch.decorators import http_get
+from cablewatch import config, derivatives, hls, http, loghlp, scheduler, search, timeline, tracing
+from cablewatch.decorators import http_get, http_post
 
 
 SEGMENT_DURATION = 30
-SEGMENT_DATETIME_FORMAT = '%Y-%m-%dT%Hh%Mm%S'
-SEGMENT_FORMAT = 'segment_{datetime}_{duration:.2f}s.ts'
-SEGMENT_PATTERN = r'^segment_(.+)_(.+)s\.ts(\.hole)?$'
+DRIFT_FILENAME = 'drift.json'
 
 
 class IngestService:
@@ -42,38 +37,80 @@ class IngestService:
           -hls_flags program_date_time
           -hls_list_size 1
           -strftime 1
-          -hls_segment_filename tmp/segment_%s.ts
-          tmp/output.m3u8
+          -hls_segment_filename {{tmpdir}}/segment_%s.ts
+          {{tmpdir}}/output.m3u8
     """
 
-    HLS_EXT_INF = '#EXTINF:'
-    HLS_EXT_PROGDT = '#EXT-X-PROGRAM-DATE-TIME:'
+    RESOLVE_COMMAND = 'yt-dlp -g -f best {yt_dlp_extra_args} {url}'
+
+    ENGINES = ('relay', 'hls')
+    STANDBY_MODES = ('off', 'planned', 'continuous')
+    MAX_HANDOVER_REPORTS = 100
 
-    def __init__(self, *, http_service, recording_requested=True, aborter=None):
+    def __init__(self, *, http_service, recording_requested=True, aborter=None, command=None):
         conf = config.Config()
         self._recording_requested = recording_requested
-        cmd = self.COMMAND
-        cmd = textwrap.dedent(cmd)
-        cmd = cmd.format(url=conf.INGEST_YOUTUBE_STREAM_URL, yt_dlp_extra_args=conf.YT_DLP_EXTRA_ARGS)
+        if command is None:
+            cmd = self.COMMAND
+            cmd = textwrap.dedent(cmd)
+            cmd = cmd.format(url=conf.INGEST_YOUTUBE_STREAM_URL, yt_dlp_extra_args=conf.YT_DLP_EXTRA_ARGS, tmpdir='{tmpdir}')
+        else:
+            cmd = command
         cmd = cmd.replace('\n', ' ')
         cmd = cmd.strip()
         self._command = cmd
-        self._proc = None
+        if conf.INGEST_ENGINE not in self.ENGINES:
+            raise AssertionError(f'invalid ingest engine: {conf.INGEST_ENGINE!r}')
+        self._engine = conf.INGEST_ENGINE
+        if conf.INGEST_STANDBY_MODE not in self.STANDBY_MODES:
+            raise AssertionError(f'invalid standby mode: {conf.INGEST_STANDBY_MODE!r}')
+        self._standby_mode = conf.INGEST_STANDBY_MODE
+        self._pipeline = None
+        self._standby = None
+        self._number_of_pipelines = 0
         self._background_task = None
         self._status_websockets = set()
         self._service_start_time = None
         self._record_start_time = None
         self._halt_start_time = None
         self._background_task = None
-        self._current_cmd_log_level = None
         self._number_of_launched_records = 0
         self._number_of_failed_records = 0
-        self._drifts = []
+        self._segment_filename = None
+        self._hole_segment_marker = None
+        self._last_segment_end = None
         self._aborter = aborter
+        self._index = None
+        self._derivatives = None
+        self._health = scheduler.IngestHealthMonitor()
+        self._scheduler = scheduler.IngestScheduler(health=self._health)
+        self._supervisor = IngestSupervisor()
+        self._standby_supervisor = IngestSupervisor()
+        self._next_restart_time = None
+        self._next_standby_time = None
+        self._handover = None
+        self._handovers = []
+        self._number_of_handovers = 0
+        self._profiler = None
         http_service.addDecoratedRoutes(self)
 
+    @property
+    def index(self):
+        return self._index
+
     async def start(self):
         logger.info("starting ingest service")
+        index = timeline.IngestIndex()
+        if not index.exists():
+            logger.info(f"build segment index {index.filename!r}")
+            index.rebuild()
+        index.load()
+        self._index = index
+        self._health.start()
+        self._scheduler.start()
+        if len(config.Config().INGEST_DERIVATIVES) > 0:
+            self._derivatives = derivatives.IngestDerivatives(scheduler=self._scheduler)
+            self._derivatives.start()
         self._service_start_time = datetime.today()
         task = asyncio.create_task(self.runBackgroundTask())
         task.add_done_callback(self.runBackgroundTaskDone)
@@ -84,9 +121,31 @@ class IngestService:
         while True:
             if self._recording_requested:
                 await self.runCommand()
+                if self._recording_requested and not self.hasStandby():
+                    await self.waitBeforeRestart()
             else:
                 await self.halt()
 
+    async def waitBeforeRestart(self):
+        spv = self._supervisor
+        delay = spv.restart_delay
+        if delay is None:
+            return
+        if spv.state == spv.OPEN:
+            logger.error(f"circuit breaker open after {spv.consecutive_failures} consecutive failures, "
+                f"restart recording in {delay:.1f}s")
+        else:
+            logger.warning(f"restart recording in {delay:.1f}s")
+        self._next_restart_time = datetime.now() + timedelta(seconds=delay)
+        await self.pushStatus()
+        while self._recording_requested:
+            remaining = (self._next_restart_time - datetime.now()).total_seconds()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(0.3, remaining))
+        self._next_restart_time = None
+        spv.onRecordRestarting()
+
     async def halt(self):
         self._halt_start_time = datetime.today()
         await self.pushStatus()
@@ -98,131 +157,171 @@ class IngestService:
                 if i==99:
                     logger.info('halt')
 
-    def getDriftAverage(self):
-        sum = timedelta(seconds=0)
-        for drift in self._drifts:
-            sum += drift
-        return sum / len(self._drifts)
-
-    async def processLineIssuedByCommand(self, line):
-        if line.startswith('frame='):
-            return
-        m = re.search(r'^\[https @ 0x[0-9a-f]+\] Opening', line)
-        if m:
-            return
-        m = re.search(r"\[hls @ 0x[0-9a-f]+\] Skip \('(\S+)'\)", line)
-        if m:
-            if m.group(1).startswith(self.HLS_EXT_PROGDT):
-                dt = datetime.fromisoformat(m.group(1)[len(self.HLS_EXT_PROGDT):])
-                dt = dt.astimezone()
-                drift = datetime.now().astimezone() - dt
-                self._drifts += [drift]
-                self._drifts = self._drifts[-4:]
-                logger.info(f'drift: {self.getDriftAverage().total_seconds():0.1f}s')
-            return
-        m = re.search(r"^\[hls @ 0x[0-9a-f]+\] Opening '(\S+)' for writing", line)
-        if m:
-            fn = m.group(1)
-            if fn.endswith('.ts'):
-                self._tmp_segment_filename = fn
-            elif fn.endswith('.m3u8.tmp'):
-                self.processM3U8Output(fn)
-            return 'INFO'
-        return self._current_cmd_log_level
+    def hasStandby(self):
+        return self._standby is not None and not self._standby.done()
 
-    def processM3U8Output(self, fn):
-        with open(fn[:-4],'r') as f:
-            count = 0
-            duration = None
-            while True:
-                ln = f.readline()
-                if len(ln) == 0:
-                    break
-                if ln.endswith('\n'):
-                    ln=ln[:-1]
-                if ln.startswith(self.HLS_EXT_INF):
-                    L = len(self.HLS_EXT_INF)
-                    duration = float(ln[L:-1])
-                    count += 1
-                if ln.startswith(self.HLS_EXT_PROGDT):
-                    L = len(self.HLS_EXT_PROGDT)
-                    dt = datetime.strptime(ln[L:], "%Y-%m-%dT%H:%M:%S.%f%z")
-                    dt = dt - self.getDriftAverage()
-                    self._segment_filename = SEGMENT_FORMAT.format(datetime=dt.strftime(SEGMENT_DATETIME_FORMAT), duration=duration)
-                    count += 1
-                if ln.startswith('segment_'):
-                    logger.info(f'move {self._tmp_segment_filename!r} to {self._segment_filename!r}')
-                    os.rename(self._tmp_segment_filename, self._segment_filename)
-                    self._hole_segment_marker = self._segment_filename + '.hole'
-                    count += 1
-            if count < 3:
-                raise AssertionError
+    def createPipeline(self, *, standby=False):
+        self._number_of_pipelines += 1
+        name = f'pipeline{self._number_of_pipelines}'
+        tmpdir = f'tmp/{name}'
+        if self._standby_mode == 'off':
+            log_name = '[from-cmd]'
+        else:
+            log_name = f'[from-cmd:{name}]'
+        if self._engine == 'hls':
+            conf = config.Config()
+            url = conf.INGEST_YOUTUBE_STREAM_URL
+            command = self.RESOLVE_COMMAND.format(url=url, yt_dlp_extra_args=conf.YT_DLP_EXTRA_ARGS)
+            command = ' '.join(command.split())
+            return IngestHLSPipeline(service=self, name=name, command=command, url=url,
+                tmpdir=tmpdir, log_name=log_name, standby=standby)
+        return IngestPipeline(service=self, name=name, command=self._command.replace('{tmpdir}', tmpdir),
+            tmpdir=tmpdir, log_name=log_name, standby=standby)
 
     def cleanupTempFolder(self):
         conf = config.Config()
         now = time.time()
         dir = f'{conf.INGEST_DATADIR}/tmp'
-        for fn in os.listdir(dir):
-            pth = f'{dir}/{fn}'
-            if os.path.isfile(pth):
+        for root, dirs, files in os.walk(dir):
+            for fn in files:
+                pth = f'{root}/{fn}'
                 if fn.endswith('.ts') or fn.endswith('.concat'):
                     age = now - os.path.getmtime(pth)
                     if age >= 10 * 60: # 10 minutes
-                        logger.info(f"remove old temp file 'tmp/{fn}'")
+                        logger.info(f"remove old temp file {os.path.relpath(pth, conf.INGEST_DATADIR)!r}")
                         os.remove(pth)
 
-    async def readLineIssuedByCommand(self, stream):
-        line = b''
-        while True:
-            ch = await stream.read(1)
-            if not ch:
-                return ''
-            if ch==b'\r' or ch==b'\n':
-                return line.strip().decode()
-            else:
-                line += ch
-
     async def runCommand(self):
         logger.info("run recording")
-        logger.info(f"command is {self._command!r}")
         self._record_start_time = datetime.today()
         self._number_of_launched_records += 1
-        self._tmp_segment_filename = None
-        self._segment_filename = None
         self._hole_segment_marker = None
-        self._current_cmd_log_level = 'INFO'
+        previous = self._pipeline
+        if self.hasStandby():
+            pipeline = self._standby
+            self._standby = None
+            self.promotePipeline(pipeline, planned=previous is not None and previous.handover_requested)
+        else:
+            self._standby = None
+            pipeline = self.createPipeline()
+            logger.info(f"command is {pipeline.command!r}")
+            self._pipeline = pipeline
+            pipeline.start()
         try:
-            conf = config.Config()
-            os.chdir(f"{conf.INGEST_DATADIR}")
-            proc = await asyncio.create_subprocess_shell(self._command,
-                stdin = asyncio.subprocess.PIPE,
-                stdout = asyncio.subprocess.PIPE,
-                stderr = asyncio.subprocess.STDOUT,
-            )
-            logger.info(f"ingest command pid is {proc.pid}")
-            self._proc = proc
             await self.pushStatus()
-            i = 0
-            while True:
-                line = await self.readLineIssuedByCommand(proc.stdout)
-                if not line:
-                    break
-                log_level = await self.processLineIssuedByCommand(line)
-                if log_level is not None:
-                    logger.bind(name='[from-cmd]').log(log_level, line)
-                if i > 100:
-                    self.cleanupTempFolder()
-                    i = 0
-                i += 1
-            returncode = await proc.wait()
-            logger.log(self._current_cmd_log_level, f'command exits with returncode {returncode}')
+            while not pipeline.done():
+                await pipeline.wait(timeout=1.0)
+                if pipeline.handover_requested:
+                    await pipeline.halt()
+                else:
+                    await self.manageStandby(pipeline)
+            await pipeline.wait()
         finally:
-            self.markHoleSegment()
-            self._proc = None
-            self._number_of_failed_records += 1
+            pipeline.cancel()
+            if not (self._recording_requested and self.hasStandby()):
+                self.markHoleSegment()
+            if not pipeline.handover_requested:
+                self._number_of_failed_records += 1
+                if self._recording_requested:
+                    self._supervisor.onRecordFailed(datetime.now())
             await self.pushStatus()
             self.checkFatalAtStartup()
 
+    async def manageStandby(self, pipeline):
+        if self._standby_mode == 'off':
+            return
+        conf = config.Config()
+        now = datetime.now()
+        if self._standby is not None:
+            if not self._standby.done():
+                return
+            logger.warning(f"standby pipeline {self._standby.name!r} exits")
+            self._standby = None
+            delay = self._standby_supervisor.onRecordFailed(now)
+            self._next_standby_time = now + timedelta(seconds=delay)
+        if self._next_standby_time is not None and now < self._next_standby_time:
+            return
+        if self._standby_mode == 'planned':
+            age = (now - pipeline.start_time).total_seconds()
+            if age < conf.INGEST_PLANNED_RESTART_PERIOD - conf.INGEST_STANDBY_LEAD:
+                return
+        standby = self.createPipeline(standby=True)
+        logger.info(f"start standby pipeline {standby.name!r}")
+        logger.info(f"command is {standby.command!r}")
+        self._standby_supervisor.onRecordRestarting()
+        self._next_standby_time = None
+        self._standby = standby
+        standby.start()
+        await self.pushStatus()
+
+    def promotePipeline(self, pipeline, *, planned):
+        logger.info(f"promote standby pipeline {pipeline.name!r}")
+        pipeline.standby = False
+        self._pipeline = pipeline
+        self._handover = dict(time=datetime.now(), last_segment_end=self._last_segment_end, planned=planned)
+        pending = pipeline.pending
+        pipeline.pending = []
+        for tmp_filename, segment_filename in pending:
+            self.commitSegment(pipeline, tmp_filename, segment_filename)
+
+    def onPipelineSegment(self, pipeline, tmp_filename, segment_filename):
+        if not pipeline.standby:
+            self.commitSegment(pipeline, tmp_filename, segment_filename)
+            return
+        self._standby_supervisor.onSegmentFinalized(datetime.now())
+        pipeline.pending.append((tmp_filename, segment_filename))
+        while len(pipeline.pending) > 2:
+            fn, _ = pipeline.pending.pop(0)
+            os.remove(fn)
+        active = self._pipeline
+        if self._standby_mode != 'planned' or active is None or active.handover_requested:
+            return
+        seg = timeline.IngestSegment.fromFileName(segment_filename)
+        if self._last_segment_end is None or seg.end > self._last_segment_end + timeline.GAP_TOLERANCE:
+            logger.info(f"standby pipeline {pipeline.name!r} is ready, hand over from {active.name!r}")
+            active.handover_requested = True
+
+    @tracing.traced('ingest.commit_segment')
+    def commitSegment(self, pipeline, tmp_filename, segment_filename):
+        seg = timeline.IngestSegment.fromFileName(segment_filename)
+        if pipeline.standby_origin and self._last_segment_end is not None:
+            if seg.end <= self._last_segment_end + timeline.GAP_TOLERANCE:
+                logger.info(f'discard {tmp_filename!r}, already recorded until {self._last_segment_end}')
+                os.remove(tmp_filename)
+                return
+        logger.info(f'move {tmp_filename!r} to {segment_filename!r}')
+        self._health.addRenameLatency(time.time() - os.path.getmtime(tmp_filename))
+        if pipeline is self._pipeline:
+            self._health.addDrift(pipeline.drift.total_seconds())
+        os.rename(tmp_filename, segment_filename)
+        self._segment_filename = segment_filename
+        self._hole_segment_marker = segment_filename + '.hole'
+        self._index.addSegment(seg)
+        if self._derivatives is not None:
+            self._derivatives.submit(seg)
+        if self._handover is not None:
+            self.reportHandover(seg)
+        if self._last_segment_end is None or seg.end > self._last_segment_end:
+            self._last_segment_end = seg.end
+        self._supervisor.onSegmentFinalized(datetime.now())
+
+    def reportHandover(self, seg):
+        handover = self._handover
+        self._handover = None
+        if handover['last_segment_end'] is None:
+            return
+        gap = (seg.begin - handover['last_segment_end']).total_seconds()
+        report = dict(
+            time = handover['time'].isoformat(),
+            planned = handover['planned'],
+            gap = max(gap, 0),
+            overlap = max(-gap, 0),
+        )
+        logger.info(f"handover done, gap={report['gap']:.2f}s overlap={report['overlap']:.2f}s")
+        self._number_of_handovers += 1
+        self._handovers.append(report)
+        self._handovers = self._handovers[-self.MAX_HANDOVER_REPORTS:]
+
     def checkFatalAtStartup(self, msg=''):
         duration = (datetime.now() - self._service_start_time).total_seconds()
         if not (5 < duration < 10):
@@ -243,15 +342,13 @@ class IngestService:
         logger.warning(f"put hole segment marker: {self._hole_segment_marker!r}")
         with open(f'{self._hole_segment_marker}','w') as f:
             f.write('')
+        self._index.markHole(self._segment_filename)
+        self._hole_segment_marker = None
 
-    def haltCommand(self):
-        if self._proc is None:
-            return
-        parent = psutil.Process(self._proc.pid)
-        children = parent.children(recursive=True)
-        for pid in [self._proc.pid] + [child.pid for child in children]:
-            os.kill(pid, signal.SIGTERM)
-        self._proc = None
+    async def haltCommand(self):
+        for pipeline in (self._pipeline, self._standby):
+            if pipeline is not None:
+                await pipeline.halt()
 
     def runBackgroundTaskDone(self, future):
         if future.cancelled():
@@ -264,15 +361,36 @@ class IngestService:
         logger.info(message)
         for ws in list(self._status_websockets):
             await ws.close(code=WSCloseCode.GOING_AWAY, message=message)
-        self.haltCommand()
+        await self.haltCommand()
         if self._background_task is not None:
             self._background_task.cancel()
             try:
                 await self._background_task
             except asyncio.CancelledError:
                 pass
+        if self._derivatives is not None:
+            await self._derivatives.stop()
+        await self._scheduler.stop()
+        await self._health.stop()
+        if self._profiler is not None:
+            self.stopProfiler()
         logger.info("ingest service stopped")
 
+    def startProfiler(self):
+        self._profiler = tracing.IngestSamplingProfiler()
+        self._profiler.start()
+        logger.info("sampling profiler started")
+
+    def stopProfiler(self):
+        conf = config.Config()
+        profiler = self._profiler
+        self._profiler = None
+        profiler.stop()
+        filename = profiler.exportFolded(f"{conf.INGEST_PROFILES_DIR}/profile_{profiler.start_time.strftime('%Y-%m-%dT%Hh%Mm%S')}.folded")
+        top = ', '.join(f'{function} {count}' for function, count in profiler.getTopFunctions(5))
+        logger.info(f"sampling profiler stopped, {profiler.number_of_samples} samples in {filename!r}, top: {top}")
+        return filename
+
     @http_get("/api/ingest")
     async def handleWebSocket(self, request: web.Request) -> web.WebSocketResponse():
         ws = web.WebSocketResponse()
@@ -288,6 +406,7 @@ class IngestService:
                     if msg.data == 'record':
                         if not self._recording_requested:
                             self._recording_requested = True
+                            self._supervisor.reset()
                             await self.pushStatus()
                             returned_msg = "ok"
                         else:
@@ -297,12 +416,32 @@ class IngestService:
                             self._number_of_failed_records -= 1
                             self._recording_requested = False
                             await self.pushStatus()
-                            self._current_cmd_log_level = 'INFO'
-                            self.haltCommand()
+                            await self.haltCommand()
                             await self.pushStatus()
                             returned_msg = "ok"
                         else:
                             returned_msg = "state error: curently not recording"
+                    elif msg.data == 'profile-start':
+                        if self._profiler is None:
+                            self.startProfiler()
+                            await self.pushStatus()
+                            returned_msg = "ok"
+                        else:
+                            returned_msg = "state error: profiler is running"
+                    elif msg.data == 'profile-stop':
+                        if self._profiler is not None:
+                            filename = self.stopProfiler()
+                            await self.pushStatus()
+                            returned_msg = f"ok: {filename}"
+                        else:
+                            returned_msg = "state error: profiler is not running"
+                    elif msg.data in ('tracing-on', 'tracing-off'):
+                        if msg.data == 'tracing-on':
+                            tracing.TRACER.enable()
+                        else:
+                            tracing.TRACER.disable()
+                        await self.pushStatus()
+                        returned_msg = "ok"
                     else:
                         returned_msg = f"invalid command: '{msg.data}'"
                     await ws.send_json({'type': 'command-reply', 'message': returned_msg})
@@ -310,15 +449,43 @@ class IngestService:
             self._status_websockets.remove(ws)
         return ws
 
+    @http_get("/api/ingest/handovers")
+    async def handleHandovers(self, request: web.Request) -> web.Response:
+        return web.json_response(self._handovers)
+
+    @http_get("/api/ingest/scheduler")
+    async def handleScheduler(self, request: web.Request) -> web.Response:
+        return web.json_response(self._scheduler.asDict())
+
+    @http_get("/api/ingest/tracing")
+    async def handleTracing(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(enabled=tracing.TRACER.enabled, stages=tracing.TRACER.getStats()))
+
+    @http_get("/api/ingest/tracing/trace.json")
+    async def handleTrace(self, request: web.Request) -> web.Response:
+        return web.json_response(tracing.TRACER.asChromeTrace(),
+            headers={'Content-Disposition': 'attachment; filename="trace.json"'})
+
+    @http_post("/api/ingest/tracing/reset")
+    async def handleTracingReset(self, request: web.Request) -> web.Response:
+        tracing.TRACER.reset()
+        return web.json_response(dict(enabled=tracing.TRACER.enabled, stages={}))
+
     def prepareStatus(self):
         sts = {}
         sts['type'] = 'status'
         sts['recording_requested'] = self._recording_requested
         sts['segment_filename'] = self._segment_filename
-        if self._proc is not None:
-            sts['pid'] = self._proc.pid
-        else:
-            sts['pid'] = None
+        for k in 'pipeline', 'standby':
+            pipeline = getattr(self, f'_{k}')
+            if pipeline is not None:
+                pid = pipeline.pid
+            else:
+                pid = None
+            if k == 'pipeline':
+                sts['pid'] = pid
+            elif self._standby_mode != 'off':
+                sts['standby_pid'] = pid
         for k in 'service_start_time', 'record_start_time', 'halt_start_time':
             value = getattr(self, f'_{k}')
             if value is None:
@@ -326,420 +493,710 @@ class IngestService:
             else:
                 sts[k] = value.strftime("%Y-%m-%d %Hh%M")
         sts['number_of_launched_records'] = self._number_of_launched_records
+        sts['tracing'] = tracing.TRACER.enabled
+        sts['profiling'] = self._profiler is not None
         sts['number_of_failed_records'] = self._number_of_failed_records
+        if self._pipeline is not None:
+            sts['drift'] = round(self._pipeline.drift.total_seconds(), 3)
+        else:
+            sts['drift'] = None
+        spv = self._supervisor
+        sts['supervisor_state'] = spv.state
+        sts['consecutive_failures'] = spv.consecutive_failures
+        if self._next_restart_time is None:
+            sts['next_restart_time'] = None
+        else:
+            sts['next_restart_time'] = self._next_restart_time.strftime("%Y-%m-%d %Hh%Mm%S")
+        for k in 'restart_delay', 'last_time_to_recover':
+            value = getattr(spv, k)
+            if value is None:
+                sts[k] = None
+            else:
+                sts[k] = round(value, 1)
+        if self._standby_mode != 'off':
+            sts['standby_mode'] = self._standby_mode
+            sts['number_of_handovers'] = self._number_of_handovers
+            if len(self._handovers) > 0:
+                sts['last_handover_gap'] = round(self._handovers[-1]['gap'], 2)
+            else:
+                sts['last_handover_gap'] = None
+        sts['health'] = self._health.getState()
+        sts['scheduler_budget'] = self._scheduler.budget
+        sts['scheduler_pending'] = self._scheduler.number_of_pending
+        sts['scheduler_running'] = self._scheduler.number_of_running
+        if self._derivatives is not None:
+            sts['derivatives_pending'] = self._derivatives.number_of_pending
+            for k, v in self._derivatives.stats.items():
+                sts[f'derivatives_{k}'] = v
         return sts
 
+    @tracing.traced('ingest.push_status')
     async def pushStatus(self):
         sts = self.prepareStatus()
         for ws in self._status_websockets:
             await ws.send_json(sts)
 
 
-class IngestTimeLine:
-    NAME_PATTERN = r"^[A-Za-z0-9_-]+$"
-    PROTECTED_NAMES = set(['glob'])
-
-    @classmethod
-    def checkName(cls, name):
-        if not re.fullmatch(cls.NAME_PATTERN, name):
-            raise AssertionError(f'{name} is not a valid timeline name')
+class IngestPipeline:
+    HLS_EXT_INF = '#EXTINF:'
+    HLS_EXT_PROGDT = '#EXT-X-PROGRAM-DATE-TIME:'
+    READ_SIZE = 1 << 14
+    LINE_END_PATTERN = re.compile(rb'[\r\n]')
 
-    @classmethod
-    def loadNames(self):
-        EXT = '.json'
-        names = []
-        conf = config.Config()
-        for bn in os.listdir(f'{conf.INGEST_DATADIR}/timelines'):
-            if bn.endswith(EXT):
-                names.append(bn[:-len(EXT)])
-        return names
-
-    @classmethod
-    def loadInstances(cls):
-        instances = {}
-        instances['glob'] = IngestTimeLine(name='glob')
-        for name in cls.loadNames():
-            tl = IngestTimeLine(name=name)
-            instances[name] = tl
-        return instances
-
-    def __init__(self, *args, **kwargs):
-        self.init(*args,**kwargs)
-
-    def init(self, name, readonly=False, begin=None, duration=None, load=True):
-        self.checkName(name)
-        conf = config.Config()
-        all_segment_filenames = glob.glob(f"{conf.INGEST_DATADIR}/segment_*.ts*")
-        all_segment_filenames.sort()
-        segments = {}
-        for fn in all_segment_filenames:
-            seg = IngestSegment.fromFileName(fn)
-            segments[seg.begin] = seg
-        if len(segments) > 0:
-            first_seg = next(iter(segments.values()))
-            last_seg = next(reversed(segments.values()))
-        if begin is None:
-            if len(segments) > 0:
-                begin = first_seg.begin
-            else:
-                begin = datetime.combine(datetime.today(), datetime.min.time())
-        if duration is None:
-            if len(segments) > 0:
-                duration = last_seg.begin - first_seg.begin + last_seg.duration
-            else:
-                duration = timedelta(seconds=0)
-        if load and os.path.exists(f'{conf.INGEST_DATADIR}/timelines/{name}.json'):
-            with open(f'{conf.INGEST_DATADIR}/timelines/{name}.json', 'r') as f:
-                d = json.loads(f.read())
-            begin = datetime.fromisoformat(d['begin'])
-            duration = timedelta(seconds=d['duration'])
-        for seg in list(segments.values()):
-            if (seg.begin + seg.duration) < begin:
-                del segments[seg.begin]
-            elif seg.begin >= (begin + duration):
-                del segments[seg.begin]
-        if len(segments) > 0:
-            first_seg = next(iter(segments.values()))
-            last_seg = next(reversed(segments.values()))
-            end = (begin + duration)
-            seg_end =(last_seg.begin + last_seg.duration)
-            if begin > first_seg.begin:
-                first_seg.inpoint = begin - first_seg.begin
-            if seg_end > end:
-                last_seg.outpoint = last_seg.duration - (seg_end - end)
-        self._begin = begin
-        self._duration = duration
+    def __init__(self, *, service, name, command, tmpdir, log_name='[from-cmd]', standby=False):
+        self._service = service
         self._name = name
-        self._segments = segments
+        self._command = command
+        self._tmpdir = tmpdir
+        self._log_name = log_name
+        self._proc = None
+        self._task = None
+        self._tmp_segment_filename = None
+        self._current_cmd_log_level = 'INFO'
+        self._sampler = loghlp.IngestLogSampler()
+        self._lines = collections.deque()
+        self._partial_line = b''
+        self._drift = IngestDriftEstimator()
+        self._drift.load()
+        self.start_time = None
+        self.standby = standby
+        self.standby_origin = standby
+        self.handover_requested = False
+        self.pending = []
 
     @property
     def name(self):
         return self._name
 
     @property
-    def begin(self):
-        return self._begin
+    def command(self):
+        return self._command
 
     @property
-    def end(self):
-        return self._begin + self._duration
+    def pid(self):
+        if self._proc is None:
+            return None
+        return self._proc.pid
 
-    @property
-    def duration(self):
-        return self._duration
+    def start(self):
+        self.start_time = datetime.now()
+        self._task = asyncio.create_task(self.run())
+
+    def done(self):
+        return self._task is None or self._task.done()
+
+    async def wait(self, timeout=None):
+        if self._task is None:
+            return None
+        if timeout is None:
+            return await self._task
+        await asyncio.wait([self._task], timeout=timeout)
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
 
     @property
-    def segments(self):
-        return copy.copy(self._segments)
-
-    def lookupSegmentFromTimestamp(self, timestamp):
-        for seg in self._segments.values():
-            if (seg.begin <= timestamp <= seg.end):
-                return seg
-        raise LookupError
-
-    def getNumberOfHoles(self):
-        num_holes = 0
-        for seg in self._segments.values():
-            if seg.hole:
-                num_holes += 1
-        return num_holes
-
-    def advance(self):
-        duration = self._duration
-        begin = self._begin + duration
-        self.init(self._name, begin=begin, duration=duration, load=False)
+    def drift(self):
+        return self._drift.value
 
-    def reset(self):
-        duration = self._duration
-        begin = None
-        self.init(self._name, begin=begin, duration=duration, load=False)
+    def getDriftAverage(self):
+        return self._drift.value
 
-    def save(self):
-        name = self._name
-        if name in self.PROTECTED_NAMES:
-            raise AssertionError(f'timeline {name!r} cannot be altered')
+    async def processLineIssuedByCommand(self, line):
+        if line.startswith('frame='):
+            return
+        m = re.search(r'^\[https @ 0x[0-9a-f]+\] Opening', line)
+        if m:
+            return
+        m = re.search(r"\[hls @ 0x[0-9a-f]+\] Skip \('(\S+)'\)", line)
+        if m:
+            if m.group(1).startswith(self.HLS_EXT_PROGDT):
+                dt = datetime.fromisoformat(m.group(1)[len(self.HLS_EXT_PROGDT):])
+                dt = dt.astimezone()
+                drift = datetime.now().astimezone() - dt
+                self._drift.update(drift)
+                logger.info(f'drift: {self.getDriftAverage().total_seconds():0.3f}s')
+            return
+        m = re.search(r"^\[hls @ 0x[0-9a-f]+\] Opening '(\S+)' for writing", line)
+        if m:
+            fn = m.group(1)
+            if fn.endswith('.ts'):
+                self._tmp_segment_filename = fn
+            elif fn.endswith('.m3u8.tmp'):
+                self.processM3U8Output(fn)
+            return 'INFO'
+        return self._current_cmd_log_level
+
+    def logCommandLine(self, log_level, line):
+        for ln in self._sampler.sample(line):
+            logger.bind(name=self._log_name).log(log_level, ln)
+
+    def flushCommandLog(self):
+        for ln in self._sampler.flush():
+            logger.bind(name=self._log_name).log(self._current_cmd_log_level, ln)
+
+    @tracing.traced('ingest.m3u8')
+    def processM3U8Output(self, fn):
+        with open(fn[:-4],'r') as f:
+            count = 0
+            duration = None
+            while True:
+                ln = f.readline()
+                if len(ln) == 0:
+                    break
+                if ln.endswith('\n'):
+                    ln=ln[:-1]
+                if ln.startswith(self.HLS_EXT_INF):
+                    L = len(self.HLS_EXT_INF)
+                    duration = float(ln[L:-1])
+                    count += 1
+                if ln.startswith(self.HLS_EXT_PROGDT):
+                    L = len(self.HLS_EXT_PROGDT)
+                    dt = datetime.strptime(ln[L:], "%Y-%m-%dT%H:%M:%S.%f%z")
+                    dt = dt - self.getDriftAverage()
+                    segment_filename = timeline.SEGMENT_FORMAT.format(datetime=timeline.formatSegmentDatetime(dt), duration=duration)
+                    count += 1
+                if ln.startswith('segment_'):
+                    self._service.onPipelineSegment(self, self._tmp_segment_filename, segment_filename)
+                    count += 1
+            if count < 3:
+                raise AssertionError
+
+    async def readLineIssuedByCommand(self, stream):
+        # ffmpeg ends progress lines with \r, the output is read by chunks and split on both
+        while len(self._lines) == 0:
+            chunk = await stream.read(self.READ_SIZE)
+            if not chunk:
+                return ''
+            lines = self.LINE_END_PATTERN.split(self._partial_line + chunk)
+            self._partial_line = lines.pop()
+            self._lines.extend(ln for ln in (ln.strip() for ln in lines) if ln)
+        return self._lines.popleft().decode()
+
+    async def run(self):
         conf = config.Config()
-        d = dict(
-            begin = self._begin.isoformat(),
-            duration = self._duration.total_seconds(),
+        os.chdir(f"{conf.INGEST_DATADIR}")
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+        os.makedirs(self._tmpdir)
+        capture = loghlp.IngestCommandCapture(name=self._name, command=self._command)
+        returncode = None
+        try:
+            proc = await asyncio.create_subprocess_shell(self._command,
+                stdin = asyncio.subprocess.PIPE,
+                stdout = asyncio.subprocess.PIPE,
+                stderr = asyncio.subprocess.STDOUT,
+            )
+            logger.info(f"ingest command pid is {proc.pid}")
+            self._proc = proc
+            await self._service.pushStatus()
+            i = 0
+            while True:
+                line = await self.readLineIssuedByCommand(proc.stdout)
+                if not line:
+                    break
+                capture.write(line)
+                with tracing.span('ingest.line', track=self._name):
+                    log_level = await self.processLineIssuedByCommand(line)
+                    if log_level is not None:
+                        self.logCommandLine(log_level, line)
+                if i > 100:
+                    self._service.cleanupTempFolder()
+                    i = 0
+                i += 1
+            returncode = await proc.wait()
+            self.flushCommandLog()
+            logger.log(self._current_cmd_log_level, f'command exits with returncode {returncode}')
+            return returncode
+        finally:
+            capture.close(returncode)
+            self._proc = None
+            self.cleanup()
+
+    def cleanup(self):
+        self._drift.save()
+        for tmp_filename, _ in self.pending:
+            os.remove(tmp_filename)
+        self.pending = []
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    async def halt(self):
+        self._current_cmd_log_level = 'INFO'
+        if self._proc is None:
+            return
+        conf = config.Config()
+        try:
+            parent = psutil.Process(self._proc.pid)
+            procs = [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            procs = []
+        for p in procs:
+            try:
+                p.send_signal(signal.SIGTERM)
+            except psutil.NoSuchProcess:
+                pass
+        alive = await self.waitProcesses(procs, conf.INGEST_HALT_TIMEOUT)
+        for p in alive:
+            logger.warning(f"process {p.pid} still alive {conf.INGEST_HALT_TIMEOUT}s after SIGTERM, send SIGKILL")
+            try:
+                p.send_signal(signal.SIGKILL)
+            except psutil.NoSuchProcess:
+                pass
+
+    @staticmethod
+    async def waitProcesses(procs, timeout):
+        def is_alive(p):
+            try:
+                return p.status() != psutil.STATUS_ZOMBIE
+            except psutil.NoSuchProcess:
+                return False
+        deadline = time.monotonic() + timeout
+        alive = [p for p in procs if is_alive(p)]
+        while len(alive) > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            alive = [p for p in alive if is_alive(p)]
+        return alive
+
+
+class IngestHLSPipeline(IngestPipeline):
+    def __init__(self, *, url, **kwargs):
+        super().__init__(**kwargs)
+        self._url = url
+        # now - PROGRAM-DATE-TIME is the live edge latency, not the relay drift stored in drift.json
+        self._drift = IngestDriftEstimator(persistent=False)
+        self._segment_duration = SEGMENT_DURATION
+        self._fetcher = None
+        self._halt_requested = False
+        self._output = None
+        self._output_filename = None
+        self._output_begin = None
+        self._output_duration = 0
+
+    async def resolveManifestURL(self):
+        if re.search(r'\.m3u8(\?|$)', self._url):
+            return self._url
+        proc = await asyncio.create_subprocess_shell(self._command,
+            stdin = asyncio.subprocess.DEVNULL,
+            stdout = asyncio.subprocess.PIPE,
+            stderr = asyncio.subprocess.PIPE,
         )
-        with open(f'{conf.INGEST_DATADIR}/timelines/{name}.json', 'w') as f:
-            f.write(json.dumps(d))
+        logger.info(f"resolve command pid is {proc.pid}")
+        self._proc = proc
+        try:
+            stdout, stderr = await proc.communicate()
+        finally:
+            self._proc = None
+        capture = loghlp.IngestCommandCapture(name=self._name, command=self._command)
+        for line in stderr.decode().splitlines():
+            capture.write(line)
+            self.logCommandLine(self._current_cmd_log_level, line)
+        capture.close(proc.returncode)
+        self.flushCommandLog()
+        urls = stdout.decode().split()
+        if proc.returncode != 0 or len(urls) == 0:
+            raise hls.HLSError(f'cannot resolve manifest url (returncode {proc.returncode})')
+        return urls[0]
+
+    def processSourceSegment(self, seg, data):
+        pdt = seg.program_date_time
+        if pdt is None:
+            pdt = datetime.now(timezone.utc)
+        if self._output is not None:
+            expected = self._output_begin + timedelta(seconds=self._output_duration)
+            if seg.discontinuity or abs(pdt - expected) > timeline.GAP_TOLERANCE:
+                self.closeOutputSegment()
+        if self._output is None:
+            self._output_filename = f'{self._tmpdir}/segment_{seg.sequence}.ts'
+            self._output = open(self._output_filename, 'wb')
+            self._output_begin = pdt
+            self._output_duration = 0
+            drift = datetime.now(timezone.utc) - pdt
+            self._drift.update(drift)
+            logger.info(f'drift: {self.getDriftAverage().total_seconds():0.3f}s')
+        self._output.write(data)
+        self._output_duration += seg.duration
+        if self._output_duration >= self._segment_duration:
+            self.closeOutputSegment()
+
+    def closeOutputSegment(self):
+        if self._output is None:
+            return
+        self._output.close()
+        self._output = None
+        dt = self._output_begin.astimezone()
+        segment_filename = timeline.SEGMENT_FORMAT.format(datetime=timeline.formatSegmentDatetime(dt), duration=self._output_duration)
+        self._service.onPipelineSegment(self, self._output_filename, segment_filename)
 
-    def remove(self):
-        name = self._name
-        if name in self.PROTECTED_NAMES:
-            raise AssertionError(f'timeline {name!r} cannot be removed')
+    async def run(self):
         conf = config.Config()
-        os.remove(f'{conf.INGEST_DATADIR}/timelines/{name}.json')
+        os.chdir(f"{conf.INGEST_DATADIR}")
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+        os.makedirs(self._tmpdir)
+        try:
+            url = await self.resolveManifestURL()
+            logger.info(f"manifest url is {url!r}")
+            fetcher = hls.HLSFetcher(url, on_segment=self.processSourceSegment, prefetch=conf.INGEST_HLS_PREFETCH)
+            self._fetcher = fetcher
+            if not self._halt_requested:
+                await fetcher.run()
+            self.closeOutputSegment()
+            logger.info(f'hls fetcher exits, stats: {fetcher.stats}')
+            return 0
+        except hls.HLSError as e:
+            logger.log(self._current_cmd_log_level, f'hls fetcher fails: {e}')
+            return 1
+        finally:
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+            self._fetcher = None
+            self.cleanup()
+
+    async def halt(self):
+        self._halt_requested = True
+        if self._fetcher is not None:
+            self._fetcher.stop()
+        await super().halt()
 
-    def slices(self):
-        segments = []
-        for seg in self._segments.values():
-            segments.append(seg)
-            if seg.hole:
-                yield IngestTimeSlice(timeline=self, segments=segments)
-                segments = []
-        if len(segments):
-            yield IngestTimeSlice(timeline=self, segments=segments)
 
+class IngestDriftEstimator:
+    SAVE_PERIOD = 60
 
-class IngestSegment:
-    @staticmethod
-    def fromFileName(filename):
-        basename = os.path.basename(filename)
-        m = re.match(SEGMENT_PATTERN, basename)
-        if not m:
-            raise AssertionError(f'cannot parse segment filename: {basename!r}')
-        begin = datetime.strptime(m.group(1), SEGMENT_DATETIME_FORMAT)
-        duration = timedelta(seconds=float(m.group(2)))
-        if m.group(3):
-            hole = True
-            L = len(m.group(3))
-            basename = basename[:-L]
-            filename = filename[:-L]
-        else:
-            hole = False
-        return IngestSegment(filename=filename, basename=basename, begin=begin, duration=duration,
-            hole=hole)
-
-    def __init__(self, *,filename, basename, begin, duration, inpoint=None, outpoint=None, hole=False):
-        self.filename = filename
-        self.basename = basename
-        self.begin = begin
-        self.duration = duration
-        self.inpoint = inpoint
-        self.outpoint = outpoint
-        self.hole = hole
+    def __init__(self, *, alpha=None, outlier=None, filename=None, persistent=True):
+        conf = config.Config()
+        self._alpha = conf.INGEST_DRIFT_ALPHA if alpha is None else alpha
+        self._outlier = timedelta(seconds=conf.INGEST_DRIFT_OUTLIER if outlier is None else outlier)
+        if filename is None:
+            filename = f'{conf.INGEST_DATADIR}/{DRIFT_FILENAME}'
+        self._filename = filename
+        self._persistent = persistent
+        self._value = None
+        self._primed = False
+        self._outliers = collections.deque(maxlen=3)
+        self._number_of_samples = 0
+        self._save_time = None
 
     @property
-    def end(self):
-        return self.begin + self.duration
+    def value(self):
+        if self._value is None:
+            return timedelta(seconds=0)
+        return self._value
 
     @property
-    def effective_duration(self):
-        duration = self.duration
-        if self.inpoint is None:
-            inpoint = timedelta(seconds=0)
-        else:
-            inpoint = self.inpoint
-        if self.outpoint is None:
-            outpoint = duration
+    def number_of_samples(self):
+        return self._number_of_samples
+
+    def load(self):
+        if not self._persistent:
+            return
+        try:
+            with open(self._filename, 'r') as f:
+                d = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        self._value = timedelta(seconds=d['drift'])
+
+    def save(self):
+        if self._value is None or not self._persistent:
+            return
+        d = dict(
+            drift = self._value.total_seconds(),
+            updated = datetime.now().astimezone().isoformat(),
+        )
+        tmp_filename = f'{self._filename}.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(json.dumps(d))
+        os.rename(tmp_filename, self._filename)
+        self._save_time = time.monotonic()
+
+    def update(self, drift):
+        self._number_of_samples += 1
+        if self._value is None or not self._primed:
+            if self._value is None or abs(drift - self._value) > self._outlier:
+                self._value = drift
+            self._primed = True
+        elif abs(drift - self._value) > self._outlier:
+            self._outliers.append(drift)
+            if len(self._outliers) < self._outliers.maxlen:
+                return self._value
+            self._value = sorted(self._outliers)[len(self._outliers) // 2]
+            self._outliers.clear()
         else:
-            outpoint = self.outpoint
-        return outpoint - inpoint
+            self._outliers.clear()
+            self._value += (drift - self._value) * self._alpha
+        if self._save_time is None or (time.monotonic() - self._save_time) >= self.SAVE_PERIOD:
+            self.save()
+        return self._value
 
-    def __repr__(self):
-        s = f'<{self.__class__.__name__} at {hex(id(self))}'
-        for k,v in self.__dict__.items():
-            s += f' {k}={v!r}'
-        s += '>'
-        return s
 
+class IngestSupervisor:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
 
-class IngestTimeSlice:
-    def __init__(self, *, timeline, segments):
-        self._timeline = timeline
-        self._segments = copy.copy(segments)
+    def __init__(self, *, delay_min=None, delay_max=None, jitter=None, breaker_threshold=None,
+            breaker_cooldown=None, rng=None):
+        conf = config.Config()
+        self._delay_min = conf.INGEST_RESTART_DELAY_MIN if delay_min is None else delay_min
+        self._delay_max = conf.INGEST_RESTART_DELAY_MAX if delay_max is None else delay_max
+        self._jitter = conf.INGEST_RESTART_JITTER if jitter is None else jitter
+        self._breaker_threshold = conf.INGEST_CIRCUIT_BREAKER_THRESHOLD if breaker_threshold is None else breaker_threshold
+        self._breaker_cooldown = conf.INGEST_CIRCUIT_BREAKER_COOLDOWN if breaker_cooldown is None else breaker_cooldown
+        self._rng = random.Random() if rng is None else rng
+        self._last_time_to_recover = None
+        self.reset()
 
-    @property
-    def segments(self):
-        return copy.copy(self._segments)
+    def reset(self):
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._outage_start_time = None
+        self._restart_delay = None
 
     @property
-    def begin(self):
-        if len(self._segments) == 0:
-            raise AssertionError
-        first_seg = self._segments[0]
-        return first_seg.begin
+    def state(self):
+        return self._state
 
     @property
-    def end(self):
-        if len(self._segments) == 0:
-            raise AssertionError
-        last_seg = self._segments[-1]
-        return last_seg.begin + last_seg.duration
+    def consecutive_failures(self):
+        return self._consecutive_failures
 
     @property
-    def duration(self):
-        duration = timedelta(seconds=0)
-        for seg in self._segments:
-            duration += seg.duration
-        return duration
+    def restart_delay(self):
+        return self._restart_delay
 
     @property
-    def effective_duration(self):
-        duration = timedelta(seconds=0)
-        for seg in self._segments:
-            duration += seg.effective_duration
-        return duration
-
-    def generateConcatContent(self):
-        s = ''
-        for seg in self._segments:
-            s += f"file '{seg.filename}'\n"
-            if seg.inpoint:
-                s += f'inpoint {seg.inpoint.total_seconds()}\n'
-            if seg.outpoint:
-                s += f'outpoint {seg.outpoint.total_seconds()}\n'
-            s += '\n'
-        return s
-
-    def concatFile(self, *, delete=True):
+    def last_time_to_recover(self):
+        return self._last_time_to_recover
+
+    def onRecordFailed(self, now):
+        if self._outage_start_time is None:
+            self._outage_start_time = now
+        self._consecutive_failures += 1
+        if self._state == self.HALF_OPEN or self._consecutive_failures >= self._breaker_threshold:
+            self._state = self.OPEN
+            delay = self._breaker_cooldown
+        else:
+            delay = self._delay_min * 2 ** (self._consecutive_failures - 1)
+            delay = min(delay, self._delay_max)
+            delay *= 1 - self._jitter * self._rng.random()
+        self._restart_delay = delay
+        return delay
+
+    def onRecordRestarting(self):
+        if self._state == self.OPEN:
+            self._state = self.HALF_OPEN
+
+    def onSegmentFinalized(self, now):
+        if self._outage_start_time is not None:
+            self._last_time_to_recover = (now - self._outage_start_time).total_seconds()
+            logger.info(f"recording recovered in {self._last_time_to_recover:.1f}s "
+                f"after {self._consecutive_failures} failure(s)")
+        self.reset()
+
+
+class IngestTimeLineService:
+    SEGMENT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def __init__(self, *, http_service, ingest_service):
+        conf = config.Config()
+        self._ingest_service = ingest_service
+        self._timelines = {}
+        self._segment_files = http.FileServer(conf.INGEST_DATADIR, cache_control=self.SEGMENT_CACHE_CONTROL)
+        http_service.addDecoratedRoutes(self)
+
+    @staticmethod
+    def errorResponse(status, msg):
+        return web.json_response({'error': msg}, status=status)
+
+    def getCacheKey(self, index, name):
         conf = config.Config()
-        tl = self._timeline
-        f = tempfile.NamedTemporaryFile(dir=f"{conf.INGEST_DATADIR}/tmp/", prefix=f'{tl.name}_', suffix=".concat", mode='w', delete=delete)
-        content = self.generateConcatContent()
-        f.write(content)
-        f.flush()
-        return f
-
-
-TLTOOL_ACTIONS = {}
-
-
-def TLtool_action(*names):
-    def inner(obj):
-        for n in names:
-            TLTOOL_ACTIONS[n]=obj
-    return inner
-
-
-class IngestTimeLineTool:
-    class ArgumentParser(argparse.ArgumentParser):
-        def __init__(self):
-            actions = '|'.join(TLTOOL_ACTIONS)
-            super().__init__(usage=f'%(prog)s <{actions}> [timeline-names] <options>')
-            self.add_argument('-d','--duration', dest='duration', default="0s", help="set timeline duration")
-            self.add_argument('-s','--slice-index', dest='slice_index', default=None, type=int, help="set slice index")
-
-        def parse_args(self, args):
-            prog = args[0]
-            ns,args = super().parse_known_args(args[1:])
-            ns.prog = prog
-            ns.action = None
-            ns.largs = []
-            ns.rargs = []
-            xargs = ns.largs
-            for a in args:
-                if ns.action is None:
-                    if a not in TLTOOL_ACTIONS:
-                        self.error(f'invalid action {a!r}')
-                    else:
-                        ns.action = a
-                elif a == '--':
-                    xargs = ns.rargs
-                else:
-                    xargs.append(a)
-            if ns.action is None:
-                self.error('no action secified')
-            return ns
-
-    def __init__(self, args):
-        p = self.ArgumentParser()
-        self._ns = p.parse_args(args)
-        self._argparser = p
-
-    def __call__(self):
-        ns = self._ns
-        f = TLTOOL_ACTIONS[ns.action]
-        f(self)
-
-    @TLtool_action('rm','remove')
-    def remove(self):
-        ns = self._ns
-        for name in ns.largs:
-            self.ensureName(name, 'existing')
-            tl = IngestTimeLine(name=name)
-            tl.remove()
-
-    def getName(self, idx):
-        ns = self._ns
         try:
-            name = ns.largs[idx]
-        except IndexError:
-            self.error('please specify a valid timeline name')
-        return name
-
-    def error(self, msg):
-        self._argparser.error(msg)
-
-    def ensureName(self, name, mode):
-        exists = (name in IngestTimeLine.loadNames()) or (name in IngestTimeLine.PROTECTED_NAMES)
-        if mode not in ('existing', 'not-existing'):
-            raise AssertionError
-        if exists and mode=='not-existing':
-            self.error(f'timeline {name!r} already exists')
-        if not exists and mode=='existing':
-            self.error(f'timeline {name!r} does not exist')
-
-    @TLtool_action('create')
-    def create(self):
-        ns = self._ns
-        name = self.getName(0)
-        self.ensureName(name, 'not-existing')
-        duration = timedelta(seconds=timeparse(ns.duration))
-        begin = None
-        tl = IngestTimeLine(name=name, begin=begin, duration=duration)
-        tl.save()
-
-    @TLtool_action('adv', 'advance')
-    def advance(self):
-        name = self.getName(0)
-        self.ensureName(name, 'existing')
-        tl = IngestTimeLine(name=name)
-        tl.advance()
-        tl.save()
-
-    @TLtool_action('reset')
-    def reset(self):
-        name = self.getName(0)
-        self.ensureName(name, 'existing')
-        tl = IngestTimeLine(name=name)
-        tl.reset()
-        tl.save()
-
-    @TLtool_action('ls','list')
-    def list(self):
-        table = Table()
-        table.add_column("NAME")
-        table.add_column("BEGIN")
-        table.add_column("END")
-        table.add_column("DURATION")
-        table.add_column("NUM_HOLES")
-        for name, tl in IngestTimeLine.loadInstances().items():
-            if tl.duration.total_seconds() == 0:
-                duration = "0s"
+            st = os.stat(f'{conf.INGEST_DATADIR}/timelines/{name}.json')
+            stamp = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        return (id(index), index.revision, stamp)
+
+    def getTimeLine(self, name):
+        index = self._ingest_service.index
+        if index is None:
+            raise LookupError('segment index is not loaded yet')
+        if name not in timeline.IngestTimeLine.PROTECTED_NAMES and name not in timeline.IngestTimeLine.loadNames():
+            raise KeyError(name)
+        key = self.getCacheKey(index, name)
+        try:
+            cached_key, tl = self._timelines[name]
+            if cached_key == key:
+                return tl
+        except KeyError:
+            pass
+        tl = timeline.IngestTimeLine(name=name, index=index)
+        self._timelines[name] = (key, tl)
+        return tl
+
+    def storeTimeLine(self, tl):
+        self._timelines[tl.name] = (self.getCacheKey(self._ingest_service.index, tl.name), tl)
+
+    async def runWithTimeLine(self, request, f, *, locking=False):
+        name = request.match_info['name']
+        try:
+            timeline.IngestTimeLine.checkName(name)
+            tl = self.getTimeLine(name)
+        except AssertionError as e:
+            return self.errorResponse(400, str(e))
+        except KeyError:
+            return self.errorResponse(404, f'timeline {name!r} does not exist')
+        except LookupError as e:
+            return self.errorResponse(503, str(e))
+        try:
+            if locking:
+                # the timeline state lock may be held by a worker, the segment commits must not wait for it
+                return await asyncio.to_thread(f, tl)
+            return f(tl)
+        except timeline.IngestTimeLineConflictError as e:
+            return self.errorResponse(409, str(e))
+        except AssertionError as e:
+            return self.errorResponse(400, str(e))
+
+    @http_get("/api/timelines")
+    async def handleList(self, request: web.Request) -> web.Response:
+        names = ['glob'] + timeline.IngestTimeLine.loadNames()
+        try:
+            timelines = [self.getTimeLine(name).asDict() for name in names]
+        except LookupError as e:
+            return self.errorResponse(503, str(e))
+        return web.json_response(timelines)
+
+    @http_get("/api/timelines/{name}")
+    async def handleTimeLine(self, request: web.Request) -> web.Response:
+        def f(tl):
+            d = tl.asDict()
+            d['gaps'] = [gap.asDict() for gap in tl.getGaps()]
+            return web.json_response(d)
+        return await self.runWithTimeLine(request, f)
+
+    @http_get("/api/timelines/{name}/slices")
+    async def handleSlices(self, request: web.Request) -> web.Response:
+        def f(tl):
+            return web.json_response([slice.asDict() for slice in tl.slices()])
+        return await self.runWithTimeLine(request, f)
+
+    @http_get("/api/timelines/{name}/lookup")
+    async def handleLookup(self, request: web.Request) -> web.Response:
+        def f(tl):
+            timestamp = timeline.parseTimestamp(request.query.get('timestamp'))
+            try:
+                seg = tl.lookupSegmentFromTimestamp(timestamp)
+            except LookupError:
+                return self.errorResponse(404, f'no segment at {timestamp.isoformat()}')
+            d = seg.asDict()
+            d['offset'] = (timestamp - seg.begin).total_seconds()
+            return web.json_response(d)
+        return await self.runWithTimeLine(request, f)
+
+    @http_get("/api/timelines/{name}/playlist.m3u8")
+    async def handlePlaylist(self, request: web.Request) -> web.Response:
+        def f(tl):
+            query = request.query
+            index = self._ingest_service.index
+            if 'begin' in query or 'end' in query:
+                begin = timeline.parseTimestamp(query['begin']) if 'begin' in query else tl.begin
+                end = timeline.parseTimestamp(query['end']) if 'end' in query else tl.end
+                if end <= begin:
+                    raise AssertionError('end must be after begin')
+                tl = timeline.IngestTimeLine(name=tl.name, begin=begin, duration=end - begin, load=False, index=index)
+            if 'slice' in query:
+                try:
+                    slice = list(tl.slices())[int(query['slice'])]
+                except ValueError:
+                    raise AssertionError('please specify a valid slice index')
+                except IndexError:
+                    return self.errorResponse(404, f"no slice #{query['slice']}")
+            else:
+                slice = timeline.IngestTimeSlice(timeline=tl, segments=list(tl.segments.values()))
+            if len(slice.segments) == 0:
+                return self.errorResponse(404, 'no segment')
+            text = slice.generatePlaylist(url_prefix='/api/segments/')
+            etag = f'"{hashlib.sha1(text.encode()).hexdigest()[:16]}"'
+            if tl.end <= index.last_segment.end:
+                cache_control = 'public, max-age=3600'
             else:
-                duration = str(tl.duration)
-            table.add_row(name, tl.begin.isoformat(), tl.end.isoformat(), duration, f'{tl.getNumberOfHoles()}')
-        print(table)
-
-    @TLtool_action('sl','slices')
-    def slices(self):
-        table = Table()
-        headers = ["SLICE_ID/SEGMENT_BASENAME", "INPOINT", "OUTPOINT", "EFFECTIVE_DURATION"]
-        for hdr in headers:
-            table.add_column(hdr)
-        seprator = [''] * len(headers)
-        name = self.getName(0)
-        self.ensureName(name, 'existing')
-        tl = IngestTimeLine(name=name)
-        for i,slice in enumerate(tl.slices()):
-            table.add_row(*seprator)
-            table.add_row(f'[cyan]slice #{i}[/cyan]','','',f'[cyan]{slice.effective_duration}[/cyan]')
-            for seg in slice.segments:
-                table.add_row(seg.basename,f'{seg.inpoint}',f'{seg.outpoint}',f'{seg.effective_duration}')
-        print()
-        print(table)
-
-    @TLtool_action('concat')
-    def concat(self):
-        ns = self._ns
-        name = self.getName(0)
-        self.ensureName(name, 'existing')
-        tl = IngestTimeLine(name=name)
-        slice = list(tl.slices())[ns.slice_index]
-        content = slice.generateConcatContent()
-        print(content)
+                cache_control = 'no-cache'
+            headers = {'Cache-Control': cache_control, 'ETag': etag}
+            if request.headers.get('If-None-Match') == etag:
+                return web.Response(status=304, headers=headers)
+            return web.Response(text=text, content_type='application/vnd.apple.mpegurl', headers=headers)
+        return await self.runWithTimeLine(request, f)
+
+    @http_get("/api/segments/{basename}")
+    async def handleSegment(self, request: web.Request) -> web.StreamResponse:
+        basename = request.match_info['basename']
+        index = self._ingest_service.index
+        if index is None:
+            return self.errorResponse(503, 'segment index is not loaded yet')
+        try:
+            if not re.fullmatch(timeline.SEGMENT_PATTERN, basename) or basename.endswith('.hole'):
+                raise AssertionError
+            seg = index.getSegment(timeline.IngestSegment.fromFileName(basename).begin)
+            if seg.basename != basename:
+                raise LookupError
+        except (AssertionError, LookupError):
+            return self.errorResponse(404, f'no segment {basename!r}')
+        return await self._segment_files.serve(request, seg.basename, content_type='video/mp2t')
+
+    @http_post("/api/timelines/{name}/advance")
+    async def handleAdvance(self, request: web.Request) -> web.Response:
+        def f(tl):
+            if tl.name in timeline.IngestTimeLine.PROTECTED_NAMES:
+                raise AssertionError(f'timeline {tl.name!r} cannot be altered')
+            tl.compareAndAdvance()
+            self.storeTimeLine(tl)
+            return web.json_response(tl.asDict())
+        return await self.runWithTimeLine(request, f, locking=True)
+
+    @http_post("/api/timelines/{name}/reset")
+    async def handleReset(self, request: web.Request) -> web.Response:
+        def f(tl):
+            if tl.name in timeline.IngestTimeLine.PROTECTED_NAMES:
+                raise AssertionError(f'timeline {tl.name!r} cannot be altered')
+            tl.reset()
+            tl.save()
+            self.storeTimeLine(tl)
+            return web.json_response(tl.asDict())
+        return await self.runWithTimeLine(request, f, locking=True)
+
+    @http_post("/api/timelines/{name}/claim")
+    async def handleClaim(self, request: web.Request) -> web.Response:
+        def f(tl):
+            claimed = timeline.IngestTimeLine.claim(tl.name, index=self._ingest_service.index)
+            self._timelines.pop(tl.name, None)
+            d = claimed.asDict()
+            d['slices'] = [slice.asDict() for slice in claimed.slices()]
+            return web.json_response(d)
+        return await self.runWithTimeLine(request, f, locking=True)
+
+
+class IngestSearchService:
+    MAX_LIMIT = 200
+
+    def __init__(self, *, http_service, search_index=None):
+        self._search_index = search.IngestSearchIndex() if search_index is None else search_index
+        http_service.addDecoratedRoutes(self)
+
+    @http_get("/api/search")
+    async def handleSearch(self, request: web.Request) -> web.Response:
+        query = request.query
+        try:
+            begin = timeline.parseTimestamp(query['begin']) if 'begin' in query else None
+            end = timeline.parseTimestamp(query['end']) if 'end' in query else None
+            try:
+                limit = int(query.get('limit', search.IngestSearchIndex.LIMIT))
+            except ValueError:
+                raise AssertionError('please specify a valid limit')
+            if not 0 < limit <= self.MAX_LIMIT:
+                raise AssertionError(f'limit must be between 1 and {self.MAX_LIMIT}')
+            records = await asyncio.to_thread(self._search_index.search, query.get('q', ''), begin=begin,
+                end=end, types=query.getall('type', None), limit=limit)
+        except AssertionError as e:
+            return IngestTimeLineService.errorResponse(400, str(e))
+        return web.json_response([record.asDict() for record in records])
@@ -0,0 +1,235 @@
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+from datetime import datetime, timedelta
+from loguru import logger
+from cablewatch import config, scheduler, timeline
+
+
+JOBS_FILENAME = 'jobs.sqlite'
+
+
+class IngestJobLostError(AssertionError):
+    pass
+
+
+class IngestJob:
+    def __init__(self, *, id, timeline, begin, duration, worker, attempts, state=None, error=None):
+        self.id = id
+        self.timeline = timeline
+        self.begin = begin
+        self.duration = duration
+        self.worker = worker
+        self.attempts = attempts
+        self.state = state
+        self.error = error
+
+    @property
+    def end(self):
+        return self.begin + self.duration
+
+    def getTimeLine(self, index=None):
+        return timeline.IngestTimeLine(name=self.timeline, begin=self.begin, duration=self.duration, load=False,
+            index=index)
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestJobQueue:
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = (PENDING, LEASED, DONE, FAILED)
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            timeline TEXT NOT NULL,
+            begin TEXT NOT NULL,
+            duration REAL NOT NULL,
+            state TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            UNIQUE (timeline, begin)
+        )
+    """
+
+    def __init__(self, filename=None, *, lease_timeout=None, max_attempts=None):
+        conf = config.Config()
+        if filename is None:
+            filename = f'{conf.INGEST_DATADIR}/{JOBS_FILENAME}'
+        self._filename = filename
+        self._lease_timeout = conf.INGEST_JOBS_LEASE_TIMEOUT if lease_timeout is None else lease_timeout
+        self._max_attempts = conf.INGEST_JOBS_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        with self.transaction() as db:
+            db.execute(self.SCHEMA)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def lease_timeout(self):
+        return self._lease_timeout
+
+    @contextlib.contextmanager
+    def transaction(self):
+        db = sqlite3.connect(self._filename, timeout=60, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def enqueueAvailable(self, name, index=None):
+        if index is None:
+            index = timeline.IngestIndex.open()
+        last_seg = index.last_segment
+        jobs = []
+        with timeline.IngestTimeLine.locked(name):
+            state = timeline.IngestTimeLine.loadState(name)
+            if state is None:
+                raise AssertionError(f'timeline {name!r} does not exist')
+            begin, duration = state
+            if duration <= timedelta(seconds=0):
+                raise AssertionError(f'timeline {name!r} has no duration')
+            if last_seg is None:
+                return jobs
+            with self.transaction() as db:
+                while begin + duration <= last_seg.end:
+                    db.execute('INSERT OR IGNORE INTO jobs (timeline, begin, duration, state) VALUES (?, ?, ?, ?)',
+                        (name, begin.isoformat(), duration.total_seconds(), self.PENDING))
+                    jobs.append((begin, duration))
+                    begin += duration
+            if len(jobs) > 0:
+                tl = timeline.IngestTimeLine(name=name, begin=begin, duration=duration, load=False, index=index)
+                tl.writeState()
+        return jobs
+
+    def lease(self, name, worker):
+        now = time.time()
+        with self.transaction() as db:
+            while True:
+                row = db.execute("""
+                    SELECT id, begin, duration, attempts FROM jobs
+                    WHERE timeline = ? AND (state = ? OR (state = ? AND lease_expires < ?))
+                    ORDER BY begin LIMIT 1
+                """, (name, self.PENDING, self.LEASED, now)).fetchone()
+                if row is None:
+                    return None
+                id, begin, duration, attempts = row
+                if attempts < self._max_attempts:
+                    break
+                db.execute('UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, error = ? WHERE id = ?',
+                    (self.FAILED, 'lease expired', id))
+            db.execute('UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = ? WHERE id = ?',
+                (self.LEASED, worker, now + self._lease_timeout, attempts + 1, id))
+        return IngestJob(id=id, timeline=name, begin=datetime.fromisoformat(begin),
+            duration=timedelta(seconds=duration), worker=worker, attempts=attempts + 1, state=self.LEASED)
+
+    def updateLeasedJob(self, job, query, args):
+        with self.transaction() as db:
+            cursor = db.execute(query + ' WHERE id = ? AND worker = ? AND state = ?',
+                args + (job.id, job.worker, self.LEASED))
+            if cursor.rowcount == 0:
+                raise IngestJobLostError(f'lease of job #{job.id} lost by {job.worker!r}')
+
+    def heartbeat(self, job):
+        self.updateLeasedJob(job, 'UPDATE jobs SET lease_expires = ?', (time.time() + self._lease_timeout,))
+
+    def complete(self, job):
+        self.updateLeasedJob(job, 'UPDATE jobs SET state = ?, lease_expires = NULL, error = NULL', (self.DONE,))
+
+    def fail(self, job, error):
+        if job.attempts >= self._max_attempts:
+            state = self.FAILED
+        else:
+            state = self.PENDING
+        self.updateLeasedJob(job, 'UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, error = ?',
+            (state, error))
+        return state
+
+    def getStats(self, name):
+        stats = dict.fromkeys(self.STATES, 0)
+        with self.transaction() as db:
+            for state, count in db.execute('SELECT state, COUNT(*) FROM jobs WHERE timeline = ? GROUP BY state', (name,)):
+                stats[state] = count
+        return stats
+
+    def getJobs(self, name, state=None):
+        query = 'SELECT id, begin, duration, worker, attempts, state, error FROM jobs WHERE timeline = ?'
+        args = (name,)
+        if state is not None:
+            query += ' AND state = ?'
+            args += (state,)
+        query += ' ORDER BY begin'
+        with self.transaction() as db:
+            rows = db.execute(query, args).fetchall()
+        jobs = []
+        for id, begin, duration, worker, attempts, state, error in rows:
+            jobs.append(IngestJob(id=id, timeline=name, begin=datetime.fromisoformat(begin),
+                duration=timedelta(seconds=duration), worker=worker, attempts=attempts, state=state, error=error))
+        return jobs
+
+    def runHeartbeat(self, job, stop_event, period):
+        while not stop_event.wait(period):
+            try:
+                self.heartbeat(job)
+            except IngestJobLostError as e:
+                logger.warning(str(e))
+                return
+
+    def work(self, name, func, *, worker=None, heartbeat_period=None, gate=None):
+        if worker is None:
+            worker = f'{os.uname().nodename}:{os.getpid()}'
+        if heartbeat_period is None:
+            heartbeat_period = self._lease_timeout / 3
+        if gate is None:
+            gate = scheduler.IngestHealthGate()
+        index = timeline.IngestIndex.open()
+        number_of_jobs = 0
+        while True:
+            # no new window while the local ingest falls behind
+            gate.wait()
+            # the windows finalized by the ingest since the last lease, only the new index entries are read
+            index.refresh()
+            self.enqueueAvailable(name, index)
+            job = self.lease(name, worker)
+            if job is None:
+                return number_of_jobs
+            logger.info(f'{worker} processes {name!r} window {job.begin} (attempt #{job.attempts})')
+            stop_event = threading.Event()
+            thread = threading.Thread(target=self.runHeartbeat, args=(job, stop_event, heartbeat_period), daemon=True)
+            thread.start()
+            try:
+                func(job)
+            except Exception as e:
+                error = e
+            else:
+                error = None
+            stop_event.set()
+            thread.join()
+            try:
+                if error is None:
+                    self.complete(job)
+                else:
+                    state = self.fail(job, repr(error))
+                    logger.error(f'{worker} failed {name!r} window {job.begin} ({error!r}), job is now {state}')
+            except IngestJobLostError as e:
+                logger.warning(str(e))
+            number_of_jobs += 1
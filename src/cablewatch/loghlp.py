@@ -1,8 +1,21 @@
+import os
+import re
+import sys
+import json
+import time
+import glob
+import queue
 import logging
+import threading
+from datetime import datetime, timedelta
 from loguru import logger
 from cablewatch import config
 
 
+_writers = []
+_files = []
+
+
 class InterceptHandler(logging.Handler):
     def emit(self, record):
         try:
@@ -15,7 +28,91 @@ class InterceptHandler(logging.Handler):
         )
 
 
-def setup():
+class IngestLogFile:
+    def __init__(self, dirname, *, rotation_hour=7, retention_days=100):
+        self._dirname = dirname
+        self._rotation_hour = rotation_hour
+        self._retention = timedelta(days=retention_days)
+        self._f = None
+        self._next_rotation = None
+
+    @property
+    def filename(self):
+        return None if self._f is None else self._f.name
+
+    def open(self, now):
+        if self._f is not None:
+            self._f.close()
+        os.makedirs(self._dirname, exist_ok=True)
+        self._f = open(f"{self._dirname}/ingest_{now.strftime('%Y-%m-%d_%Hh%M')}.log", 'a')
+        self._next_rotation = now.replace(hour=self._rotation_hour, minute=0, second=0, microsecond=0)
+        if self._next_rotation <= now:
+            self._next_rotation += timedelta(days=1)
+        for filename in glob.glob(f'{self._dirname}/ingest_*.log'):
+            if datetime.fromtimestamp(os.path.getmtime(filename)) < now - self._retention:
+                os.remove(filename)
+
+    def write(self, s):
+        now = datetime.now()
+        if self._f is None or now >= self._next_rotation:
+            self.open(now)
+        self._f.write(s)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class IngestLogWriter:
+    MAX_PENDING = 10000
+
+    def __init__(self, write, flush=None):
+        self._write = write
+        self._flush = flush
+        self._queue = queue.Queue(maxsize=self.MAX_PENDING)
+        self._dropped = 0
+        self._thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def __call__(self, message):
+        try:
+            self._queue.put_nowait(str(message))
+        except queue.Full:
+            # the sink is stuck (terminal, disk), the event loop must not wait for it
+            self._dropped += 1
+
+    def run(self):
+        while True:
+            s = self._queue.get()
+            if s is None:
+                break
+            self._write(s)
+            if self._queue.empty():
+                if self._dropped > 0:
+                    dropped, self._dropped = self._dropped, 0
+                    self._write(f'{datetime.now():%H:%M:%S} WARNING {dropped} log line(s) dropped\n')
+                if self._flush is not None:
+                    self._flush()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def writeConsole(s):
+    sys.stdout.write(s)
+
+
+def flushConsole():
+    sys.stdout.flush()
+
+
+def setup(*, enqueue=True):
     conf = config.Config()
 
     logging.root.handlers = []
@@ -38,18 +135,147 @@ def setup():
 
     format = "<green>{time:HH:mm:ss}</green> <level>{level}</level> <light-cyan>{name}</light-cyan><cyan>{extra[name]}</cyan> {message}"
 
-    logger.add(
-        lambda msg: print(msg, end=""),
-        level="INFO",
-        colorize=True,
-        format=format,
-    )
-
-    logger.add(
-        f"{conf.LOGS_DIR}/ingest_{{time:YYYY-MM-DD}}_{{time:HH}}h{{time:mm}}.log",
-        rotation="07:00",
-        retention="100 days",
-        level="INFO",
-        colorize=False,
-        format=format,
-    )
+    if not enqueue:
+        logger.add(
+            writeConsole,
+            level="INFO",
+            colorize=True,
+            format=format,
+        )
+
+        logger.add(
+            f"{conf.LOGS_DIR}/ingest_{{time:YYYY-MM-DD}}_{{time:HH}}h{{time:mm}}.log",
+            rotation="07:00",
+            retention="100 days",
+            level="INFO",
+            colorize=False,
+            format=format,
+        )
+        return
+
+    # formatted in the caller, written by background threads
+    log_file = IngestLogFile(conf.LOGS_DIR)
+    for writer, colorize in (
+        (IngestLogWriter(writeConsole, flushConsole), True),
+        (IngestLogWriter(log_file.write, log_file.flush), False),
+    ):
+        _writers.append(writer)
+        logger.add(
+            writer,
+            level="INFO",
+            colorize=colorize,
+            format=format,
+        )
+    _files.append(log_file)
+
+
+async def shutdown():
+    await logger.complete()
+    logger.remove()
+    while len(_writers) > 0:
+        _writers.pop().stop()
+    while len(_files) > 0:
+        _files.pop().close()
+
+
+class IngestLogSampler:
+    NUMBER_PATTERN = re.compile(r'0x[0-9a-fA-F]+|\d+')
+
+    def __init__(self, *, period=None, burst=None, clock=time.monotonic):
+        conf = config.Config()
+        self._period = conf.INGEST_LOG_SAMPLING_PERIOD if period is None else period
+        self._burst = conf.INGEST_LOG_SAMPLING_BURST if burst is None else burst
+        self._clock = clock
+        # key -> [window start, number of lines, last suppressed line]
+        self._windows = {}
+        self._last_expire = clock()
+        self.number_of_suppressed_lines = 0
+
+    def getKey(self, line):
+        return self.NUMBER_PATTERN.sub('#', line)
+
+    def formatSummary(self, count, line):
+        return f'suppressed {count} similar line(s) in {self._period:g}s, last: {line}'
+
+    def expire(self, now):
+        summaries = []
+        for key, (start, count, line) in list(self._windows.items()):
+            if now - start < self._period:
+                continue
+            if count > self._burst:
+                summaries.append(self.formatSummary(count - self._burst, line))
+            del self._windows[key]
+        self._last_expire = now
+        return summaries
+
+    def sample(self, line):
+        now = self._clock()
+        lines = []
+        if now - self._last_expire >= self._period:
+            lines += self.expire(now)
+        key = self.getKey(line)
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self._period:
+            if window is not None and window[1] > self._burst:
+                lines.append(self.formatSummary(window[1] - self._burst, window[2]))
+            window = self._windows[key] = [now, 0, None]
+        window[1] += 1
+        if window[1] <= self._burst:
+            lines.append(line)
+        else:
+            window[2] = line
+            self.number_of_suppressed_lines += 1
+        return lines
+
+    def flush(self):
+        return self.expire(float('inf'))
+
+
+class IngestCommandCapture:
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, *, name, command, dirname=None, retention=None):
+        conf = config.Config()
+        self._dirname = conf.INGEST_CAPTURE_DIR if dirname is None else dirname
+        self._retention = conf.INGEST_CAPTURE_RETENTION if retention is None else retention
+        os.makedirs(self._dirname, exist_ok=True)
+        start_time = datetime.now()
+        self._filename = f"{self._dirname}/{start_time.strftime('%Y-%m-%dT%Hh%Mm%S.%f')}_{name}.jsonl"
+        self._f = open(self._filename, 'w', buffering=self.BUFFER_SIZE)
+        self._t0 = time.monotonic()
+        self._f.write(json.dumps(dict(name=name, command=command, start_time=start_time.isoformat())) + '\n')
+        self.cleanup()
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def cleanup(self):
+        filenames = sorted(glob.glob(f'{self._dirname}/*.jsonl'))
+        for filename in filenames[:max(0, len(filenames) - self._retention)]:
+            os.remove(filename)
+
+    def write(self, line):
+        # one [seconds since start, line] array per line, flushed when the buffer is full
+        self._f.write(json.dumps([round(time.monotonic() - self._t0, 3), line], ensure_ascii=False) + '\n')
+
+    def close(self, returncode=None):
+        if self._f is None:
+            return
+        self._f.write(json.dumps(dict(returncode=returncode, duration=round(time.monotonic() - self._t0, 3))) + '\n')
+        self._f.close()
+        self._f = None
+
+    @staticmethod
+    def read(filename):
+        with open(filename, 'r') as f:
+            header = json.loads(f.readline())
+            lines = []
+            footer = None
+            for ln in f:
+                d = json.loads(ln)
+                if isinstance(d, dict):
+                    footer = d
+                else:
+                    lines.append(tuple(d))
+        return header, lines, footer
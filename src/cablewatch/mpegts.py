@@ -0,0 +1,282 @@
+import os
+import mmap
+from datetime import timedelta
+
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1fff
+PTS_CLOCK = 90000
+PTS_MODULO = 1 << 33
+
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1b, 0x24}
+AUDIO_STREAM_TYPES = {0x03, 0x04, 0x0f, 0x11, 0x81, 0x87}
+
+# PES stream ids without the optional PES header
+PES_STREAM_IDS_WITHOUT_HEADER = {0xbc, 0xbe, 0xbf, 0xf0, 0xf1, 0xf2, 0xf8, 0xff}
+
+
+def parseTimestamp(b, i):
+    return ((b[i] >> 1) & 0x07) << 30 | b[i + 1] << 22 | (b[i + 2] >> 1) << 15 | b[i + 3] << 7 | b[i + 4] >> 1
+
+
+def getPTSDelta(pts, origin):
+    return (pts - origin) % PTS_MODULO
+
+
+def getSignedPTSDelta(pts, origin):
+    delta = getPTSDelta(pts, origin)
+    if delta >= PTS_MODULO // 2:
+        delta -= PTS_MODULO
+    return delta
+
+
+class IngestPESPacket:
+    def __init__(self, *, pid, stream_id, pts, dts, chunks, timestamp=None):
+        self.pid = pid
+        self.stream_id = stream_id
+        self.pts = pts
+        self.dts = dts
+        self.chunks = chunks
+        self.timestamp = timestamp
+
+    @property
+    def size(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    @property
+    def data(self):
+        return b''.join(self.chunks)
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            if k == 'chunks':
+                k, v = 'size', self.size
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestTSDemuxer:
+    # payloads are memoryviews of the mapped file, they must be released before close()
+    @classmethod
+    def fromSegment(cls, seg):
+        return cls(seg.filename, segment=seg)
+
+    def __init__(self, filename, *, segment=None):
+        self._filename = filename
+        self._segment = segment
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self._mmap = None
+                self._view = memoryview(b'')
+            else:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+        try:
+            self._start = self.findSync()
+        except AssertionError:
+            self.close()
+            raise
+        self._number_of_packets = (len(self._view) - self._start) // PACKET_SIZE
+        self._streams = None
+        self._origin = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._view.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # some payloads are still referenced, the mapping is released with them
+                pass
+            self._mmap = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def number_of_packets(self):
+        return self._number_of_packets
+
+    def findSync(self):
+        view = self._view
+        for start in range(min(PACKET_SIZE, len(view))):
+            if all(view[offset] == SYNC_BYTE for offset in range(start, min(len(view), start + 3 * PACKET_SIZE), PACKET_SIZE)):
+                return start
+        if len(view) > 0:
+            raise AssertionError(f'no MPEG-TS sync byte found in {self._filename!r}')
+        return 0
+
+    def iterPackets(self, pids=None, *, reverse=False):
+        view = self._view
+        offsets = range(self._start, self._start + self._number_of_packets * PACKET_SIZE, PACKET_SIZE)
+        if reverse:
+            offsets = reversed(offsets)
+        for offset in offsets:
+            if view[offset] != SYNC_BYTE:
+                raise AssertionError(f'lost sync at offset {offset} of {self._filename!r}')
+            b1 = view[offset + 1]
+            pid = (b1 & 0x1f) << 8 | view[offset + 2]
+            if pids is not None and pid not in pids:
+                continue
+            afc = view[offset + 3] & 0x30
+            if b1 & 0x80 or not afc & 0x10:
+                continue
+            payload_offset = offset + 4
+            if afc & 0x20:
+                payload_offset += 1 + view[offset + 4]
+            end = offset + PACKET_SIZE
+            if payload_offset < end:
+                yield pid, bool(b1 & 0x40), view[payload_offset:end]
+
+    def readSection(self, pid):
+        for _, pusi, payload in self.iterPackets({pid}):
+            if not pusi:
+                continue
+            section = payload[1 + payload[0]:]
+            length = (section[1] & 0x0f) << 8 | section[2]
+            if 3 + length > len(section):
+                raise AssertionError(f'PSI section of PID {pid} spans several packets in {self._filename!r}')
+            # without the trailing CRC
+            return section[:3 + length - 4]
+        return None
+
+    def getStreams(self):
+        if self._streams is not None:
+            return self._streams
+        streams = {}
+        pat = self.readSection(PAT_PID)
+        pmt_pids = []
+        if pat is not None:
+            for i in range(8, len(pat), 4):
+                program_number = pat[i] << 8 | pat[i + 1]
+                if program_number != 0:
+                    pmt_pids.append((pat[i + 2] & 0x1f) << 8 | pat[i + 3])
+        for pmt_pid in pmt_pids:
+            pmt = self.readSection(pmt_pid)
+            if pmt is None:
+                continue
+            i = 12 + ((pmt[10] & 0x0f) << 8 | pmt[11])
+            while i + 5 <= len(pmt):
+                streams[(pmt[i + 1] & 0x1f) << 8 | pmt[i + 2]] = pmt[i]
+                i += 5 + ((pmt[i + 3] & 0x0f) << 8 | pmt[i + 4])
+        self._streams = streams
+        return streams
+
+    def getAudioPIDs(self):
+        return [pid for pid, stream_type in self.getStreams().items() if stream_type in AUDIO_STREAM_TYPES]
+
+    def getVideoPIDs(self):
+        return [pid for pid, stream_type in self.getStreams().items() if stream_type in VIDEO_STREAM_TYPES]
+
+    def getDefaultPID(self):
+        pids = self.getAudioPIDs() or self.getVideoPIDs()
+        if len(pids) == 0:
+            raise LookupError(f'no audio nor video stream in {self._filename!r}')
+        return pids[0]
+
+    def parsePESHeader(self, payload):
+        if len(payload) < 6 or payload[0] != 0 or payload[1] != 0 or payload[2] != 1:
+            return None
+        stream_id = payload[3]
+        if stream_id in PES_STREAM_IDS_WITHOUT_HEADER:
+            return stream_id, None, None, payload[6:]
+        flags = payload[7]
+        header_end = 9 + payload[8]
+        if header_end > len(payload):
+            raise AssertionError(f'PES header spans several packets in {self._filename!r}')
+        pts = dts = None
+        if flags & 0x80:
+            pts = dts = parseTimestamp(payload, 9)
+        if flags & 0x40:
+            dts = parseTimestamp(payload, 14)
+        return stream_id, pts, dts, payload[header_end:]
+
+    def iterPES(self, pid=None, *, begin=None, end=None):
+        if pid is None:
+            pid = self.getDefaultPID()
+        if (begin is not None or end is not None) and self._segment is None:
+            raise AssertionError('a segment is required to filter PES packets by time')
+        pes = None
+        for _, pusi, payload in self.iterPackets({pid}):
+            if pusi:
+                if pes is not None:
+                    if self.setTimestamp(pes, begin, end):
+                        yield pes
+                    pes = None
+                header = self.parsePESHeader(payload)
+                if header is not None:
+                    stream_id, pts, dts, payload = header
+                    pes = IngestPESPacket(pid=pid, stream_id=stream_id, pts=pts, dts=dts, chunks=[payload])
+            elif pes is not None:
+                pes.chunks.append(payload)
+        if pes is not None and self.setTimestamp(pes, begin, end):
+            yield pes
+
+    def setTimestamp(self, pes, begin, end):
+        if self._segment is None or pes.pts is None:
+            return begin is None and end is None
+        pes.timestamp = self._segment.begin + timedelta(seconds=getPTSDelta(pes.pts, self.getOrigin()) / PTS_CLOCK)
+        if begin is not None and pes.timestamp < begin:
+            return False
+        if end is not None and pes.timestamp >= end:
+            return False
+        return True
+
+    def getFirstPTS(self, pid=None):
+        if pid is None:
+            pid = self.getDefaultPID()
+        for _, pusi, payload in self.iterPackets({pid}):
+            if pusi:
+                header = self.parsePESHeader(payload)
+                if header is not None and header[1] is not None:
+                    return header[1]
+        return None
+
+    def getLastPTS(self, pid=None):
+        pts = self.getTailPTS(pid, count=1)
+        return pts[0] if len(pts) > 0 else None
+
+    def getTailPTS(self, pid=None, *, count):
+        if pid is None:
+            pid = self.getDefaultPID()
+        pts = []
+        for _, pusi, payload in self.iterPackets({pid}, reverse=True):
+            if pusi:
+                header = self.parsePESHeader(payload)
+                if header is not None and header[1] is not None:
+                    pts.append(header[1])
+                    if len(pts) == count:
+                        break
+        return pts
+
+    def getOrigin(self):
+        if self._origin is None:
+            first = [self.getFirstPTS(pid) for pid in self.getAudioPIDs() + self.getVideoPIDs()]
+            first = [pts for pts in first if pts is not None]
+            if len(first) == 0:
+                raise LookupError(f'no PTS in {self._filename!r}')
+            self._origin = min(first, key=lambda pts: getSignedPTSDelta(pts, first[0]))
+        return self._origin
+
+    def getDuration(self, pid=None, *, lookbehind=16):
+        if pid is None:
+            pid = self.getDefaultPID()
+        first = self.getFirstPTS(pid)
+        if first is None:
+            raise LookupError(f'no PTS for PID {pid}')
+        # the last PES packets in decode order are not in presentation order when there are B-frames
+        last = sorted(getPTSDelta(pts, first) for pts in self.getTailPTS(pid, count=lookbehind))
+        if len(last) < 2:
+            return timedelta(seconds=0)
+        return timedelta(seconds=(2 * last[-1] - last[-2]) / PTS_CLOCK)
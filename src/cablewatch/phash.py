@@ -0,0 +1,228 @@
+import os
+import shlex
+import itertools
+import functools
+import subprocess
+from datetime import timedelta
+import numpy as np
+from cablewatch import config, scheduler, timeline
+from cablewatch.timeline import toMilliseconds
+
+
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+
+@functools.cache
+def getBandMasks(band_bits, radius):
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(band_bits), r):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.uint64)
+
+
+def computeDHash(frames):
+    bits = frames[:, :, 1:] > frames[:, :, :-1]
+    return np.packbits(bits.reshape(len(frames), 64), axis=1).view('>u8').reshape(-1).astype(np.uint64)
+
+
+class IngestRebroadcastMatch:
+    def __init__(self, *, begin, end, shift, score):
+        self.begin = begin
+        self.end = end
+        self.shift = shift
+        self.score = score
+
+    @property
+    def source_begin(self):
+        return self.begin + self.shift
+
+    @property
+    def source_end(self):
+        return self.end + self.shift
+
+    def mapFromSource(self, timestamp):
+        return timestamp - self.shift
+
+    def copyResults(self, search_index):
+        records = []
+        for record in search_index.getRecords(begin=self.source_begin, end=self.source_end):
+            # results overlapping the source bounds are clipped to the rerun
+            record.begin = max(self.mapFromSource(record.begin), self.begin)
+            record.end = min(self.mapFromSource(record.end), self.end)
+            records.append(record)
+        return search_index.addRecords(records)
+
+    def asDict(self):
+        return dict(
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            source_begin = self.source_begin.isoformat(),
+            source_end = self.source_end.isoformat(),
+            shift = self.shift.total_seconds(),
+            score = self.score,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestFrameHashIndex:
+    COMMAND = """
+        ffmpeg -nostdin -loglevel error -i {input}
+          -an -vf fps=1/{period},scale=9:8:flags=area,format=gray
+          -f rawvideo -
+    """
+    PERIOD = 1
+    BANDS = 4
+    MAX_DISTANCE = 8
+    # flat frames (black screens, color bars) match everything
+    MIN_BITS = 4
+
+    def __init__(self, *, dirname=None, period=None, niceness=None):
+        conf = config.Config()
+        self._dirname = conf.INGEST_DERIVATIVES_DIR if dirname is None else dirname
+        self._period = self.PERIOD if period is None else period
+        self._niceness = conf.INGEST_DERIVATIVES_NICENESS if niceness is None else niceness
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._times = np.zeros(0, dtype=np.int64)
+        self._bands = []
+
+    @property
+    def number_of_hashes(self):
+        return len(self._hashes)
+
+    def getFileName(self, seg):
+        return seg.getDerivativeFileName('phash', 'npy', self._dirname)
+
+    def renice(self):
+        scheduler.applyPriority(scheduler.BATCH, self._niceness)
+
+    def computeSegment(self, seg):
+        cmd = ' '.join(self.COMMAND.split()).format(input=shlex.quote(seg.filename), period=self._period)
+        proc = subprocess.run(cmd, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=self.renice)
+        if proc.returncode != 0:
+            raise AssertionError(f'cannot decode frames of {seg.basename!r}: {proc.stderr.decode().strip()}')
+        frame_size = HASH_WIDTH * HASH_HEIGHT
+        frames = np.frombuffer(proc.stdout, dtype=np.uint8)
+        frames = frames[:len(frames) // frame_size * frame_size].reshape(-1, HASH_HEIGHT, HASH_WIDTH)
+        hashes = computeDHash(frames)
+        filename = self.getFileName(seg)
+        os.makedirs(self._dirname, exist_ok=True)
+        with open(f'{filename}.tmp', 'wb') as f:
+            np.save(f, hashes)
+        os.rename(f'{filename}.tmp', filename)
+        return hashes
+
+    def update(self, index=None, begin=None, end=None):
+        if index is None:
+            index = timeline.IngestIndex.open()
+        added = []
+        failed = []
+        for seg in index.getSegments(begin, end).values():
+            if os.path.exists(self.getFileName(seg)):
+                continue
+            try:
+                self.computeSegment(seg)
+            except AssertionError:
+                failed.append(seg)
+                continue
+            added.append(seg)
+        return added, failed
+
+    def loadSegment(self, seg):
+        filename = self.getFileName(seg)
+        if not os.path.exists(filename):
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+        hashes = np.load(filename)
+        times = toMilliseconds(seg.begin) + np.arange(len(hashes), dtype=np.int64) * round(self._period * 1000)
+        return hashes, times
+
+    def load(self, index=None, begin=None, end=None):
+        if index is None:
+            index = timeline.IngestIndex.open()
+        hashes = [np.zeros(0, dtype=np.uint64)]
+        times = [np.zeros(0, dtype=np.int64)]
+        for seg in index.getSegments(begin, end).values():
+            h, t = self.loadSegment(seg)
+            hashes.append(h)
+            times.append(t)
+        hashes = np.concatenate(hashes)
+        times = np.concatenate(times)
+        bits = np.bitwise_count(hashes)
+        informative = (bits >= self.MIN_BITS) & (bits <= 64 - self.MIN_BITS)
+        self._hashes = hashes[informative]
+        self._times = times[informative]
+        # multi-index hashing: two hashes within d bits have at least one 64 / BANDS bits band within d // BANDS
+        # bits, lookup() probes the band values around the query band
+        band_bits = 64 // self.BANDS
+        self._bands = []
+        for b in range(self.BANDS):
+            values = (self._hashes >> np.uint64(b * band_bits)) & np.uint64((1 << band_bits) - 1)
+            order = np.argsort(values, kind='stable')
+            self._bands.append((values[order], order))
+
+    def lookup(self, h, max_distance=None):
+        if max_distance is None:
+            max_distance = self.MAX_DISTANCE
+        h = np.uint64(h)
+        band_bits = 64 // self.BANDS
+        masks = getBandMasks(band_bits, max_distance // self.BANDS)
+        candidates = []
+        for b, (values, order) in enumerate(self._bands):
+            v = (h >> np.uint64(b * band_bits)) & np.uint64((1 << band_bits) - 1)
+            probes = v ^ masks
+            lo = np.searchsorted(values, probes, side='left')
+            hi = np.searchsorted(values, probes, side='right')
+            candidates += [order[i:j] for i, j in zip(lo.tolist(), hi.tolist()) if j > i]
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(candidates))
+        distances = np.bitwise_count(self._hashes[candidates] ^ h)
+        found = distances <= max_distance
+        return self._times[candidates[found]], distances[found]
+
+    def getSliceHashes(self, slice):
+        hashes = [np.zeros(0, dtype=np.uint64)]
+        times = [np.zeros(0, dtype=np.int64)]
+        for seg in slice.segments:
+            h, t = self.loadSegment(seg)
+            first = toMilliseconds(seg.begin + (seg.inpoint or timedelta(seconds=0)))
+            last = toMilliseconds(seg.begin + (seg.duration if seg.outpoint is None else seg.outpoint))
+            keep = (t >= first) & (t < last)
+            hashes.append(h[keep])
+            times.append(t[keep])
+        return np.concatenate(hashes), np.concatenate(times)
+
+    def findRebroadcast(self, slice, *, before=None, max_distance=None, min_score=0.5):
+        if before is None:
+            before = slice.begin
+        before_ms = toMilliseconds(before)
+        hashes, times = self.getSliceHashes(slice)
+        bits = np.bitwise_count(hashes)
+        informative = (bits >= self.MIN_BITS) & (bits <= 64 - self.MIN_BITS)
+        hashes, times = hashes[informative], times[informative]
+        if len(hashes) == 0:
+            return None
+        period_ms = round(self._period * 1000)
+        votes = {}
+        for h, t in zip(hashes, times.tolist()):
+            source_times, _ = self.lookup(h, max_distance)
+            source_times = source_times[source_times < before_ms]
+            # one vote per frame and shift, static scenes match many source frames
+            for shift in set(np.round((source_times - t) / period_ms).astype(np.int64).tolist()):
+                votes[shift] = votes.get(shift, 0) + 1
+        if len(votes) == 0:
+            return None
+        shift = max(votes, key=lambda s: (votes[s] + votes.get(s - 1, 0) + votes.get(s + 1, 0), votes[s]))
+        score = (votes[shift] + votes.get(shift - 1, 0) + votes.get(shift + 1, 0)) / len(hashes)
+        if score < min_score:
+            return None
+        return IngestRebroadcastMatch(begin=slice.begin, end=slice.end, shift=timedelta(milliseconds=shift * period_ms),
+            score=min(score, 1.0))
@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import shlex
+from datetime import datetime, timedelta
+import psutil
+from cablewatch import http, ingest
+
+
+class IngestReplaySource:
+    FFMPEG_ADDR = '0x55d0c0a0f2c0'
+    LATENCY = timedelta(seconds=12)
+    PROGRESS_LINES_PER_SEGMENT = 4
+
+    def __init__(self, *, tmpdir, segment_duration, speed, hours, payload, noise=None, noise_burst=1, begin=None,
+            fps=25):
+        self._tmpdir = tmpdir
+        self._segment_duration = segment_duration
+        self._speed = speed
+        self._hours = hours
+        self._payload = payload
+        self._noise = noise or []
+        self._noise_index = 0
+        self._noise_burst = noise_burst
+        if begin is None:
+            begin = datetime.now().astimezone().replace(microsecond=0)
+        self._begin = begin
+        self._fps = fps
+
+    def emit(self, line, end='\n'):
+        sys.stdout.write(line + end)
+        sys.stdout.flush()
+
+    def emitNoise(self):
+        if len(self._noise) == 0:
+            return
+        for i in range(self._noise_burst):
+            self.emit(self._noise[self._noise_index % len(self._noise)])
+            self._noise_index += 1
+
+    @staticmethod
+    def formatProgramDateTime(dt):
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + dt.strftime('%z')
+
+    def writePlaylist(self, sequence, basename, pdt):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{round(self._segment_duration)}',
+            f'#EXT-X-MEDIA-SEQUENCE:{sequence}',
+            f'#EXTINF:{self._segment_duration:.6f},',
+            f'#EXT-X-PROGRAM-DATE-TIME:{self.formatProgramDateTime(pdt)}',
+            basename,
+        ]
+        # renamed like ffmpeg does, the service may read the playlist while the next one is written
+        with open(f'{self._tmpdir}/output.m3u8.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(f'{self._tmpdir}/output.m3u8.tmp', f'{self._tmpdir}/output.m3u8')
+
+    def run(self):
+        num_segments = round(self._hours * 3600 / self._segment_duration)
+        t0 = time.monotonic()
+        frames = 0
+        for i in range(num_segments):
+            pdt = self._begin + timedelta(seconds=i * self._segment_duration)
+            basename = f'segment_{int(pdt.timestamp())}.ts'
+            self.emit(f"[hls @ {self.FFMPEG_ADDR}] Opening '{self._tmpdir}/{basename}' for writing")
+            with open(f'{self._tmpdir}/{basename}', 'wb') as f:
+                for j in range(self.PROGRESS_LINES_PER_SEGMENT):
+                    f.write(self._payload)
+                    frames += round(self._fps * self._segment_duration / self.PROGRESS_LINES_PER_SEGMENT)
+                    elapsed = timedelta(seconds=frames / self._fps)
+                    self.emit(f'frame={frames:6d} fps={self._fps} q=-1.0 size=N/A time={elapsed} bitrate=N/A speed={self._speed:.0f}x', end='\r')
+                    self.emitNoise()
+            deadline = t0 + (i + 1) * self._segment_duration / self._speed
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = datetime.now().astimezone()
+            self.emit(f"[hls @ {self.FFMPEG_ADDR}] Skip ('#EXT-X-PROGRAM-DATE-TIME:{(now - self.LATENCY).isoformat()}')")
+            self.writePlaylist(i, basename, pdt + self.LATENCY)
+            self.emit(f"[hls @ {self.FFMPEG_ADDR}] Opening '{self._tmpdir}/output.m3u8.tmp' for writing")
+
+    @classmethod
+    def main(cls, args=None):
+        p = argparse.ArgumentParser()
+        p.add_argument('--tmpdir', required=True)
+        p.add_argument('--segment-duration', type=float, default=ingest.SEGMENT_DURATION)
+        p.add_argument('--speed', type=float, default=1.0)
+        p.add_argument('--hours', type=float, default=1.0)
+        p.add_argument('--payload-size', type=int, default=188 * 64)
+        p.add_argument('--ts', default=None, help="recorded MPEG-TS file used as segment payload")
+        p.add_argument('--stderr', default=None, help="recorded command output replayed as noise lines")
+        p.add_argument('--noise-burst', type=int, default=1, help="noise lines emitted with each progress line")
+        p.add_argument('--begin', default=None)
+        ns = p.parse_args(args)
+        if ns.ts is None:
+            payload = b'\x47' + bytes(187)
+            payload = payload * (ns.payload_size // 188 // cls.PROGRESS_LINES_PER_SEGMENT)
+        else:
+            with open(ns.ts, 'rb') as f:
+                payload = f.read()
+        noise = []
+        if ns.stderr is not None:
+            with open(ns.stderr, 'r') as f:
+                for ln in f.read().splitlines():
+                    if "' for writing" not in ln and not ln.startswith('frame='):
+                        noise.append(ln)
+        begin = None if ns.begin is None else datetime.fromisoformat(ns.begin)
+        source = cls(tmpdir=ns.tmpdir, segment_duration=ns.segment_duration, speed=ns.speed, hours=ns.hours,
+            payload=payload, noise=noise, noise_burst=ns.noise_burst, begin=begin)
+        source.run()
+
+
+class IngestReplayBenchmark:
+    LAG_PERIOD = 0.05
+
+    def __init__(self, *, hours=1.0, speed=600.0, segment_duration=None, payload_size=188 * 64, ts_filename=None,
+            stderr_filename=None, noise_burst=1):
+        self._hours = hours
+        self._speed = speed
+        self._segment_duration = ingest.SEGMENT_DURATION if segment_duration is None else segment_duration
+        self._payload_size = payload_size
+        self._ts_filename = ts_filename
+        self._stderr_filename = stderr_filename
+        self._noise_burst = noise_burst
+        self._rename_latencies = []
+        self._loop_lags = []
+
+    @property
+    def number_of_segments(self):
+        return round(self._hours * 3600 / self._segment_duration)
+
+    def command(self):
+        cmd = f'{shlex.quote(sys.executable)} -m cablewatch.replay --tmpdir {{tmpdir}}'
+        cmd += f' --hours {self._hours} --speed {self._speed} --segment-duration {self._segment_duration}'
+        cmd += f' --payload-size {self._payload_size}'
+        if self._ts_filename is not None:
+            cmd += f' --ts {shlex.quote(self._ts_filename)}'
+        if self._stderr_filename is not None:
+            cmd += f' --stderr {shlex.quote(self._stderr_filename)} --noise-burst {self._noise_burst}'
+        return cmd
+
+    async def monitorLoopLag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.LAG_PERIOD)
+            self._loop_lags.append(loop.time() - t - self.LAG_PERIOD)
+
+    def hookService(self, service):
+        commit = service.commitSegment
+
+        def commitSegment(pipeline, tmp_filename, segment_filename):
+            latency = time.time() - os.path.getmtime(tmp_filename)
+            commit(pipeline, tmp_filename, segment_filename)
+            self._rename_latencies.append(latency)
+        service.commitSegment = commitSegment
+
+    @staticmethod
+    def percentile(values, p):
+        if len(values) == 0:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    async def run(self, timeout=None):
+        if timeout is None:
+            timeout = 30 + 3 * self._hours * 3600 / self._speed
+        proc = psutil.Process()
+        service = ingest.IngestService(http_service=http.HTTPService(), command=self.command())
+        self.hookService(service)
+        monitor = asyncio.create_task(self.monitorLoopLag())
+        cpu0 = proc.cpu_times()
+        rss0 = proc.memory_info().rss
+        t0 = time.monotonic()
+        try:
+            await service.start()
+            while len(self._rename_latencies) < self.number_of_segments:
+                if time.monotonic() - t0 > timeout:
+                    break
+                await asyncio.sleep(0.1)
+            duration = time.monotonic() - t0
+            rss1 = proc.memory_info().rss
+            await service.stop()
+        finally:
+            monitor.cancel()
+        cpu1 = proc.cpu_times()
+        service_cpu = (cpu1.user - cpu0.user) + (cpu1.system - cpu0.system)
+        source_cpu = (cpu1.children_user - cpu0.children_user) + (cpu1.children_system - cpu0.children_system)
+        hours = len(self._rename_latencies) * self._segment_duration / 3600
+        report = dict(
+            hours = hours,
+            segments = len(self._rename_latencies),
+            expected_segments = self.number_of_segments,
+            duration = duration,
+            service_cpu = service_cpu,
+            source_cpu = source_cpu,
+            cpu_per_hour = service_cpu / hours if hours > 0 else None,
+            loop_lag_max = max(self._loop_lags, default=None),
+            loop_lag_p99 = self.percentile(self._loop_lags, 0.99),
+            rename_latency_mean = sum(self._rename_latencies) / len(self._rename_latencies) if self._rename_latencies else None,
+            rename_latency_max = max(self._rename_latencies, default=None),
+            rss_start = rss0,
+            rss_end = rss1,
+            rss_growth_per_hour = (rss1 - rss0) / hours if hours > 0 else None,
+        )
+        return report
+
+
+if __name__ == '__main__':
+    IngestReplaySource.main()
@@ -0,0 +1,529 @@
+import os
+import json
+import time
+import heapq
+import signal
+import asyncio
+import platform
+import functools
+import collections
+from loguru import logger
+from cablewatch import config, tracing
+
+
+HEALTH_FILENAME = 'health.json'
+
+OK = 'ok'
+DEGRADED = 'degraded'
+CRITICAL = 'critical'
+
+NORMAL = 'normal'
+BATCH = 'batch'
+PRIORITIES = (NORMAL, BATCH)
+
+IOPRIO_CLASSES = {
+    'none': 0,
+    'realtime': 1,
+    'best-effort': 2,
+    'idle': 3,
+}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {
+    'x86_64': 251,
+    'i686': 289,
+    'aarch64': 30,
+    'riscv64': 30,
+    'armv7l': 314,
+}
+
+
+@functools.cache
+def getSyscall():
+    import ctypes
+    return ctypes.CDLL(None, use_errno=True).syscall
+
+
+def setIOPriority(ioclass, level=0):
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if number is None:
+        return False
+    value = IOPRIO_CLASSES[ioclass] << IOPRIO_CLASS_SHIFT | level
+    return getSyscall()(number, IOPRIO_WHO_PROCESS, 0, value) == 0
+
+
+def getPriorityClass(priority, niceness=None):
+    conf = config.Config()
+    if priority == NORMAL:
+        # lowest level of the default I/O class, the ingest ffmpeg keeps the default level
+        return conf.INGEST_DERIVATIVES_NICENESS if niceness is None else niceness, 'best-effort', 7
+    if priority == BATCH:
+        return conf.INGEST_BATCH_NICENESS if niceness is None else niceness, conf.INGEST_BATCH_IOCLASS, 0
+    raise AssertionError(f'invalid priority: {priority!r}')
+
+
+def applyPriority(priority, niceness=None):
+    niceness, ioclass, level = getPriorityClass(priority, niceness)
+    os.nice(niceness)
+    setIOPriority(ioclass, level)
+
+
+class IngestHealthMonitor:
+    PERIOD = 0.5
+    WRITE_PERIOD = 5.0
+    CRITICAL_FACTOR = 2.0
+
+    def __init__(self, *, window=None, max_loop_lag=None, max_rename_latency=None, max_drift_growth=None,
+            filename=None, clock=time.monotonic):
+        conf = config.Config()
+        self._window = conf.INGEST_HEALTH_WINDOW if window is None else window
+        self._thresholds = dict(
+            loop_lag = conf.INGEST_HEALTH_MAX_LOOP_LAG if max_loop_lag is None else max_loop_lag,
+            rename_latency = conf.INGEST_HEALTH_MAX_RENAME_LATENCY if max_rename_latency is None else max_rename_latency,
+            drift_growth = conf.INGEST_HEALTH_MAX_DRIFT_GROWTH if max_drift_growth is None else max_drift_growth,
+        )
+        if filename is None:
+            filename = f'{conf.INGEST_DATADIR}/{HEALTH_FILENAME}'
+        self._filename = filename
+        self._clock = clock
+        self._samples = {k: collections.deque() for k in self._thresholds}
+        self._task = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def addSample(self, metric, value, now=None):
+        if now is None:
+            now = self._clock()
+        samples = self._samples[metric]
+        samples.append((now, value))
+        while samples[0][0] < now - self._window:
+            samples.popleft()
+
+    def addLoopLag(self, lag, now=None):
+        self.addSample('loop_lag', lag, now)
+
+    def addRenameLatency(self, latency, now=None):
+        self.addSample('rename_latency', latency, now)
+
+    def addDrift(self, drift, now=None):
+        self.addSample('drift_growth', drift, now)
+
+    def getMetrics(self, now=None):
+        if now is None:
+            now = self._clock()
+        metrics = {}
+        for metric, samples in self._samples.items():
+            values = [v for t, v in samples if t >= now - self._window]
+            if len(values) == 0:
+                metrics[metric] = None
+            elif metric == 'drift_growth':
+                # the drift grows when the ingest falls behind the live stream
+                metrics[metric] = max(values[-1] - min(values), 0)
+            else:
+                metrics[metric] = max(values)
+        return metrics
+
+    def getState(self, now=None):
+        state = OK
+        for metric, value in self.getMetrics(now).items():
+            if value is None or value <= self._thresholds[metric]:
+                continue
+            if value > self._thresholds[metric] * self.CRITICAL_FACTOR:
+                return CRITICAL
+            state = DEGRADED
+        return state
+
+    def asDict(self, now=None):
+        return dict(
+            state = self.getState(now),
+            time = time.time(),
+            metrics = self.getMetrics(now),
+            thresholds = self._thresholds,
+        )
+
+    def write(self):
+        d = self.asDict()
+        with open(f'{self._filename}.tmp', 'w') as f:
+            json.dump(d, f)
+        os.rename(f'{self._filename}.tmp', self._filename)
+
+    @staticmethod
+    def read(filename=None, *, max_age=60.0):
+        if filename is None:
+            filename = f'{config.Config().INGEST_DATADIR}/{HEALTH_FILENAME}'
+        try:
+            with open(filename) as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return None
+        # not updated anymore, the ingest service is not running
+        if time.time() - d['time'] > max_age:
+            return None
+        return d
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if os.path.exists(self._filename):
+            os.remove(self._filename)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        write_time = loop.time()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.PERIOD)
+            now = loop.time()
+            self.addLoopLag(max(now - t - self.PERIOD, 0))
+            if now - write_time >= self.WRITE_PERIOD:
+                write_time = now
+                self.write()
+
+
+class IngestHealthGate:
+    POLL_PERIOD = 5.0
+
+    def __init__(self, filename=None, *, poll_period=None):
+        self._filename = filename
+        self._poll_period = self.POLL_PERIOD if poll_period is None else poll_period
+
+    def isPaused(self):
+        d = IngestHealthMonitor.read(self._filename)
+        return d is not None and d['state'] == CRITICAL
+
+    def wait(self):
+        t0 = time.monotonic()
+        if not self.isPaused():
+            return 0
+        logger.warning("ingest falls behind, batch work paused")
+        while self.isPaused():
+            time.sleep(self._poll_period)
+        waited = time.monotonic() - t0
+        logger.info(f"batch work resumed after {waited:.1f}s")
+        return waited
+
+
+class IngestScheduledJob:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUSPENDED = 'suspended'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, *, id, name, command, priority, niceness=None, submit_time=None):
+        self.id = id
+        self.name = name
+        self.command = command
+        self.priority = priority
+        self.niceness = niceness
+        self.state = self.PENDING
+        self.submit_time = submit_time
+        self.start_time = None
+        self.end_time = None
+        self.pid = None
+        self.returncode = None
+        self.stderr = None
+        self.kill_requested = False
+        self._future = asyncio.get_running_loop().create_future()
+
+    @property
+    def rank(self):
+        return (PRIORITIES.index(self.priority), self.id)
+
+    @property
+    def wait_time(self):
+        if self.start_time is None:
+            return None
+        return self.start_time - self.submit_time
+
+    @property
+    def run_time(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    async def wait(self):
+        return await asyncio.shield(self._future)
+
+    def asDict(self):
+        return dict(
+            id = self.id,
+            name = self.name,
+            priority = self.priority,
+            state = self.state,
+            pid = self.pid,
+            wait_time = self.wait_time,
+            run_time = self.run_time,
+            returncode = self.returncode,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            if k.startswith('_'):
+                continue
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestScheduler:
+    # additive increase, multiplicative decrease of the number of concurrent jobs
+    ADJUST_PERIOD = 1.0
+    INCREASE_PERIOD = 10.0
+    DECREASE_PERIOD = 5.0
+    THROUGHPUT_WINDOW = 60.0
+
+    def __init__(self, *, max_jobs=None, health=None, clock=time.monotonic):
+        conf = config.Config()
+        self._max_jobs = conf.INGEST_SCHEDULER_MAX_JOBS if max_jobs is None else max_jobs
+        if self._max_jobs < 1:
+            raise AssertionError(f'invalid number of concurrent jobs: {self._max_jobs!r}')
+        self._health = health
+        self._clock = clock
+        self._budget = self._max_jobs
+        self._change_time = None
+        self._unhealthy_time = None
+        self._pending = []
+        self._running = []
+        self._job_tasks = set()
+        self._number_of_jobs = 0
+        self._task = None
+        self._wakeup = None
+        self._paused_since = None
+        self._paused_time = 0
+        self._completions = collections.deque()
+        self._wait_stats = {p: tracing.IngestStageStats(f'{p}.wait') for p in PRIORITIES}
+        self._run_stats = {p: tracing.IngestStageStats(f'{p}.run') for p in PRIORITIES}
+        self.stats = dict(submitted=0, completed=0, failed=0, cancelled=0, suspensions=0)
+        # resolved before forking, the children only call it
+        getSyscall()
+
+    @property
+    def budget(self):
+        return self._budget
+
+    @property
+    def health_state(self):
+        if self._health is None:
+            return OK
+        return self._health.getState()
+
+    @property
+    def paused(self):
+        return self._paused_since is not None
+
+    @property
+    def number_of_pending(self):
+        return len(self._pending)
+
+    @property
+    def number_of_running(self):
+        return len(self._running)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.runDispatcher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in list(self._running):
+            self.cancel(job)
+        for _, job in list(self._pending):
+            self.cancel(job)
+        if len(self._job_tasks) > 0:
+            await asyncio.wait(self._job_tasks)
+
+    def submit(self, command, *, name=None, priority=NORMAL, niceness=None):
+        if priority not in PRIORITIES:
+            raise AssertionError(f'invalid priority: {priority!r}')
+        self._number_of_jobs += 1
+        job = IngestScheduledJob(id=self._number_of_jobs, name=name or command, command=command, priority=priority,
+            niceness=niceness, submit_time=self._clock())
+        heapq.heappush(self._pending, (job.rank, job))
+        self.stats['submitted'] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def run(self, command, **kwargs):
+        job = self.submit(command, **kwargs)
+        try:
+            return await job.wait()
+        except asyncio.CancelledError:
+            self.cancel(job)
+            raise
+
+    def cancel(self, job):
+        if job.state == job.PENDING:
+            self._pending = [(rank, j) for rank, j in self._pending if j is not job]
+            heapq.heapify(self._pending)
+            self.finish(job, job.CANCELLED)
+        elif job.state in (job.RUNNING, job.SUSPENDED):
+            job.kill_requested = True
+            if job.pid is not None:
+                self.signal(job, signal.SIGKILL)
+
+    def finish(self, job, state):
+        job.state = state
+        job.end_time = self._clock()
+        self.stats[state if state != job.DONE else 'completed'] += 1
+        if job.start_time is not None:
+            self._run_stats[job.priority].add(round(job.run_time * 1e9))
+        if state == job.DONE:
+            self._completions.append(job.end_time)
+        if not job._future.done():
+            job._future.set_result(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def signal(self, job, signum):
+        try:
+            os.killpg(job.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def adjustBudget(self, now=None):
+        if now is None:
+            now = self._clock()
+        state = self.health_state
+        if state != OK:
+            self._unhealthy_time = now
+            if self._budget > 1 and (self._change_time is None or now - self._change_time >= self.DECREASE_PERIOD):
+                self._budget = max(self._budget // 2, 1)
+                self._change_time = now
+                logger.warning(f"ingest health is {state}, run at most {self._budget} job(s)")
+        elif self._budget < self._max_jobs and len(self._running) + len(self._pending) > self._budget:
+            # only grown while jobs wait for a slot, after a healthy period
+            if now - max(self._change_time, self._unhealthy_time) >= self.INCREASE_PERIOD:
+                self._budget += 1
+                self._change_time = now
+                logger.info(f"ingest health is ok, run at most {self._budget} job(s)")
+        if state == CRITICAL and self._paused_since is None:
+            logger.warning("ingest falls behind, batch jobs paused")
+            self._paused_since = now
+        elif state != CRITICAL and self._paused_since is not None:
+            logger.info(f"batch jobs resumed after {now - self._paused_since:.1f}s")
+            self._paused_time += now - self._paused_since
+            self._paused_since = None
+
+    def schedule(self):
+        active = [job for job in self._running if job.state == job.RUNNING]
+        # batch jobs above the budget are suspended, the most recent first, all of them when paused
+        for job in sorted(active, key=lambda job: job.rank, reverse=True):
+            if job.priority != BATCH or job.pid is None:
+                continue
+            if self.paused or len(active) > self._budget:
+                self.signal(job, signal.SIGSTOP)
+                job.state = job.SUSPENDED
+                self.stats['suspensions'] += 1
+                active.remove(job)
+        suspended = sorted((job for job in self._running if job.state == job.SUSPENDED), key=lambda job: job.rank)
+        while len(active) < self._budget:
+            candidates = []
+            if len(suspended) > 0:
+                candidates.append(suspended[0])
+            if len(self._pending) > 0:
+                candidates.append(self._pending[0][1])
+            candidates = [job for job in candidates if not (self.paused and job.priority == BATCH)]
+            if len(candidates) == 0:
+                break
+            job = min(candidates, key=lambda job: job.rank)
+            if job.state == job.SUSPENDED:
+                suspended.pop(0)
+                self.signal(job, signal.SIGCONT)
+                job.state = job.RUNNING
+            else:
+                heapq.heappop(self._pending)
+                self.launch(job)
+            active.append(job)
+
+    def launch(self, job):
+        job.state = job.RUNNING
+        job.start_time = self._clock()
+        self._wait_stats[job.priority].add(round(job.wait_time * 1e9))
+        self._running.append(job)
+        task = asyncio.create_task(self.runJob(job), name=f'job{job.id}')
+        self._job_tasks.add(task)
+        task.add_done_callback(self._job_tasks.discard)
+
+    async def runJob(self, job):
+        state = job.FAILED
+        try:
+            with tracing.span(f'scheduler.{job.priority}', track=f'job{job.id}', job=job.name):
+                # a session per job, the whole shell pipeline is suspended, resumed or killed at once
+                proc = await asyncio.create_subprocess_shell(job.command, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE, start_new_session=True,
+                    preexec_fn=functools.partial(applyPriority, job.priority, job.niceness))
+                job.pid = proc.pid
+                if job.kill_requested:
+                    self.signal(job, signal.SIGKILL)
+                _, stderr = await proc.communicate()
+            job.returncode = proc.returncode
+            job.stderr = stderr.decode(errors='replace')
+            if proc.returncode == 0:
+                state = job.DONE
+            elif proc.returncode == -signal.SIGKILL:
+                state = job.CANCELLED
+        except Exception as e:
+            job.stderr = repr(e)
+        finally:
+            self._running.remove(job)
+            self.finish(job, state)
+
+    async def runDispatcher(self):
+        while True:
+            self.adjustBudget()
+            self.schedule()
+            try:
+                async with asyncio.timeout(self.ADJUST_PERIOD):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def getThroughput(self, now=None):
+        if now is None:
+            now = self._clock()
+        while len(self._completions) > 0 and self._completions[0] < now - self.THROUGHPUT_WINDOW:
+            self._completions.popleft()
+        return len(self._completions) * 60 / self.THROUGHPUT_WINDOW
+
+    def asDict(self):
+        now = self._clock()
+        paused_time = self._paused_time
+        if self._paused_since is not None:
+            paused_time += now - self._paused_since
+        return dict(
+            health = None if self._health is None else self._health.asDict(),
+            budget = self._budget,
+            max_jobs = self._max_jobs,
+            paused = self.paused,
+            paused_time = round(paused_time, 3),
+            pending = len(self._pending),
+            running = len([job for job in self._running if job.state == job.RUNNING]),
+            suspended = len([job for job in self._running if job.state == job.SUSPENDED]),
+            throughput = self.getThroughput(now),
+            jobs = [job.asDict() for job in self._running] + [job.asDict() for _, job in sorted(self._pending)],
+            wait = {p: stats.asDict() for p, stats in self._wait_stats.items()},
+            run = {p: stats.asDict() for p, stats in self._run_stats.items()},
+            **self.stats,
+        )
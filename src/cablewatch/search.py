@@ -0,0 +1,241 @@
+import os
+import re
+import csv
+import sqlite3
+import contextlib
+from datetime import datetime
+from cablewatch import config
+from cablewatch.timeline import fromMilliseconds, parseTimestamp, toMilliseconds
+
+
+SEARCH_FILENAME = 'search.sqlite'
+BANNER_FIELDS = ['timestamp_begin', 'timestamp_end', 'banner_type', 'banner_content']
+SPEECH_FIELDS = ['timestamp_begin', 'timestamp_end', 'locutor', 'text']
+SPEECH_TYPE = 'speech'
+TOKEN_PATTERN = re.compile(r'\w+\*?')
+
+
+def prepareMatch(query):
+    tokens = TOKEN_PATTERN.findall(query)
+    if len(tokens) == 0:
+        raise AssertionError('please specify at least one word to search')
+    # every token is quoted, FTS5 operators and column filters cannot be injected
+    return ' '.join(f'"{t[:-1]}"*' if t.endswith('*') else f'"{t}"' for t in tokens)
+
+
+class IngestSearchRecord:
+    @classmethod
+    def fromRow(cls, row):
+        begin = parseTimestamp(row['timestamp_begin'])
+        end = parseTimestamp(row['timestamp_end'])
+        if 'banner_type' in row:
+            return cls(type=row['banner_type'], begin=begin, end=end, content=row['banner_content'])
+        return cls(type=SPEECH_TYPE, begin=begin, end=end, content=row['text'], locutor=row.get('locutor') or None)
+
+    def __init__(self, *, type, begin, end, content, locutor=None, id=None, score=None, snippet=None):
+        self.id = id
+        self.type = type
+        self.begin = begin
+        self.end = end
+        self.content = content
+        self.locutor = locutor
+        self.score = score
+        self.snippet = snippet
+
+    def asDict(self):
+        return dict(
+            id = self.id,
+            type = self.type,
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            content = self.content,
+            locutor = self.locutor,
+            score = self.score,
+            snippet = self.snippet,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestSearchIndex:
+    # FTS5 keeps the postings of each token as delta-encoded varints and ranks them with BM25
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            begin INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            locutor TEXT,
+            UNIQUE (type, begin, content)
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS results_begin ON results (begin)',
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5 (
+            content,
+            content='results',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN
+            INSERT INTO results_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN
+            INSERT INTO results_fts (results_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """,
+    ]
+    LIMIT = 20
+    SNIPPET_TOKENS = 12
+
+    def __init__(self, filename=None):
+        conf = config.Config()
+        if filename is None:
+            filename = f'{conf.INGEST_DATADIR}/{SEARCH_FILENAME}'
+        self._filename = filename
+        with self.transaction() as db:
+            for query in self.SCHEMA:
+                db.execute(query)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @contextlib.contextmanager
+    def transaction(self, mode='IMMEDIATE'):
+        db = sqlite3.connect(self._filename, timeout=60, isolation_level=None)
+        try:
+            db.execute(f'BEGIN {mode}')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    @property
+    def number_of_results(self):
+        with self.transaction('DEFERRED') as db:
+            return db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def addRecords(self, records):
+        with self.transaction() as db:
+            cursor = db.executemany("""
+                INSERT OR IGNORE INTO results (type, begin, end, content, locutor) VALUES (?, ?, ?, ?, ?)
+            """, ((r.type, toMilliseconds(r.begin), toMilliseconds(r.end), r.content, r.locutor) for r in records))
+            return cursor.rowcount
+
+    def importCSV(self, filename):
+        with open(filename, 'r', newline='') as f:
+            return self.addRecords(IngestSearchRecord.fromRow(row) for row in csv.DictReader(f))
+
+    def optimize(self):
+        with self.transaction() as db:
+            db.execute("INSERT INTO results_fts (results_fts) VALUES ('optimize')")
+
+    def getRecords(self, *, begin=None, end=None, types=None):
+        conditions = ['1']
+        params = []
+        if begin is not None:
+            conditions.append('end > ?')
+            params.append(toMilliseconds(begin))
+        if end is not None:
+            conditions.append('begin < ?')
+            params.append(toMilliseconds(end))
+        if types:
+            conditions.append(f"type IN ({','.join('?' * len(types))})")
+            params += list(types)
+        with self.transaction('DEFERRED') as db:
+            rows = db.execute(f"""
+                SELECT id, type, begin, end, content, locutor FROM results
+                WHERE {' AND '.join(conditions)}
+                ORDER BY begin, id
+            """, params).fetchall()
+        return [IngestSearchRecord(id=id, type=type, begin=fromMilliseconds(begin), end=fromMilliseconds(end),
+            content=content, locutor=locutor) for id, type, begin, end, content, locutor in rows]
+
+    def search(self, query, *, begin=None, end=None, types=None, limit=None):
+        if limit is None:
+            limit = self.LIMIT
+        conditions = ['results_fts MATCH ?']
+        params = [prepareMatch(query)]
+        # results overlapping [begin, end)
+        if begin is not None:
+            conditions.append('r.end > ?')
+            params.append(toMilliseconds(begin))
+        if end is not None:
+            conditions.append('r.begin < ?')
+            params.append(toMilliseconds(end))
+        if types:
+            conditions.append(f"r.type IN ({','.join('?' * len(types))})")
+            params += list(types)
+        with self.transaction('DEFERRED') as db:
+            rows = db.execute(f"""
+                SELECT r.id, r.type, r.begin, r.end, r.content, r.locutor, bm25(results_fts),
+                    snippet(results_fts, 0, '[', ']', '…', {self.SNIPPET_TOKENS})
+                FROM results_fts JOIN results r ON r.id = results_fts.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY bm25(results_fts), r.begin
+                LIMIT ?
+            """, params + [limit]).fetchall()
+        # bm25() is negative, the lower the better
+        return [IngestSearchRecord(id=id, type=type, begin=fromMilliseconds(begin), end=fromMilliseconds(end),
+            content=content, locutor=locutor, score=-score, snippet=snippet)
+            for id, type, begin, end, content, locutor, score, snippet in rows]
+
+
+class IngestResultWriter:
+    BATCH_SIZE = 100
+
+    def __init__(self, filename, *, fieldnames=None, search_index=None):
+        self._fieldnames = BANNER_FIELDS if fieldnames is None else fieldnames
+        self._search_index = IngestSearchIndex() if search_index is None else search_index
+        self._filename = filename
+        # the .gz sibling of the previous results would be served while the file is rewritten
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f'{filename}.gz')
+        self._f = open(filename, 'w', newline='')
+        self._writer = csv.DictWriter(self._f, fieldnames=self._fieldnames)
+        self._writer.writeheader()
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def writeRow(self, row):
+        row = {k: v.isoformat() if isinstance(v, datetime) else v for k,v in row.items()}
+        self._writer.writerow(row)
+        self._pending.append(IngestSearchRecord.fromRow(row))
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self._f.flush()
+        if len(self._pending) > 0:
+            self._search_index.addRecords(self._pending)
+            self._pending = []
+
+    def close(self):
+        from cablewatch import http
+        if self._f is None:
+            return
+        self.flush()
+        self._f.close()
+        self._f = None
+        http.FileServer.precompress(self._filename)
@@ -0,0 +1,1113 @@
+import os
+import re
+import time
+import glob
+import json
+import argparse
+import tempfile
+import copy
+import bisect
+import math
+import fcntl
+import contextlib
+from datetime import datetime, timedelta
+from pytimeparse.timeparse import timeparse
+from rich import print
+from rich.table import Table
+from cablewatch import config, tracing
+
+
+SEGMENT_DATETIME_FORMAT = '%Y-%m-%dT%Hh%Mm%S'
+SEGMENT_DATETIME_MS_FORMAT = '%Y-%m-%dT%Hh%Mm%S.%f'
+SEGMENT_FORMAT = 'segment_{datetime}_{duration:.2f}s.ts'
+SEGMENT_PATTERN = r'^segment_(.+)_(.+)s\.ts(\.hole)?$'
+INDEX_FILENAME = 'index.jsonl'
+GAP_TOLERANCE = timedelta(seconds=1)
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_SAMPLE_WIDTH = 2
+EPOCH = datetime(1970, 1, 1)
+
+
+def formatSegmentDatetime(dt):
+    return dt.strftime(SEGMENT_DATETIME_FORMAT) + f'.{dt.microsecond // 1000:03d}'
+
+
+def parseSegmentDatetime(s):
+    if '.' in s:
+        return datetime.strptime(s, SEGMENT_DATETIME_MS_FORMAT)
+    return datetime.strptime(s, SEGMENT_DATETIME_FORMAT)
+
+
+def toMilliseconds(dt):
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+
+def fromMilliseconds(ms):
+    return EPOCH + timedelta(milliseconds=ms)
+
+
+def parseTimestamp(s):
+    try:
+        timestamp = datetime.fromisoformat(s)
+    except (TypeError, ValueError):
+        raise AssertionError('please specify a valid ISO 8601 timestamp')
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+class IngestTimeLineConflictError(AssertionError):
+    pass
+
+
+class IngestTimeLine:
+    NAME_PATTERN = r"^[A-Za-z0-9_-]+$"
+    PROTECTED_NAMES = set(['glob'])
+
+    @classmethod
+    def checkName(cls, name):
+        if not re.fullmatch(cls.NAME_PATTERN, name):
+            raise AssertionError(f'{name} is not a valid timeline name')
+
+    @classmethod
+    def loadNames(self):
+        EXT = '.json'
+        names = []
+        conf = config.Config()
+        for bn in os.listdir(f'{conf.INGEST_DATADIR}/timelines'):
+            if bn.endswith(EXT):
+                names.append(bn[:-len(EXT)])
+        return names
+
+    @classmethod
+    def loadInstances(cls):
+        instances = {}
+        index = IngestIndex.open()
+        instances['glob'] = IngestTimeLine(name='glob', index=index)
+        for name in cls.loadNames():
+            tl = IngestTimeLine(name=name, index=index)
+            instances[name] = tl
+        return instances
+
+    def __init__(self, *args, **kwargs):
+        self.init(*args,**kwargs)
+
+    @tracing.traced('timeline.build')
+    def init(self, name, readonly=False, begin=None, duration=None, load=True, index=None):
+        self.checkName(name)
+        if index is None:
+            index = IngestIndex.open()
+        first_seg = index.first_segment
+        last_seg = index.last_segment
+        if begin is None:
+            if first_seg is not None:
+                begin = first_seg.begin
+            else:
+                begin = datetime.combine(datetime.today(), datetime.min.time())
+        if duration is None:
+            if first_seg is not None:
+                duration = last_seg.begin - first_seg.begin + last_seg.duration
+            else:
+                duration = timedelta(seconds=0)
+        if load:
+            state = self.loadState(name)
+            if state is not None:
+                begin, duration = state
+        segments = index.getSegments(begin, begin + duration)
+        prev_end = None
+        for seg in list(segments.values()):
+            if prev_end is not None and (prev_end - seg.begin) > GAP_TOLERANCE:
+                if seg.end <= prev_end:
+                    del segments[seg.begin]
+                    continue
+                seg.inpoint = prev_end - seg.begin
+            prev_end = seg.end
+        for seg in list(segments.values()):
+            if (seg.begin + seg.duration) < begin:
+                del segments[seg.begin]
+            elif seg.begin >= (begin + duration):
+                del segments[seg.begin]
+        if len(segments) > 0:
+            first_seg = next(iter(segments.values()))
+            last_seg = next(reversed(segments.values()))
+            end = (begin + duration)
+            seg_end =(last_seg.begin + last_seg.duration)
+            if begin > first_seg.begin + (first_seg.inpoint or timedelta(seconds=0)):
+                first_seg.inpoint = begin - first_seg.begin
+            if seg_end > end:
+                last_seg.outpoint = last_seg.duration - (seg_end - end)
+        self._begin = begin
+        self._duration = duration
+        self._name = name
+        self._segments = segments
+        self._index = index
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def begin(self):
+        return self._begin
+
+    @property
+    def end(self):
+        return self._begin + self._duration
+
+    @property
+    def duration(self):
+        return self._duration
+
+    @property
+    def segments(self):
+        return copy.copy(self._segments)
+
+    def lookupSegmentFromTimestamp(self, timestamp):
+        seg = self._index.lookupSegment(timestamp)
+        try:
+            return self._segments[seg.begin]
+        except KeyError:
+            raise LookupError
+
+    def getNumberOfHoles(self):
+        return len(self._index.getHoles(self.begin, self.end))
+
+    def getGaps(self, begin=None, end=None):
+        if begin is None:
+            begin = self.begin
+        if end is None:
+            end = self.end
+        return self._index.getGaps(begin, end)
+
+    def getCoverage(self, begin=None, end=None):
+        if begin is None:
+            begin = self.begin
+        if end is None:
+            end = self.end
+        return self._index.getCoverage(begin, end)
+
+    def advance(self):
+        duration = self._duration
+        begin = self._begin + duration
+        self.init(self._name, begin=begin, duration=duration, load=False, index=self._index)
+
+    def reset(self):
+        duration = self._duration
+        begin = None
+        self.init(self._name, begin=begin, duration=duration, load=False, index=self._index)
+
+    @classmethod
+    def getFileName(cls, name):
+        conf = config.Config()
+        return f'{conf.INGEST_DATADIR}/timelines/{name}.json'
+
+    @classmethod
+    @contextlib.contextmanager
+    def locked(cls, name):
+        conf = config.Config()
+        with open(f'{conf.INGEST_DATADIR}/timelines/.{name}.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def loadState(cls, name):
+        try:
+            with open(cls.getFileName(name), 'r') as f:
+                d = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        return datetime.fromisoformat(d['begin']), timedelta(seconds=d['duration'])
+
+    def writeState(self):
+        name = self._name
+        if name in self.PROTECTED_NAMES:
+            raise AssertionError(f'timeline {name!r} cannot be altered')
+        d = dict(
+            begin = self._begin.isoformat(),
+            duration = self._duration.total_seconds(),
+        )
+        filename = self.getFileName(name)
+        dirname = os.path.dirname(filename)
+        with tempfile.NamedTemporaryFile(dir=dirname, prefix=f'.{name}.', suffix='.tmp', mode='w', delete=False) as f:
+            try:
+                f.write(json.dumps(d))
+                f.flush()
+                os.fsync(f.fileno())
+                os.replace(f.name, filename)
+            except BaseException:
+                os.remove(f.name)
+                raise
+        fd = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def save(self):
+        with self.locked(self._name):
+            self.writeState()
+
+    def compareAndAdvance(self):
+        name = self._name
+        with self.locked(name):
+            state = self.loadState(name)
+            if state != (self._begin, self._duration):
+                raise IngestTimeLineConflictError(f'timeline {name!r} has been modified by another process')
+            self.advance()
+            self.writeState()
+
+    @classmethod
+    def claim(cls, name, index=None):
+        cls.checkName(name)
+        if name in cls.PROTECTED_NAMES:
+            raise AssertionError(f'timeline {name!r} cannot be altered')
+        with cls.locked(name):
+            if cls.loadState(name) is None:
+                raise AssertionError(f'timeline {name!r} does not exist')
+            tl = cls(name=name, index=index)
+            following = cls(name=name, begin=tl.end, duration=tl.duration, load=False, index=tl._index)
+            following.writeState()
+        return tl
+
+    def remove(self):
+        name = self._name
+        if name in self.PROTECTED_NAMES:
+            raise AssertionError(f'timeline {name!r} cannot be removed')
+        with self.locked(name):
+            os.remove(self.getFileName(name))
+
+    def asDict(self):
+        coverage = self.getCoverage()
+        return dict(
+            name = self._name,
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            duration = self._duration.total_seconds(),
+            number_of_segments = len(self._segments),
+            number_of_holes = self.getNumberOfHoles(),
+            number_of_gaps = len(self.getGaps()),
+            coverage = coverage,
+        )
+
+    def follow(self, *, end=None, slices=False, poll_period=None, timeout=None):
+        return IngestTimeLineFollower(timeline=self, index=self._index, begin=self._begin, end=end,
+            slices=slices, poll_period=poll_period, timeout=timeout)
+
+    def slices(self):
+        segments = []
+        for seg in self._segments.values():
+            segments.append(seg)
+            if seg.hole:
+                yield IngestTimeSlice(timeline=self, segments=segments)
+                segments = []
+        if len(segments):
+            yield IngestTimeSlice(timeline=self, segments=segments)
+
+
+class IngestTimeLineFollower:
+    POLL_PERIOD = 0.5
+
+    def __init__(self, *, timeline, index, begin, end=None, slices=False, poll_period=None, timeout=None):
+        self._timeline = timeline
+        self._index = index
+        self._begin = begin
+        self._end = end
+        self._slices = slices
+        self._poll_period = self.POLL_PERIOD if poll_period is None else poll_period
+        self._timeout = timeout
+        self._last_begin = None
+        self._prev_end = None
+        self._pending = []
+        self._done = False
+
+    @property
+    def done(self):
+        return self._done
+
+    def getNewSegments(self):
+        self._index.refresh()
+        if self._last_begin is None:
+            return self._index.getSegments(self._begin, self._end).values()
+        return self._index.getSegmentsAfter(self._last_begin).values()
+
+    def trimSegment(self, seg):
+        begin = self._begin
+        end = self._end
+        prev_end = self._prev_end
+        if seg.end <= begin:
+            self._prev_end = seg.end
+            return None
+        if prev_end is not None and (prev_end - seg.begin) > GAP_TOLERANCE:
+            if seg.end <= prev_end:
+                return None
+            seg.inpoint = prev_end - seg.begin
+        if begin > seg.begin + (seg.inpoint or timedelta(seconds=0)):
+            seg.inpoint = begin - seg.begin
+        if end is not None and seg.end > end:
+            seg.outpoint = seg.duration - (seg.end - end)
+        self._prev_end = seg.end
+        return seg
+
+    def closeSlice(self):
+        slice = IngestTimeSlice(timeline=self._timeline, segments=self._pending)
+        self._pending = []
+        return slice
+
+    def poll(self):
+        items = []
+        for seg in self.getNewSegments():
+            if self._end is not None and seg.begin >= self._end:
+                self._done = True
+                break
+            self._last_begin = seg.begin
+            seg = self.trimSegment(seg)
+            if seg is None:
+                continue
+            if not self._slices:
+                items.append(seg)
+            else:
+                if len(self._pending) > 0 and self._index.isHole(self._pending[-1].begin):
+                    self._pending[-1].hole = True
+                    items.append(self.closeSlice())
+                self._pending.append(seg)
+            if self._end is not None and seg.end >= self._end:
+                self._done = True
+                break
+        if self._done and len(self._pending) > 0:
+            items.append(self.closeSlice())
+        return items
+
+    def __iter__(self):
+        last_time = time.monotonic()
+        while not self._done:
+            items = self.poll()
+            yield from items
+            if len(items) > 0:
+                last_time = time.monotonic()
+            elif self._timeout is not None and time.monotonic() - last_time > self._timeout:
+                if len(self._pending) > 0:
+                    yield self.closeSlice()
+                return
+            elif not self._done:
+                time.sleep(self._poll_period)
+
+    async def __aiter__(self):
+        import asyncio
+        last_time = time.monotonic()
+        while not self._done:
+            items = self.poll()
+            for item in items:
+                yield item
+            if len(items) > 0:
+                last_time = time.monotonic()
+            elif self._timeout is not None and time.monotonic() - last_time > self._timeout:
+                if len(self._pending) > 0:
+                    yield self.closeSlice()
+                return
+            elif not self._done:
+                await asyncio.sleep(self._poll_period)
+
+
+class IngestSegment:
+    @staticmethod
+    def fromFileName(filename):
+        basename = os.path.basename(filename)
+        m = re.match(SEGMENT_PATTERN, basename)
+        if not m:
+            raise AssertionError(f'cannot parse segment filename: {basename!r}')
+        begin = parseSegmentDatetime(m.group(1))
+        duration = timedelta(seconds=float(m.group(2)))
+        if m.group(3):
+            hole = True
+            L = len(m.group(3))
+            basename = basename[:-L]
+            filename = filename[:-L]
+        else:
+            hole = False
+        return IngestSegment(filename=filename, basename=basename, begin=begin, duration=duration,
+            hole=hole)
+
+    def __init__(self, *,filename, basename, begin, duration, inpoint=None, outpoint=None, hole=False):
+        self.filename = filename
+        self.basename = basename
+        self.begin = begin
+        self.duration = duration
+        self.inpoint = inpoint
+        self.outpoint = outpoint
+        self.hole = hole
+
+    @property
+    def end(self):
+        return self.begin + self.duration
+
+    @property
+    def effective_duration(self):
+        duration = self.duration
+        if self.inpoint is None:
+            inpoint = timedelta(seconds=0)
+        else:
+            inpoint = self.inpoint
+        if self.outpoint is None:
+            outpoint = duration
+        else:
+            outpoint = self.outpoint
+        return outpoint - inpoint
+
+    def getDerivativeFileName(self, kind, extension, dirname=None):
+        if dirname is None:
+            dirname = config.Config().INGEST_DERIVATIVES_DIR
+        stem = self.basename[:-len('.ts')]
+        return f'{dirname}/{stem}.{kind}.{extension}'
+
+    def asDict(self):
+        return dict(
+            basename = self.basename,
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            duration = self.duration.total_seconds(),
+            inpoint = None if self.inpoint is None else self.inpoint.total_seconds(),
+            outpoint = None if self.outpoint is None else self.outpoint.total_seconds(),
+            effective_duration = self.effective_duration.total_seconds(),
+            hole = self.hole,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestTimeSlice:
+    def __init__(self, *, timeline, segments):
+        self._timeline = timeline
+        self._segments = copy.copy(segments)
+
+    @property
+    def segments(self):
+        return copy.copy(self._segments)
+
+    @property
+    def begin(self):
+        if len(self._segments) == 0:
+            raise AssertionError
+        first_seg = self._segments[0]
+        return first_seg.begin
+
+    @property
+    def end(self):
+        if len(self._segments) == 0:
+            raise AssertionError
+        last_seg = self._segments[-1]
+        return last_seg.begin + last_seg.duration
+
+    @property
+    def duration(self):
+        duration = timedelta(seconds=0)
+        for seg in self._segments:
+            duration += seg.duration
+        return duration
+
+    @property
+    def effective_duration(self):
+        duration = timedelta(seconds=0)
+        for seg in self._segments:
+            duration += seg.effective_duration
+        return duration
+
+    def getTimestamp(self, offset):
+        for seg in self._segments:
+            if offset < seg.effective_duration or seg is self._segments[-1]:
+                inpoint = timedelta(seconds=0) if seg.inpoint is None else seg.inpoint
+                return seg.begin + inpoint + offset
+            offset -= seg.effective_duration
+        raise AssertionError
+
+    def asDict(self):
+        return dict(
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            duration = self.duration.total_seconds(),
+            effective_duration = self.effective_duration.total_seconds(),
+            segments = [seg.asDict() for seg in self._segments],
+        )
+
+    def generateConcatContent(self):
+        s = ''
+        for seg in self._segments:
+            s += f"file '{seg.filename}'\n"
+            if seg.inpoint:
+                s += f'inpoint {seg.inpoint.total_seconds()}\n'
+            if seg.outpoint:
+                s += f'outpoint {seg.outpoint.total_seconds()}\n'
+            s += '\n'
+        return s
+
+    def generatePlaylist(self, *, url_prefix=''):
+        PACKET_SIZE = 188
+        entries = []
+        prev_seg = None
+        for i,seg in enumerate(self._segments):
+            size = os.path.getsize(seg.filename)
+            duration = seg.duration.total_seconds()
+            inpoint = 0.0 if seg.inpoint is None else seg.inpoint.total_seconds()
+            outpoint = duration if seg.outpoint is None else seg.outpoint.total_seconds()
+            start_offset = None
+            if i == 0 and inpoint > 0:
+                start_offset = inpoint
+                inpoint = 0.0
+            first_byte = PACKET_SIZE * int(size * inpoint / duration / PACKET_SIZE)
+            last_byte = size if outpoint >= duration else PACKET_SIZE * math.ceil(size * outpoint / duration / PACKET_SIZE)
+            discontinuity = False
+            if prev_seg is not None:
+                begin = seg.begin + timedelta(seconds=inpoint)
+                discontinuity = prev_seg.hole or abs(begin - prev_seg.end) > GAP_TOLERANCE or first_byte > 0
+            entries.append((seg, start_offset, inpoint, outpoint, first_byte, last_byte, size, discontinuity))
+            prev_seg = seg
+        target_duration = math.ceil(max((e[3] - e[2] for e in entries), default=0))
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:4',
+            f'#EXT-X-TARGETDURATION:{target_duration}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for seg, start_offset, inpoint, outpoint, first_byte, last_byte, size, discontinuity in entries:
+            if start_offset is not None:
+                lines.append(f'#EXT-X-START:TIME-OFFSET={start_offset:.3f},PRECISE=YES')
+            if discontinuity:
+                lines.append('#EXT-X-DISCONTINUITY')
+            pdt = (seg.begin + timedelta(seconds=inpoint)).astimezone()
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{pdt.isoformat(timespec='milliseconds')}")
+            lines.append(f'#EXTINF:{outpoint - inpoint:.3f},')
+            if first_byte > 0 or last_byte < size:
+                lines.append(f'#EXT-X-BYTERANGE:{last_byte - first_byte}@{first_byte}')
+            lines.append(f'{url_prefix}{seg.basename}')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def analyze(self, analyzers, *, input=None):
+        from cablewatch import analysis
+        return analysis.IngestAnalysisPass(slice=self, analyzers=analyzers, input=input).run()
+
+    def hasAudio(self, dirname=None):
+        for seg in self._segments:
+            if not os.path.exists(seg.getDerivativeFileName('audio', 'wav', dirname)):
+                return False
+        return True
+
+    def readAudio(self, *, dirname=None, chunk_frames=AUDIO_SAMPLE_RATE):
+        import wave
+        for seg in self._segments:
+            inpoint = 0.0 if seg.inpoint is None else seg.inpoint.total_seconds()
+            outpoint = seg.duration.total_seconds() if seg.outpoint is None else seg.outpoint.total_seconds()
+            first = round(inpoint * AUDIO_SAMPLE_RATE)
+            remaining = round(outpoint * AUDIO_SAMPLE_RATE) - first
+            filename = seg.getDerivativeFileName('audio', 'wav', dirname)
+            # missing sidecars are replaced by silence to keep the samples aligned with the slice
+            if os.path.exists(filename):
+                with wave.open(filename, 'rb') as wav:
+                    if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (AUDIO_SAMPLE_RATE, 1, AUDIO_SAMPLE_WIDTH):
+                        raise AssertionError(f'unexpected audio format: {filename!r}')
+                    wav.setpos(min(first, wav.getnframes()))
+                    while remaining > 0:
+                        data = wav.readframes(min(chunk_frames, remaining))
+                        if len(data) == 0:
+                            break
+                        remaining -= len(data) // AUDIO_SAMPLE_WIDTH
+                        yield data
+            while remaining > 0:
+                n = min(chunk_frames, remaining)
+                yield bytes(n * AUDIO_SAMPLE_WIDTH)
+                remaining -= n
+
+    def writeAudio(self, filename, *, dirname=None):
+        import wave
+        number_of_frames = 0
+        with wave.open(filename, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(AUDIO_SAMPLE_WIDTH)
+            wav.setframerate(AUDIO_SAMPLE_RATE)
+            for data in self.readAudio(dirname=dirname):
+                wav.writeframes(data)
+                number_of_frames += len(data) // AUDIO_SAMPLE_WIDTH
+        return number_of_frames
+
+    def concatFile(self, *, delete=True):
+        conf = config.Config()
+        tl = self._timeline
+        f = tempfile.NamedTemporaryFile(dir=f"{conf.INGEST_DATADIR}/tmp/", prefix=f'{tl.name}_', suffix=".concat", mode='w', delete=delete)
+        content = self.generateConcatContent()
+        f.write(content)
+        f.flush()
+        return f
+
+
+class IngestGap:
+    def __init__(self, *, begin, end, hole=False):
+        self.begin = begin
+        self.end = end
+        self.hole = hole
+
+    @property
+    def duration(self):
+        return self.end - self.begin
+
+    def asDict(self):
+        return dict(
+            begin = self.begin.isoformat(),
+            end = self.end.isoformat(),
+            duration = self.duration.total_seconds(),
+            hole = self.hole,
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestIndex:
+    @classmethod
+    def open(cls):
+        index = cls()
+        if index.exists():
+            index.load()
+        else:
+            index.scan()
+        return index
+
+    def __init__(self, filename=None):
+        conf = config.Config()
+        if filename is None:
+            filename = f'{conf.INGEST_DATADIR}/{INDEX_FILENAME}'
+        self._filename = filename
+        self._datadir = os.path.dirname(filename)
+        self.clear()
+
+    def clear(self):
+        self._segments = {}
+        self._begins = []
+        self._gaps = []
+        self._holes = []
+        self._offset = 0
+        self._inode = None
+        self._revision = getattr(self, '_revision', 0) + 1
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def exists(self):
+        return os.path.exists(self._filename)
+
+    def load(self):
+        with open(self._filename, 'r') as f:
+            self._inode = os.fstat(f.fileno()).st_ino
+            f.seek(self._offset)
+            while True:
+                ln = f.readline()
+                if not ln.endswith('\n'):
+                    break
+                self._offset = f.tell()
+                self.processEntry(json.loads(ln))
+
+    @tracing.traced('index.refresh')
+    def refresh(self):
+        try:
+            st = os.stat(self._filename)
+        except FileNotFoundError:
+            return False
+        if st.st_ino == self._inode and st.st_size == self._offset:
+            return False
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self.clear()
+        self.load()
+        return True
+
+    @property
+    def revision(self):
+        return self._revision
+
+    def processEntry(self, d):
+        self._revision += 1
+        if d['type'] == 'segment':
+            seg = IngestSegment.fromFileName(f"{self._datadir}/{d['basename']}")
+            if seg.begin in self._segments:
+                pass
+            elif len(self._begins) == 0 or seg.begin > self._begins[-1]:
+                self._begins.append(seg.begin)
+            else:
+                bisect.insort(self._begins, seg.begin)
+            self._segments[seg.begin] = seg
+        elif d['type'] == 'hole':
+            seg = IngestSegment.fromFileName(f"{self._datadir}/{d['basename']}")
+            if seg.begin not in self._segments:
+                return
+            self._segments[seg.begin].hole = True
+            self._holes.append(seg.begin)
+        elif d['type'] == 'gap':
+            gap = IngestGap(begin=datetime.fromisoformat(d['begin']), end=datetime.fromisoformat(d['end']), hole=d['hole'])
+            self._gaps.append(gap)
+        else:
+            raise AssertionError(f"invalid index entry type: {d['type']!r}")
+
+    def appendEntries(self, entries):
+        s = ''
+        for d in entries:
+            s += json.dumps(d) + '\n'
+        with open(self._filename, 'a') as f:
+            f.write(s)
+        for d in entries:
+            self.processEntry(d)
+        self._offset += len(s.encode())
+
+    def prepareSegmentEntries(self, seg):
+        entries = []
+        if len(self._begins) > 0:
+            last_seg = self._segments[self._begins[-1]]
+            if seg.begin > last_seg.begin:
+                hole = last_seg.hole
+                if hole or (seg.begin - last_seg.end) > GAP_TOLERANCE:
+                    end = max(seg.begin, last_seg.end)
+                    entries.append(dict(type='gap', begin=last_seg.end.isoformat(), end=end.isoformat(), hole=hole))
+        entries.append(dict(type='segment', basename=seg.basename))
+        return entries
+
+    def addSegment(self, seg):
+        self.appendEntries(self.prepareSegmentEntries(seg))
+
+    def markHole(self, filename):
+        basename = os.path.basename(filename)
+        self.appendEntries([dict(type='hole', basename=basename)])
+
+    def scan(self):
+        self.clear()
+        segments = []
+        for fn in glob.glob(f"{self._datadir}/segment_*.ts*"):
+            segments.append(IngestSegment.fromFileName(fn))
+        segments.sort(key=lambda seg: (seg.begin, seg.hole))
+        all_entries = []
+        for seg in segments:
+            if seg.hole:
+                entries = [dict(type='hole', basename=seg.basename)]
+            else:
+                entries = self.prepareSegmentEntries(seg)
+            for d in entries:
+                self.processEntry(d)
+            all_entries += entries
+        return all_entries
+
+    def rebuild(self):
+        tmp_filename = f'{self._filename}.tmp'
+        with open(tmp_filename, 'w') as f:
+            for d in self.scan():
+                f.write(json.dumps(d) + '\n')
+            self._offset = f.tell()
+        os.rename(tmp_filename, self._filename)
+        self._inode = os.stat(self._filename).st_ino
+
+    @property
+    def first_segment(self):
+        if len(self._begins) == 0:
+            return None
+        return self._segments[self._begins[0]]
+
+    @property
+    def last_segment(self):
+        if len(self._begins) == 0:
+            return None
+        return self._segments[self._begins[-1]]
+
+    def getSegments(self, begin=None, end=None):
+        if begin is None:
+            i = 0
+        else:
+            i = bisect.bisect_left(self._begins, begin)
+            while i > 0:
+                i -= 1
+                if self._segments[self._begins[i]].end < begin:
+                    break
+        if end is None:
+            j = len(self._begins)
+        else:
+            j = bisect.bisect_left(self._begins, end)
+        segments = {}
+        for key in self._begins[i:j]:
+            segments[key] = copy.copy(self._segments[key])
+        return segments
+
+    def getSegmentsAfter(self, begin):
+        segments = {}
+        for key in self._begins[bisect.bisect_right(self._begins, begin):]:
+            segments[key] = copy.copy(self._segments[key])
+        return segments
+
+    def getSegment(self, begin):
+        try:
+            return copy.copy(self._segments[begin])
+        except KeyError:
+            raise LookupError
+
+    def isHole(self, begin):
+        return self._segments[begin].hole
+
+    def lookupSegment(self, timestamp):
+        found = None
+        i = bisect.bisect_right(self._begins, timestamp)
+        while i > 0:
+            i -= 1
+            seg = self._segments[self._begins[i]]
+            if seg.end < timestamp:
+                break
+            found = seg
+        if found is None:
+            raise LookupError
+        return found
+
+    def getHoles(self, begin, end):
+        holes = []
+        for key in self._holes:
+            seg = self._segments[key]
+            if seg.end >= begin and seg.begin < end:
+                holes.append(seg)
+        return holes
+
+    def getGaps(self, begin, end):
+        gaps = []
+        for gap in self._gaps:
+            if gap.end > begin and gap.begin < end:
+                gaps.append(IngestGap(begin=max(gap.begin, begin), end=min(gap.end, end), hole=gap.hole))
+        return gaps
+
+    def getCoverage(self, begin, end):
+        if end <= begin:
+            return None
+        covered = timedelta(seconds=0)
+        cursor = begin
+        i = bisect.bisect_left(self._begins, begin)
+        if i > 0:
+            i -= 1
+        for key in self._begins[i:]:
+            seg = self._segments[key]
+            if seg.begin >= end:
+                break
+            seg_begin = max(seg.begin, cursor)
+            seg_end = min(seg.end, end)
+            if seg_end > seg_begin:
+                covered += seg_end - seg_begin
+                cursor = seg_end
+        return covered / (end - begin)
+
+
+TLTOOL_ACTIONS = {}
+
+
+def TLtool_action(*names):
+    def inner(obj):
+        for n in names:
+            TLTOOL_ACTIONS[n]=obj
+    return inner
+
+
+class IngestTimeLineTool:
+    class ArgumentParser(argparse.ArgumentParser):
+        def __init__(self):
+            actions = '|'.join(TLTOOL_ACTIONS)
+            super().__init__(usage=f'%(prog)s <{actions}> [timeline-names] <options>')
+            self.add_argument('-d','--duration', dest='duration', default="0s", help="set timeline duration")
+            self.add_argument('-s','--slice-index', dest='slice_index', default=None, type=int, help="set slice index")
+
+        def parse_args(self, args):
+            prog = args[0]
+            ns,args = super().parse_known_args(args[1:])
+            ns.prog = prog
+            ns.action = None
+            ns.largs = []
+            ns.rargs = []
+            xargs = ns.largs
+            for a in args:
+                if ns.action is None:
+                    if a not in TLTOOL_ACTIONS:
+                        self.error(f'invalid action {a!r}')
+                    else:
+                        ns.action = a
+                elif a == '--':
+                    xargs = ns.rargs
+                else:
+                    xargs.append(a)
+            if ns.action is None:
+                self.error('no action secified')
+            return ns
+
+    def __init__(self, args):
+        p = self.ArgumentParser()
+        self._ns = p.parse_args(args)
+        self._argparser = p
+
+    def __call__(self):
+        ns = self._ns
+        f = TLTOOL_ACTIONS[ns.action]
+        f(self)
+
+    @TLtool_action('rm','remove')
+    def remove(self):
+        ns = self._ns
+        for name in ns.largs:
+            self.ensureName(name, 'existing')
+            tl = IngestTimeLine(name=name)
+            tl.remove()
+
+    def getName(self, idx):
+        ns = self._ns
+        try:
+            name = ns.largs[idx]
+        except IndexError:
+            self.error('please specify a valid timeline name')
+        return name
+
+    def error(self, msg):
+        self._argparser.error(msg)
+
+    def ensureName(self, name, mode):
+        exists = (name in IngestTimeLine.loadNames()) or (name in IngestTimeLine.PROTECTED_NAMES)
+        if mode not in ('existing', 'not-existing'):
+            raise AssertionError
+        if exists and mode=='not-existing':
+            self.error(f'timeline {name!r} already exists')
+        if not exists and mode=='existing':
+            self.error(f'timeline {name!r} does not exist')
+
+    @TLtool_action('create')
+    def create(self):
+        ns = self._ns
+        name = self.getName(0)
+        self.ensureName(name, 'not-existing')
+        duration = timedelta(seconds=timeparse(ns.duration))
+        begin = None
+        tl = IngestTimeLine(name=name, begin=begin, duration=duration)
+        tl.save()
+
+    @TLtool_action('adv', 'advance')
+    def advance(self):
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        tl = IngestTimeLine(name=name)
+        tl.compareAndAdvance()
+
+    @TLtool_action('reset')
+    def reset(self):
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        tl = IngestTimeLine(name=name)
+        tl.reset()
+        tl.save()
+
+    @TLtool_action('ls','list')
+    def list(self):
+        table = Table()
+        table.add_column("NAME")
+        table.add_column("BEGIN")
+        table.add_column("END")
+        table.add_column("DURATION")
+        table.add_column("NUM_HOLES")
+        table.add_column("NUM_GAPS")
+        table.add_column("COVERAGE")
+        for name, tl in IngestTimeLine.loadInstances().items():
+            if tl.duration.total_seconds() == 0:
+                duration = "0s"
+            else:
+                duration = str(tl.duration)
+            coverage = tl.getCoverage()
+            if coverage is None:
+                coverage = '-'
+            else:
+                coverage = f'{coverage * 100:.1f}%'
+            table.add_row(name, tl.begin.isoformat(), tl.end.isoformat(), duration, f'{tl.getNumberOfHoles()}',
+                f'{len(tl.getGaps())}', coverage)
+        print(table)
+
+    @TLtool_action('reindex')
+    def reindex(self):
+        index = IngestIndex()
+        index.rebuild()
+
+    @TLtool_action('enqueue')
+    def enqueue(self):
+        from cablewatch import jobs
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        queue = jobs.IngestJobQueue()
+        for begin, duration in queue.enqueueAvailable(name):
+            print(f'{name}: enqueued window {begin.isoformat()} ({duration})')
+
+    @TLtool_action('jobs')
+    def jobs(self):
+        from cablewatch import jobs
+        table = Table()
+        for hdr in ["ID", "BEGIN", "DURATION", "STATE", "ATTEMPTS", "WORKER", "ERROR"]:
+            table.add_column(hdr)
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        queue = jobs.IngestJobQueue()
+        for job in queue.getJobs(name):
+            table.add_row(f'{job.id}', job.begin.isoformat(), f'{job.duration}', job.state, f'{job.attempts}',
+                job.worker or '', job.error or '')
+        print(table)
+
+    @TLtool_action('verify')
+    def verify(self):
+        from cablewatch import mpegts
+        table = Table()
+        for hdr in ["SEGMENT_BASENAME", "DURATION", "MEASURED_DURATION", "DELTA"]:
+            table.add_column(hdr)
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        tl = IngestTimeLine(name=name)
+        for seg in tl.segments.values():
+            if seg.hole:
+                continue
+            try:
+                with mpegts.IngestTSDemuxer.fromSegment(seg) as demuxer:
+                    measured = demuxer.getDuration()
+            except (AssertionError, LookupError) as e:
+                table.add_row(seg.basename, f'{seg.duration}', f'[red]{e}[/red]', '')
+                continue
+            delta = (measured - seg.duration).total_seconds()
+            if abs(delta) > 0.1:
+                table.add_row(seg.basename, f'{seg.duration}', f'{measured}', f'{delta:+.3f}s')
+        print(table)
+
+    @TLtool_action('sl','slices')
+    def slices(self):
+        table = Table()
+        headers = ["SLICE_ID/SEGMENT_BASENAME", "INPOINT", "OUTPOINT", "EFFECTIVE_DURATION"]
+        for hdr in headers:
+            table.add_column(hdr)
+        seprator = [''] * len(headers)
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        tl = IngestTimeLine(name=name)
+        for i,slice in enumerate(tl.slices()):
+            table.add_row(*seprator)
+            table.add_row(f'[cyan]slice #{i}[/cyan]','','',f'[cyan]{slice.effective_duration}[/cyan]')
+            for seg in slice.segments:
+                table.add_row(seg.basename,f'{seg.inpoint}',f'{seg.outpoint}',f'{seg.effective_duration}')
+        print()
+        print(table)
+
+    @TLtool_action('concat')
+    def concat(self):
+        ns = self._ns
+        name = self.getName(0)
+        self.ensureName(name, 'existing')
+        tl = IngestTimeLine(name=name)
+        slice = list(tl.slices())[ns.slice_index]
+        content = slice.generateConcatContent()
+        print(content)
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import atexit
+import inspect
+import threading
+import functools
+import collections
+from datetime import datetime
+from cablewatch import config
+
+
+NUMBER_OF_BUCKETS = 40
+
+
+class IngestStageStats:
+    # bucket k counts the durations d with 2^(k-1) <= d / 1024ns < 2^k
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.buckets = [0] * NUMBER_OF_BUCKETS
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if self.max_ns is None or duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+        self.buckets[min(NUMBER_OF_BUCKETS - 1, (duration_ns >> 10).bit_length())] += 1
+
+    def getPercentile(self, p):
+        if self.count == 0:
+            return None
+        rank = p * self.count
+        n = 0
+        for k, count in enumerate(self.buckets):
+            n += count
+            if n >= rank:
+                # upper bound of the bucket, within the observed range
+                return min(max((1 << k) << 10, self.min_ns), self.max_ns)
+        return self.max_ns
+
+    def asDict(self):
+        def ms(ns):
+            return None if ns is None else ns / 1e6
+        return dict(
+            count = self.count,
+            total = ms(self.total_ns),
+            mean = ms(self.total_ns / self.count) if self.count > 0 else None,
+            min = ms(self.min_ns),
+            max = ms(self.max_ns),
+            p50 = ms(self.getPercentile(0.5)),
+            p90 = ms(self.getPercentile(0.9)),
+            p99 = ms(self.getPercentile(0.99)),
+            buckets = {f'<{(1 << k) * 1.024:g}us': count for k, count in enumerate(self.buckets) if count > 0},
+        )
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} at {hex(id(self))}'
+        for k,v in self.__dict__.items():
+            if k == 'buckets':
+                continue
+            s += f' {k}={v!r}'
+        s += '>'
+        return s
+
+
+class IngestNullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = IngestNullSpan()
+
+
+class IngestSpan:
+    def __init__(self, tracer, name, track, args):
+        self._tracer = tracer
+        self._name = name
+        self._track = track
+        self._args = args
+        self._start_ns = None
+
+    def __enter__(self):
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.record(self._name, self._start_ns, time.perf_counter_ns(), track=self._track, args=self._args)
+        return False
+
+
+class IngestTracer:
+    MAX_EVENTS = 100000
+
+    def __init__(self, *, enabled=False, max_events=None):
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}
+        # most recent spans only, for the trace files
+        self._events = collections.deque(maxlen=self.MAX_EVENTS if max_events is None else max_events)
+        self._origin_ns = time.perf_counter_ns()
+        self._origin_time = time.time()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def number_of_events(self):
+        return len(self._events)
+
+    def enable(self):
+        self._enabled = True
+
+    def disable(self):
+        self._enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._events.clear()
+
+    def span(self, name, *, track=None, **args):
+        if not self._enabled:
+            return NULL_SPAN
+        return IngestSpan(self, name, track, args)
+
+    def record(self, name, start_ns, end_ns, *, track=None, args=None):
+        if track is None:
+            track = threading.get_ident()
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = IngestStageStats(name)
+            stats.add(end_ns - start_ns)
+            self._events.append((name, start_ns, end_ns, track, args))
+
+    def getStats(self):
+        with self._lock:
+            return {name: stats.asDict() for name, stats in sorted(self._stats.items())}
+
+    def asChromeTrace(self):
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+        trace_events = []
+        tracks = {}
+        for name, start_ns, end_ns, track, args in events:
+            tid = tracks.get(track)
+            if tid is None:
+                tid = tracks[track] = len(tracks) + 1
+                trace_events.append(dict(name='thread_name', ph='M', pid=pid, tid=tid, args=dict(name=str(track))))
+            d = dict(name=name, cat=name.split('.')[0], ph='X', pid=pid, tid=tid,
+                ts=(start_ns - self._origin_ns) / 1000, dur=(end_ns - start_ns) / 1000)
+            if args:
+                d['args'] = {k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k,v in args.items()}
+            trace_events.append(d)
+        origin = datetime.fromtimestamp(self._origin_time).isoformat()
+        return dict(traceEvents=trace_events, displayTimeUnit='ms', otherData=dict(origin=origin))
+
+    def exportChromeTrace(self, filename):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(f'{filename}.tmp', 'w') as f:
+            json.dump(self.asChromeTrace(), f)
+        os.rename(f'{filename}.tmp', filename)
+        return filename
+
+
+class IngestSamplingProfiler:
+    INTERVAL = 0.005
+    MAX_DEPTH = 64
+
+    def __init__(self, *, thread_id=None, interval=None):
+        self._thread_id = threading.get_ident() if thread_id is None else thread_id
+        self._interval = self.INTERVAL if interval is None else interval
+        self._stacks = collections.Counter()
+        self._number_of_samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.start_time = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def number_of_samples(self):
+        return self._number_of_samples
+
+    def start(self):
+        if self._thread is not None:
+            raise AssertionError('profiler is already running')
+        self.start_time = datetime.now()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            raise AssertionError('profiler is not running')
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            del frame
+            self._stacks[';'.join(reversed(stack))] += 1
+            self._number_of_samples += 1
+
+    def getTopFunctions(self, count=20):
+        functions = collections.Counter()
+        for stack, n in self._stacks.items():
+            functions[stack.rsplit(';', 1)[-1]] += n
+        return functions.most_common(count)
+
+    def exportFolded(self, filename):
+        # flamegraph.pl / speedscope "collapsed stacks" format
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(filename, 'w') as f:
+            for stack, n in self._stacks.most_common():
+                f.write(f'{stack} {n}\n')
+        return filename
+
+
+def createTracer():
+    conf = config.Config()
+    tracer = IngestTracer(enabled=conf.INGEST_TRACING)
+    if conf.INGEST_TRACING:
+        atexit.register(exportAtExit, tracer)
+    return tracer
+
+
+def exportAtExit(tracer):
+    if tracer.number_of_events == 0:
+        return
+    conf = config.Config()
+    tracer.exportChromeTrace(f"{conf.LOGS_DIR}/traces/trace_{datetime.now().strftime('%Y-%m-%dT%Hh%Mm%S')}_{os.getpid()}.json")
+
+
+TRACER = createTracer()
+
+
+def span(name, *, track=None, **args):
+    if not TRACER.enabled:
+        return NULL_SPAN
+    return IngestSpan(TRACER, name, track, args)
+
+
+def traced(name):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not TRACER.enabled:
+                    return await func(*args, **kwargs)
+                import asyncio
+                # concurrent tasks interleave on the event loop thread, each task gets its own track
+                with IngestSpan(TRACER, name, asyncio.current_task().get_name(), None):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            with IngestSpan(TRACER, name, None, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import subprocess
+from datetime import datetime
+import pytest
+from cablewatch import config
+
+
+BENCH_RESULTS_FILENAME = '.cache/bench/results.jsonl'
+
+
+def pytest_addoption(parser):
+    parser.addoption('--bench', action='store_true', default=False, help="run benchmarks")
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'bench: benchmark, only run with --bench')
+    config._bench_results = []
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--bench'):
+        return
+    skip = pytest.mark.skip(reason="benchmark, use --bench to run")
+    for item in items:
+        if 'bench' in item.keywords:
+            item.add_marker(skip)
+
+
+def getGitCommit():
+    conf = config.Config()
+    proc = subprocess.run('git rev-parse --short HEAD', shell=True, cwd=conf.PROJECT_DIR,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return None
+    return proc.stdout.decode().strip()
+
+
+def loadBenchResults(filename):
+    previous = {}
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            for ln in f:
+                d = json.loads(ln)
+                previous[d['name']] = d
+    return previous
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    results = config._bench_results
+    if len(results) == 0:
+        return
+    filename = f'{config.rootpath}/{BENCH_RESULTS_FILENAME}'
+    previous = loadBenchResults(filename)
+    commit = getGitCommit()
+    now = datetime.now().astimezone().isoformat()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    terminalreporter.section('benchmarks')
+    terminalreporter.write_line(f"{'NAME':60s} {'MIN':>10s} {'MEAN':>10s} {'PREVIOUS':>10s} {'DELTA':>8s}")
+    with open(filename, 'a') as f:
+        for d in results:
+            d = dict(d, commit=commit, date=now)
+            f.write(json.dumps(d) + '\n')
+            prev = previous.get(d['name'])
+            if prev is None:
+                prev_min = delta = '-'
+            else:
+                prev_min = f"{prev['min'] * 1000:.2f}ms"
+                delta = f"{(d['min'] / prev['min'] - 1) * 100:+.1f}%"
+            terminalreporter.write_line(f"{d['name']:60s} {d['min'] * 1000:8.2f}ms {d['mean'] * 1000:8.2f}ms {prev_min:>10s} {delta:>8s}")
+
+
+class Benchmark:
+    def __init__(self, name, results):
+        self._name = name
+        self._results = results
+        self.stats = None
+
+    def __call__(self, func, *args, rounds=5, **kwargs):
+        times = []
+        for i in range(rounds):
+            t0 = time.perf_counter()
+            result = func(*args, **kwargs)
+            times.append(time.perf_counter() - t0)
+        self.stats = dict(name=self._name, rounds=rounds, min=min(times), mean=sum(times) / rounds, max=max(times))
+        self._results.append(self.stats)
+        return result
+
+
+@pytest.fixture
+def benchmark(request):
+    yield Benchmark(request.node.name, request.config._bench_results)
+
+
+@pytest.fixture
+def datadir(tmp_path, monkeypatch):
+    conf = config.Config()
+    for sub in ('timelines', 'tmp'):
+        os.makedirs(f'{tmp_path}/{sub}')
+    monkeypatch.setattr(conf, 'INGEST_DATADIR', str(tmp_path))
+    monkeypatch.setattr(conf, 'LOGS_DIR', f'{tmp_path}/logs')
+    yield str(tmp_path)
@@ -0,0 +1,151 @@
+import io
+import shlex
+import shutil
+import subprocess
+import wave
+from datetime import timedelta
+import pytest
+from cablewatch import analysis, timeline
+from test_ingest_index import T0, make_segment
+
+
+FREEZE_METADATA = """frame:50   pts:2000000 pts_time:2
+lavfi.freezedetect.freeze_start=2
+frame:150  pts:6000000 pts_time:6
+lavfi.freezedetect.freeze_duration=4
+lavfi.freezedetect.freeze_end=6
+frame:500  pts:20000000 pts_time:20
+lavfi.freezedetect.freeze_start=20
+"""
+
+SILENCE_METADATA = """frame:10   pts:10240   pts_time:0.64
+lavfi.silence_start=0.5
+frame:30   pts:30720   pts_time:1.92
+lavfi.silence_end=1.5
+lavfi.silence_duration=1
+"""
+
+PPM_FRAME = b'P6\n2 1\n255\n' + b'ABCDEF'
+
+
+class FakeAnalysisPass(analysis.IngestAnalysisPass):
+    def prepareCommand(self, concat_filename, fifos):
+        freeze, silence, pcm, frames = (shlex.quote(fifo) for fifo in fifos)
+        cmd = f'printf %s {shlex.quote(FREEZE_METADATA)} > {freeze} &'
+        cmd += f' printf %s {shlex.quote(SILENCE_METADATA)} > {silence} &'
+        cmd += f' head -c 32000 /dev/zero > {pcm} &'
+        cmd += f" printf '{PPM_FRAME.decode('latin-1')}%.0s' 1 2 3 > {frames} &"
+        cmd += ' wait'
+        return cmd
+
+
+def make_slice(datadir):
+    for i in range(2):
+        make_segment(datadir, T0 + timedelta(seconds=30 * i))
+    index = timeline.IngestIndex()
+    index.rebuild()
+    return next(timeline.IngestTimeLine(name='glob', index=index).slices())
+
+
+def test_prepare_command(datadir):
+    slice = make_slice(datadir)
+    analyzers = [
+        analysis.IngestFreezeDetector(crop='crop=10:10:0:0'),
+        analysis.IngestSilenceDetector(),
+        analysis.IngestPCMExtractor(f'{datadir}/audio.wav'),
+        analysis.IngestFrameSampler(period=10),
+    ]
+    graph = analysis.IngestAnalysisPass(slice=slice, analyzers=analyzers).prepareGraph(
+        ['/tmp/a:0.fifo', '/tmp/1.fifo', '/tmp/2.fifo', '/tmp/3.fifo'])
+    assert graph.split(';') == [
+        '[0:v]split=2[v0][v1]',
+        '[0:a]asplit=2[a0][a1]',
+        r'[v0]crop=10:10:0:0,freezedetect=n=0.003:d=2,metadata=mode=print:file=/tmp/a\\:0.fifo[out0]',
+        '[a0]silencedetect=noise=-30dB:d=0.5,ametadata=mode=print:file=/tmp/1.fifo[out1]',
+        '[a1]aresample=16000,aformat=sample_fmts=s16:channel_layouts=mono[out2]',
+        '[v1]fps=1/10[out3]',
+    ]
+    cmd = analysis.IngestAnalysisPass(slice=slice, analyzers=analyzers[1:2]).prepareCommand('x.concat', ['/tmp/1.fifo'])
+    assert cmd.count(' -i ') == 1
+    assert cmd.endswith(" -map '[out0]' -f null -")
+
+
+def test_dispatch_outputs(datadir):
+    slice = make_slice(datadir)
+    freeze = analysis.IngestFreezeDetector()
+    silence = analysis.IngestSilenceDetector()
+    pcm = analysis.IngestPCMExtractor(f'{datadir}/audio.wav')
+    frames = analysis.IngestFrameSampler(period=5)
+    FakeAnalysisPass(slice=slice, analyzers=[freeze, silence, pcm, frames]).run()
+    assert [(d.offset, d.duration) for d in freeze.detections] == [
+        (timedelta(seconds=2), timedelta(seconds=4)),
+        (timedelta(seconds=20), timedelta(seconds=40)),
+    ]
+    assert freeze.detections[0].begin == T0 + timedelta(seconds=2)
+    assert [(d.begin, d.end) for d in silence.detections] == [
+        (T0 + timedelta(seconds=0.5), T0 + timedelta(seconds=1.5)),
+    ]
+    assert pcm.number_of_frames == 16000
+    with wave.open(pcm.filename, 'rb') as wav:
+        assert wav.getnframes() == 16000
+        assert wav.getframerate() == 16000
+    assert frames.frames == [(T0 + timedelta(seconds=5 * i), PPM_FRAME) for i in range(3)]
+
+
+def test_consumer_errors(datadir):
+    slice = make_slice(datadir)
+
+    def callback(timestamp, data):
+        raise ValueError(timestamp)
+
+    frames = analysis.IngestFrameSampler(callback=callback)
+    with pytest.raises(ValueError):
+        FakeAnalysisPass(slice=slice, analyzers=[analysis.IngestFreezeDetector(), analysis.IngestSilenceDetector(),
+            analysis.IngestPCMExtractor(f'{datadir}/audio.wav'), frames]).run()
+
+
+def test_sampled_frames_timestamps():
+    class ShiftedSlice:
+        begin = T0
+
+        def getTimestamp(self, offset):
+            # the slice starts 10s after the beginning of its first segment
+            return T0 + timedelta(seconds=10) + offset
+
+    frames = analysis.IngestFrameSampler(period=5)
+    frames.consume(ShiftedSlice(), io.BytesIO(PPM_FRAME * 2))
+    assert [timestamp for timestamp, _ in frames.frames] == [T0 + timedelta(seconds=10), T0 + timedelta(seconds=15)]
+
+
+def test_default_analyzer(datadir):
+    class NullAnalyzer(analysis.IngestAnalyzer):
+        MEDIA = 'a'
+
+    slice = make_slice(datadir)
+    analyzers = [NullAnalyzer(), analysis.IngestFreezeDetector(crop='')]
+    graph = analysis.IngestAnalysisPass(slice=slice, analyzers=analyzers).prepareGraph(['/tmp/0.fifo', '/tmp/1.fifo'])
+    assert graph.split(';')[2] == '[a0]anull[out0]'
+    cmd = analysis.IngestAnalysisPass(slice=slice, analyzers=analyzers).prepareCommand('x.concat', ['/tmp/0.fifo',
+        '/tmp/1.fifo'])
+    assert " -map '[out0]' -f null -" in cmd
+    analyzers[0].consume(slice, io.BytesIO(b'x' * 100000))
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_single_decode(datadir):
+    seg = make_segment(datadir, T0, duration=4)
+    cmd = 'ffmpeg -nostdin -y -loglevel error -f lavfi -i color=c=black:s=320x240:r=25:d=4'
+    cmd += ' -f lavfi -i anullsrc=r=48000:cl=stereo -t 4 -c:v libx264 -c:a aac -f mpegts'
+    subprocess.run(f'{cmd} {seg.filename}', shell=True, check=True)
+    index = timeline.IngestIndex()
+    index.rebuild()
+    slice = next(timeline.IngestTimeLine(name='glob', index=index).slices())
+    freeze = analysis.IngestFreezeDetector(crop='crop=100:50:0:0', duration=1)
+    silence = analysis.IngestSilenceDetector()
+    pcm = analysis.IngestPCMExtractor(f'{datadir}/audio.wav')
+    frames = analysis.IngestFrameSampler(period=1)
+    slice.analyze([freeze, silence, pcm, frames])
+    assert len(freeze.detections) == 1
+    assert len(silence.detections) == 1
+    assert abs(pcm.number_of_frames - 4 * 16000) < 16000
+    assert 3 <= len(frames.frames) <= 5
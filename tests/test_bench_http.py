@@ -0,0 +1,77 @@
+import time
+import random
+import asyncio
+from datetime import timedelta
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from cablewatch import config, http, ingest, replay, timeline
+from test_ingest_index import T0, make_segment
+
+
+READERS = [1, 16, 64]
+SEGMENT_SIZE = 188 * 5000
+
+pytestmark = pytest.mark.bench
+
+
+async def read_segments(client, basenames, deadline, counters):
+    rng = random.Random(len(counters['latencies']))
+    while time.monotonic() < deadline:
+        t0 = time.monotonic()
+        async with client.get(f'/api/segments/{rng.choice(basenames)}') as response:
+            if response.status != 200:
+                counters['errors'] += 1
+                continue
+            data = await response.read()
+            counters['bytes'] += len(data)
+        counters['latencies'].append(time.monotonic() - t0)
+
+
+async def serve_during_ingest(readers, duration):
+    bench = replay.IngestReplayBenchmark(hours=0.2, speed=240)
+    http_service = http.HTTPService()
+    service = ingest.IngestService(http_service=http_service, command=bench.command())
+    bench.hookService(service)
+    ingest.IngestTimeLineService(http_service=http_service, ingest_service=service)
+    basenames = [seg.basename for seg in timeline.IngestIndex.open().getSegments().values()]
+    client = TestClient(TestServer(http_service._app))
+    await client.start_server()
+    monitor = asyncio.create_task(bench.monitorLoopLag())
+    counters = dict(bytes=0, errors=0, latencies=[])
+    try:
+        await service.start()
+        t0 = time.monotonic()
+        await asyncio.gather(*[read_segments(client, basenames, t0 + duration, counters) for i in range(readers)])
+        elapsed = time.monotonic() - t0
+        await service.stop()
+    finally:
+        monitor.cancel()
+        await client.close()
+    return dict(
+        readers = readers,
+        elapsed = elapsed,
+        bytes = counters['bytes'],
+        throughput = counters['bytes'] / elapsed,
+        requests = len(counters['latencies']),
+        errors = counters['errors'],
+        latency_p99 = bench.percentile(counters['latencies'], 0.99),
+        loop_lag_max = max(bench._loop_lags, default=None),
+        ingested_segments = len(bench._rename_latencies),
+    )
+
+
+@pytest.mark.parametrize('readers', READERS)
+def test_segment_serving_during_ingest(datadir, monkeypatch, benchmark, readers):
+    conf = config.Config()
+    monkeypatch.setattr(conf, 'WEB_MAX_REQUESTS_PER_CLIENT', readers)
+    monkeypatch.chdir(datadir)
+    for i in range(50):
+        seg = make_segment(datadir, T0 + timedelta(seconds=30 * i))
+        with open(seg.filename, 'wb') as f:
+            f.write(bytes(SEGMENT_SIZE))
+    timeline.IngestIndex().rebuild()
+    report = benchmark(lambda: asyncio.run(serve_during_ingest(readers, 3.0)), rounds=1)
+    print(report)
+    assert report['errors'] == 0
+    assert report['requests'] > 0
+    assert report['ingested_segments'] > 0
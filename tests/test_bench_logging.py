@@ -0,0 +1,47 @@
+import sys
+import time
+import asyncio
+import pytest
+from loguru import logger
+from cablewatch import config, loghlp, replay
+
+
+pytestmark = pytest.mark.bench
+
+NOISE = [
+    'WARNING: [youtube] Z-Nwo-ypKtM: Some formats are possibly damaged. They will be deprioritized',
+    '[https @ 0x7f3c2c0b1a40] HTTP error 503 Service Unavailable',
+    'WARNING: [youtube] Z-Nwo-ypKtM: fragment 1234 not found, retrying (3/10)',
+    '[mpegts @ 0x55d0c0a11200] Packet corrupt (stream = 0, dts = 8123456789)',
+]
+
+# a terminal over ssh or a full journald pipe
+SLOW_CONSOLE_DELAY = 0.0002
+
+
+def write_slow_console(s):
+    time.sleep(SLOW_CONSOLE_DELAY)
+
+
+@pytest.mark.parametrize('logs,sampling', [('sync', False), ('enqueue', False), ('enqueue', True)])
+def test_loop_lag_with_noisy_command(datadir, monkeypatch, logs, sampling):
+    monkeypatch.chdir(datadir)
+    monkeypatch.setattr(loghlp, 'writeConsole', write_slow_console)
+    conf = config.Config()
+    if not sampling:
+        monkeypatch.setattr(conf, 'INGEST_LOG_SAMPLING_BURST', 1 << 30)
+    with open(f'{datadir}/noise.log', 'w') as f:
+        f.write('\n'.join(NOISE) + '\n')
+    loghlp.setup(enqueue=logs == 'enqueue')
+    try:
+        bench = replay.IngestReplayBenchmark(hours=0.5, speed=600, stderr_filename=f'{datadir}/noise.log',
+            noise_burst=100)
+        report = asyncio.run(bench.run(timeout=60))
+    finally:
+        asyncio.run(loghlp.shutdown())
+        logger.add(sys.stderr)
+    print(f"logs={logs} sampling={sampling}: loop lag p99={report['loop_lag_p99'] * 1000:.1f}ms "
+        f"max={report['loop_lag_max'] * 1000:.1f}ms, service cpu={report['service_cpu']:.2f}s")
+    assert report['segments'] == report['expected_segments']
+    if logs == 'enqueue' and sampling:
+        assert report['loop_lag_max'] < 0.1
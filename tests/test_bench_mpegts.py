@@ -0,0 +1,49 @@
+import os
+from datetime import timedelta
+import pytest
+from cablewatch import mpegts
+from test_mpegts import AUDIO_PID, make_ts
+
+
+pytestmark = pytest.mark.bench
+
+
+@pytest.fixture(scope='module')
+def segment_filename(tmp_path_factory):
+    # 30s segment at ~4 Mbit/s
+    filename = f"{tmp_path_factory.mktemp('mpegts')}/segment.ts"
+    make_ts(filename, seconds=30, video_frame_size=15000)
+    return filename
+
+
+def report_throughput(benchmark, filename):
+    size = os.path.getsize(filename)
+    throughput = size / benchmark.stats['min'] / 1e6
+    print(f"{benchmark.stats['name']}: {size / 1e6:.1f} MB in {benchmark.stats['min'] * 1000:.1f}ms, {throughput:.0f} MB/s")
+    return throughput
+
+
+def test_walk_packets(segment_filename, benchmark):
+    def walk():
+        with mpegts.IngestTSDemuxer(segment_filename) as demuxer:
+            return sum(1 for _ in demuxer.iterPackets())
+    number_of_packets = benchmark(walk)
+    assert number_of_packets == os.path.getsize(segment_filename) // mpegts.PACKET_SIZE
+    report_throughput(benchmark, segment_filename)
+
+
+def test_extract_audio_payload(segment_filename, benchmark):
+    def extract():
+        with mpegts.IngestTSDemuxer(segment_filename) as demuxer:
+            return sum(pes.size for pes in demuxer.iterPES(AUDIO_PID))
+    assert benchmark(extract) > 0
+    assert report_throughput(benchmark, segment_filename) > 50
+
+
+def test_verify_duration(segment_filename, benchmark):
+    def verify():
+        with mpegts.IngestTSDemuxer(segment_filename) as demuxer:
+            return demuxer.getDuration()
+    duration = benchmark(verify)
+    assert abs(duration - timedelta(seconds=30)) < timedelta(seconds=0.05)
+    assert benchmark.stats['min'] < 0.05
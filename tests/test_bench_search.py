@@ -0,0 +1,69 @@
+import random
+from datetime import timedelta
+import pytest
+from cablewatch import search
+from test_ingest_index import T0
+
+
+pytestmark = pytest.mark.bench
+
+WORDS = ('crise agricole gouvernement réforme retraites budget élection président ministre assemblée '
+    'grève syndicats inflation prix énergie europe guerre ukraine sécurité police justice école '
+    'santé hôpital climat sécheresse agriculteurs autoroutes débat opposition sondage économie').split()
+TOPICS = ['Crise agricole: un virage populiste ?', 'Retraites: la réforme en question',
+    'Budget: le gouvernement sous pression', 'Inflation: les prix de l\'énergie flambent',
+    'Ukraine: la guerre continue', 'Hôpital: les urgences saturées']
+
+
+def generate_month():
+    rnd = random.Random(0)
+    t = T0
+    end = T0 + timedelta(days=30)
+    while t < end:
+        yield search.IngestSearchRecord(type='topic', begin=t, end=t + timedelta(minutes=10), content=rnd.choice(TOPICS))
+        for i in range(60):
+            begin = t + timedelta(seconds=10 * i)
+            yield search.IngestSearchRecord(type=search.SPEECH_TYPE, begin=begin, end=begin + timedelta(seconds=10),
+                content=' '.join(rnd.choice(WORDS) for _ in range(20)), locutor=f'locutor {rnd.randrange(4)}')
+        t += timedelta(minutes=10)
+
+
+@pytest.fixture(scope='module')
+def search_index(tmp_path_factory):
+    index = search.IngestSearchIndex(f"{tmp_path_factory.mktemp('search')}/search.sqlite")
+    records = list(generate_month())
+    for i in range(0, len(records), 10000):
+        index.addRecords(records[i:i + 10000])
+    index.optimize()
+    print(f'{index.number_of_results} results indexed')
+    return index
+
+
+def test_search_month(search_index, benchmark):
+    records = benchmark(search_index.search, 'crise agricole')
+    assert len(records) == search.IngestSearchIndex.LIMIT
+    assert benchmark.stats['min'] < 0.5
+
+
+def test_search_last_week(search_index, benchmark):
+    begin = T0 + timedelta(days=23)
+    records = benchmark(search_index.search, 'crise agricole', begin=begin, end=begin + timedelta(days=7),
+        types=['topic'])
+    assert all(r.type == 'topic' and r.begin >= begin - timedelta(minutes=10) for r in records)
+    assert benchmark.stats['min'] < 0.5
+
+
+def test_search_rare_word(search_index, benchmark):
+    records = benchmark(search_index.search, 'urgences saturées')
+    assert all(r.content == 'Hôpital: les urgences saturées' for r in records)
+    assert benchmark.stats['min'] < 0.05
+
+
+def test_index_day(tmp_path, benchmark):
+    records = [r for r in generate_month() if r.begin < T0 + timedelta(days=1)]
+
+    def index_day():
+        index = search.IngestSearchIndex(f'{tmp_path}/search-{random.random()}.sqlite')
+        return index.addRecords(records)
+    assert benchmark(index_day, rounds=3) == len(records)
+    print(f"{len(records)} results per day indexed in {benchmark.stats['min'] * 1000:.0f}ms")
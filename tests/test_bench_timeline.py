@@ -0,0 +1,98 @@
+import io
+import os
+import random
+import contextlib
+from datetime import datetime, timedelta
+import pytest
+from cablewatch import config, timeline
+
+
+T0 = datetime(2025, 12, 1, 6, 30)
+SIZES = [1000, 10000, 100000]
+
+pytestmark = pytest.mark.bench
+
+
+def generate_datadir(datadir, num_segments, *, seed=0):
+    rng = random.Random(seed)
+    for sub in ('timelines', 'tmp'):
+        os.makedirs(f'{datadir}/{sub}', exist_ok=True)
+    begin = T0
+    for i in range(num_segments):
+        duration = round(rng.uniform(29.9, 30.1), 2)
+        basename = timeline.SEGMENT_FORMAT.format(datetime=timeline.formatSegmentDatetime(begin), duration=duration)
+        open(f'{datadir}/{basename}', 'w').close()
+        begin += timedelta(seconds=duration)
+        if rng.random() < 1 / 240:
+            open(f'{datadir}/{basename}.hole', 'w').close()
+            begin += timedelta(seconds=rng.uniform(5, 60))
+        elif rng.random() < 1 / 500:
+            begin += timedelta(seconds=rng.uniform(2, 10))
+    for name, duration in ('skeleton', 180), ('banners', 3600), ('speech', 900):
+        tl = timeline.IngestTimeLine(name=name, begin=T0 + timedelta(hours=1), duration=timedelta(seconds=duration),
+            load=False, index=timeline.IngestIndex.open())
+        tl.save()
+    timeline.IngestIndex().rebuild()
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=[f'{n // 1000}k' for n in SIZES])
+def synthetic_datadir(request, tmp_path_factory):
+    conf = config.Config()
+    datadir = str(tmp_path_factory.mktemp(f'bench-{request.param}'))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(conf, 'INGEST_DATADIR', datadir)
+        generate_datadir(datadir, request.param)
+        yield datadir
+
+
+@pytest.fixture
+def glob_timeline(synthetic_datadir):
+    return timeline.IngestTimeLine(name='glob')
+
+
+def test_timeline_construction(synthetic_datadir, benchmark):
+    tl = benchmark(timeline.IngestTimeLine, name='glob')
+    assert len(tl.segments) > 0
+
+
+def test_timeline_construction_without_index(synthetic_datadir, benchmark):
+    def construct():
+        index = timeline.IngestIndex()
+        index.scan()
+        return timeline.IngestTimeLine(name='glob', index=index)
+    benchmark(construct)
+
+
+def test_load_instances(synthetic_datadir, benchmark):
+    instances = benchmark(timeline.IngestTimeLine.loadInstances)
+    assert set(instances) == {'glob', 'skeleton', 'banners', 'speech'}
+
+
+def test_slices(glob_timeline, benchmark):
+    slices = benchmark(lambda: list(glob_timeline.slices()))
+    assert len(slices) > 1
+
+
+def test_lookup_segment_from_timestamp(glob_timeline, benchmark):
+    rng = random.Random(0)
+    timestamps = []
+    for i in range(100):
+        seg = rng.choice(list(glob_timeline.segments.values()))
+        timestamps.append(seg.begin + timedelta(seconds=10))
+
+    def lookup():
+        for ts in timestamps:
+            glob_timeline.lookupSegmentFromTimestamp(ts)
+    benchmark(lookup)
+
+
+def test_generate_concat_content(glob_timeline, benchmark):
+    slices = list(glob_timeline.slices())
+    benchmark(lambda: [s.generateConcatContent() for s in slices])
+
+
+def test_timeline_tool_ls(synthetic_datadir, benchmark):
+    def ls():
+        with contextlib.redirect_stdout(io.StringIO()):
+            timeline.IngestTimeLineTool(['cablewatch-timeline', 'ls'])()
+    benchmark(ls, rounds=3)
@@ -0,0 +1,126 @@
+import os
+import struct
+import wave
+import asyncio
+import types
+from datetime import timedelta
+from cablewatch import config, derivatives, http, ingest, timeline
+from test_ingest_index import T0, make_segment
+
+
+COMMANDS = dict(
+    thumbnails = 'cp {input} {output}',
+    proxy = 'echo proxy > {output}',
+    banner = 'echo {crop} > {output}; nice > {output}.nice',
+    audio = 'cp {input} {output}',
+)
+
+
+def test_generate(datadir):
+    conf = config.Config()
+    segs = [make_segment(datadir, T0 + timedelta(seconds=30 * i)) for i in range(3)]
+
+    async def run():
+        pool = derivatives.IngestDerivatives(kinds=['thumbnails', 'proxy', 'banner', 'audio'], workers=2,
+            niceness=5, commands=COMMANDS)
+        pool.start()
+        for seg in segs:
+            pool.submit(seg)
+        await pool.join()
+        await pool.stop()
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.stats == dict(processed=12, failed=0, dropped=0)
+    for seg in segs:
+        for kind in 'thumbnails', 'proxy', 'banner', 'audio':
+            assert os.path.exists(derivatives.IngestDerivatives.getFileName(conf.INGEST_DERIVATIVES_DIR, seg, kind))
+    filename = derivatives.IngestDerivatives.getFileName(conf.INGEST_DERIVATIVES_DIR, segs[0], 'banner')
+    with open(filename) as f:
+        assert f.read().strip() == conf.INGEST_BANNER_CROP
+    with open(f'{filename}.tmp.nice') as f:
+        assert int(f.read()) == os.nice(0) + 5
+    assert [fn for fn in os.listdir(conf.INGEST_DERIVATIVES_DIR) if fn.endswith('.tmp')] == []
+
+
+def test_bounded_queue_and_failures(datadir):
+    segs = [make_segment(datadir, T0 + timedelta(seconds=30 * i)) for i in range(5)]
+
+    async def run():
+        pool = derivatives.IngestDerivatives(kinds=['proxy'], workers=1, max_pending=2,
+            commands=dict(proxy='exit 1'))
+        for seg in segs:
+            pool.submit(seg)
+        pool.start()
+        await pool.join()
+        await pool.stop()
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.stats == dict(processed=0, failed=2, dropped=3)
+
+
+def test_service_submits_finalized_segments(datadir, monkeypatch):
+    conf = config.Config()
+    monkeypatch.setattr(conf, 'INGEST_DERIVATIVES', ['thumbnails'])
+    monkeypatch.setattr(derivatives.IngestDerivatives, 'COMMANDS', COMMANDS)
+    monkeypatch.chdir(datadir)
+
+    async def run():
+        service = ingest.IngestService(http_service=http.HTTPService(), recording_requested=False)
+        await service.start()
+        seg = make_segment(datadir, T0)
+        tmp_filename = f'{datadir}/tmp/segment.ts'
+        os.rename(seg.filename, tmp_filename)
+        service.commitSegment(types.SimpleNamespace(standby_origin=False), tmp_filename, seg.filename)
+        await service._derivatives.join()
+        sts = service.prepareStatus()
+        await service.stop()
+        return seg, sts
+
+    seg, sts = asyncio.run(run())
+    assert sts['derivatives_processed'] == 1
+    assert (sts['health'], sts['scheduler_pending'], sts['scheduler_running']) == ('ok', 0, 0)
+    assert os.path.exists(derivatives.IngestDerivatives.getFileName(conf.INGEST_DERIVATIVES_DIR, seg, 'thumbnails'))
+    assert len(timeline.IngestIndex.open().getSegments()) == 1
+
+
+def write_audio(filename, value, seconds):
+    with wave.open(filename, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(timeline.AUDIO_SAMPLE_WIDTH)
+        wav.setframerate(timeline.AUDIO_SAMPLE_RATE)
+        wav.writeframes(struct.pack('<h', value) * round(seconds * timeline.AUDIO_SAMPLE_RATE))
+
+
+def test_read_slice_audio(datadir):
+    conf = config.Config()
+    os.makedirs(conf.INGEST_DERIVATIVES_DIR)
+    for i in range(4):
+        make_segment(datadir, T0 + timedelta(seconds=30 * i), hole=(i == 2))
+    index = timeline.IngestIndex()
+    index.rebuild()
+    segs = list(index.getSegments().values())
+    assert [seg.hole for seg in segs] == [False, False, True, False]
+    # the hole marks the last segment before a restart, its data and sidecar are valid
+    for i, seconds in enumerate([29.5, 30, 31]):
+        write_audio(segs[i].getDerivativeFileName('audio', 'wav'), i + 1, seconds)
+    segs[0].inpoint = timedelta(seconds=10)
+    segs[2].outpoint = timedelta(seconds=25)
+    slice = timeline.IngestTimeSlice(timeline=None, segments=segs[:3])
+    assert slice.hasAudio()
+    samples = b''.join(slice.readAudio(chunk_frames=1000))
+    samples = struct.unpack(f'<{len(samples) // 2}h', samples)
+    rate = timeline.AUDIO_SAMPLE_RATE
+    assert len(samples) == 75 * rate
+    assert samples[:int(19.5 * rate)] == (1,) * int(19.5 * rate)
+    # a short sidecar is padded with silence
+    assert samples[int(19.5 * rate):20 * rate] == (0,) * int(0.5 * rate)
+    assert samples[20 * rate:50 * rate] == (2,) * 30 * rate
+    assert samples[50 * rate:] == (3,) * 25 * rate
+    assert slice.writeAudio(f'{datadir}/slice.wav') == 75 * rate
+
+    # a missing sidecar is read as silence
+    slice = timeline.IngestTimeSlice(timeline=None, segments=segs[3:])
+    assert not slice.hasAudio()
+    assert b''.join(slice.readAudio()) == bytes(30 * rate * timeline.AUDIO_SAMPLE_WIDTH)
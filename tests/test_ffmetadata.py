@@ -0,0 +1,44 @@
+import io
+from datetime import timedelta
+from cablewatch import ffmetadata, timeline
+from test_ingest_index import T0, populate
+
+
+METADATA = b"""frame:0    pts:0       pts_time:0
+lavfi.silence_start=0
+frame:12   pts:1474560 pts_time:30.72
+lavfi.silence_end=31.5
+lavfi.silence_duration=31.5
+frame:40   pts:NOPTS   pts_time:NOPTS
+lavfi.r128.M=-23.1
+frame:41   pts:6291456 pts_time:65.536
+lavfi.silence_start=65
+"""
+
+
+def test_escape_filter_value():
+    assert ffmetadata.escapeFilterValue('/tmp/a,b') == r'/tmp/a\,b'
+    assert ffmetadata.escapeFilterValue('/tmp/a:b') == r'/tmp/a\\:b'
+    assert ffmetadata.prepareFilter('/tmp/x', 'a') == 'ametadata=mode=print:file=/tmp/x'
+
+
+def test_read_events(datadir):
+    populate(datadir)
+    index = timeline.IngestIndex()
+    index.rebuild()
+    slice = list(timeline.IngestTimeLine(name='glob', index=index).slices())[1]
+    assert slice.getTimestamp(timedelta(seconds=0)) == T0 + timedelta(seconds=65)
+    assert slice.getTimestamp(timedelta(seconds=70)) == T0 + timedelta(seconds=195)
+
+    events = list(ffmetadata.IngestMetadataReader(io.BytesIO(METADATA), slice=slice))
+    assert [e.frame for e in events] == [0, 12, 40, 41]
+    assert events[1].metadata == {'lavfi.silence_end': '31.5', 'lavfi.silence_duration': '31.5'}
+    assert events[1].getFloat('lavfi.silence_end') == 31.5
+    assert events[1].timestamp == T0 + timedelta(seconds=95.72)
+    assert events[2].pts is None and events[2].timestamp is None
+    assert 'lavfi.r128.M' in events[2]
+    assert events[3].timestamp == T0 + timedelta(seconds=190.536)
+
+    events = list(ffmetadata.IngestMetadataReader(io.StringIO(METADATA.decode())))
+    assert [e.offset for e in events] == [timedelta(seconds=0), timedelta(seconds=30.72), None, timedelta(seconds=65.536)]
+    assert events[0].timestamp is None
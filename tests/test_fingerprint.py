@@ -0,0 +1,118 @@
+import os
+import wave
+from datetime import timedelta
+import numpy as np
+from cablewatch import config, fingerprint, timeline
+from test_ingest_index import T0, make_segment
+
+
+RATE = timeline.AUDIO_SAMPLE_RATE
+
+
+def make_jingle(seed, seconds=3):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(0.1 * RATE)) / RATE
+    notes = [sum(np.sin(2 * np.pi * f * t) for f in rng.uniform(200, 6000, 3)) for _ in range(int(seconds * 10))]
+    return np.concatenate(notes) * 3000
+
+
+def write_wav(filename, samples):
+    with wave.open(filename, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes(np.clip(samples, -32768, 32767).astype('<i2').tobytes())
+
+
+def populate(datadir, jingle, positions):
+    conf = config.Config()
+    os.makedirs(conf.INGEST_DERIVATIVES_DIR)
+    rng = np.random.default_rng(0)
+    segs = []
+    for i in range(4):
+        seg = make_segment(datadir, T0 + timedelta(seconds=30 * i))
+        samples = rng.normal(0, 500, 30 * RATE)
+        for position in positions:
+            offset = round((position - 30 * i) * RATE)
+            if 0 <= offset <= len(samples) - len(jingle):
+                samples[offset:offset + len(jingle)] += jingle
+        write_wav(seg.getDerivativeFileName('audio', 'wav'), samples)
+        segs.append(seg)
+    return segs
+
+
+def test_index_and_query(datadir):
+    jingle = make_jingle(1)
+    populate(datadir, jingle, [4.0, 41.5, 70.25])
+    index = timeline.IngestIndex()
+    index.rebuild()
+    fp_index = fingerprint.IngestFingerprintIndex()
+    assert len(fp_index.update(index)) == 3
+    assert fp_index.update(index) == []
+
+    matches = fp_index.query(jingle.astype(np.float32))
+    assert len(matches) == 3
+    for match, position in zip(matches, [4.0, 41.5, 70.25]):
+        assert abs(match.begin - (T0 + timedelta(seconds=position))) < timedelta(seconds=0.1)
+        assert match.duration == timedelta(seconds=3)
+        assert match.score >= fp_index.MIN_MATCHES
+
+    matches = fp_index.query(jingle.astype(np.float32), begin=T0 + timedelta(seconds=30), end=T0 + timedelta(seconds=60))
+    assert len(matches) == 1
+
+    clip = f'{datadir}/clip.wav'
+    write_wav(clip, make_jingle(2))
+    assert fp_index.queryFile(clip) == []
+
+
+def test_holes_and_missing_audio(datadir):
+    segs = populate(datadir, make_jingle(1), [])
+    os.remove(segs[2].getDerivativeFileName('audio', 'wav'))
+    # the last segment before a restart is complete, but it has no overlap into the next one
+    open(f'{segs[1].filename}.hole', 'w').close()
+    index = timeline.IngestIndex()
+    index.rebuild()
+    assert index.isHole(segs[1].begin)
+    fp_index = fingerprint.IngestFingerprintIndex()
+    assert [seg.basename for seg in fp_index.update(index)] == [segs[0].basename, segs[1].basename]
+    no_overlap = fingerprint.IngestFingerprintIndex(f'{datadir}/no-overlap.sqlite')
+    with fp_index.transaction() as db:
+        number_of_hashes = dict(db.execute('SELECT basename, number_of_hashes FROM segments'))
+    assert number_of_hashes[segs[1].basename] == no_overlap.addSegment(index.getSegment(segs[1].begin))
+    assert number_of_hashes[segs[0].basename] > no_overlap.addSegment(index.getSegment(segs[0].begin))
+
+
+def test_peaks_next_to_loud_passage():
+    fingerprinter = fingerprint.IngestFingerprinter()
+    jingle = make_jingle(1) * 0.3
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 500, 30 * RATE)
+    samples[:10 * RATE] += rng.normal(0, 20000, 10 * RATE)
+    samples[15 * RATE:15 * RATE + len(jingle)] += jingle
+    hashes, _ = fingerprinter.computeHashes(samples.astype(np.float32))
+    clip_hashes, _ = fingerprinter.computeHashes(jingle.astype(np.float32))
+    assert np.isin(clip_hashes, hashes).sum() >= fingerprint.IngestFingerprintIndex.MIN_MATCHES
+
+
+def test_segment_overlap(datadir):
+    os.makedirs(config.Config().INGEST_DERIVATIVES_DIR)
+    jingle = make_jingle(1)
+    # the jingle spans the boundary between the second and the third segment
+    samples = np.random.default_rng(0).normal(0, 500, 120 * RATE)
+    samples[round(58.5 * RATE):round(58.5 * RATE) + len(jingle)] += jingle
+    for i in range(4):
+        seg = make_segment(datadir, T0 + timedelta(seconds=30 * i))
+        write_wav(seg.getDerivativeFileName('audio', 'wav'), samples[30 * i * RATE:30 * (i + 1) * RATE])
+    index = timeline.IngestIndex()
+    index.rebuild()
+    fp_index = fingerprint.IngestFingerprintIndex()
+    # the newest segment waits for its successor
+    assert len(fp_index.update(index)) == 3
+    no_overlap = fingerprint.IngestFingerprintIndex(f'{datadir}/no-overlap.sqlite')
+    for seg in list(index.getSegments().values())[:3]:
+        no_overlap.addSegment(seg)
+
+    matches = fp_index.query(jingle.astype(np.float32))
+    assert len(matches) == 1
+    assert abs(matches[0].begin - (T0 + timedelta(seconds=58.5))) < timedelta(seconds=0.1)
+    assert matches[0].score > no_overlap.query(jingle.astype(np.float32))[0].score
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+from cablewatch import config, hls, http, ingest, timeline
+
+
+T0 = datetime(2025, 12, 26, 5, 30, tzinfo=timezone.utc)
+
+
+class HLSStandInServer:
+    def __init__(self, *, segment_duration=2.0, speed=20.0, window=5, packets=10):
+        self._segment_duration = segment_duration
+        self._speed = speed
+        self._window = window
+        self._packets = packets
+        self._start = None
+        self.requests = []
+        app = web.Application()
+        app.router.add_get('/master.m3u8', self.handleMaster)
+        app.router.add_get('/live/index.m3u8', self.handlePlaylist)
+        app.router.add_get('/live/seg{sequence}.ts', self.handleSegment)
+        self._runner = web.AppRunner(app)
+        self.url = None
+
+    async def start(self):
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        self._start = time.monotonic()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    @staticmethod
+    def segmentData(sequence, packets):
+        return (b'\x47' + sequence.to_bytes(4, 'big') + bytes(183)) * packets
+
+    async def handleMaster(self, request):
+        text = '#EXTM3U\n'
+        text += '#EXT-X-STREAM-INF:BANDWIDTH=100000\nlow.m3u8\n'
+        text += '#EXT-X-STREAM-INF:BANDWIDTH=900000,RESOLUTION=1280x720\nlive/index.m3u8\n'
+        return web.Response(text=text)
+
+    async def handlePlaylist(self, request):
+        self.requests.append(request.path)
+        elapsed = (time.monotonic() - self._start) * self._speed
+        last = int(elapsed / self._segment_duration) + self._window
+        first = last - self._window
+        text = '#EXTM3U\n#EXT-X-VERSION:3\n'
+        text += f'#EXT-X-TARGETDURATION:{self._segment_duration / self._speed}\n'
+        text += f'#EXT-X-MEDIA-SEQUENCE:{first}\n'
+        pdt = T0 + timedelta(seconds=first * self._segment_duration)
+        text += f'#EXT-X-PROGRAM-DATE-TIME:{pdt.isoformat()}\n'
+        for sequence in range(first, last):
+            text += f'#EXTINF:{self._segment_duration:.3f},\nseg{sequence}.ts\n'
+        return web.Response(text=text)
+
+    async def handleSegment(self, request):
+        sequence = int(request.match_info['sequence'])
+        self.requests.append(request.path)
+        return web.Response(body=self.segmentData(sequence, self._packets), content_type='video/mp2t')
+
+
+def test_parse_media_playlist():
+    text = '\n'.join([
+        '#EXTM3U',
+        '#EXT-X-TARGETDURATION:5',
+        '#EXT-X-MEDIA-SEQUENCE:42',
+        '#EXT-X-PROGRAM-DATE-TIME:2025-12-26T05:30:00.000Z',
+        '#EXTINF:5.0,',
+        'a.ts',
+        '#EXTINF:4.5,',
+        'b.ts',
+        '#EXT-X-DISCONTINUITY',
+        '#EXT-X-PROGRAM-DATE-TIME:2025-12-26T05:31:00.000+00:00',
+        '#EXTINF:5.0,',
+        'https://cdn/c.ts',
+        '#EXT-X-ENDLIST',
+    ])
+    pl = hls.HLSPlaylist.parse(text, 'http://host/live/index.m3u8')
+    assert pl.endlist
+    assert pl.target_duration == 5
+    assert [seg.sequence for seg in pl.segments] == [42, 43, 44]
+    assert [seg.uri for seg in pl.segments] == ['http://host/live/a.ts', 'http://host/live/b.ts', 'https://cdn/c.ts']
+    assert pl.segments[1].program_date_time == T0 + timedelta(seconds=5)
+    assert pl.segments[2].program_date_time == T0 + timedelta(seconds=60)
+    assert [seg.discontinuity for seg in pl.segments] == [False, False, True]
+
+
+def test_fetcher_delivers_in_order():
+    async def run():
+        server = HLSStandInServer()
+        await server.start()
+        received = []
+        fetcher = hls.HLSFetcher(f'{server.url}/master.m3u8', on_segment=lambda seg, data: received.append((seg, data)))
+        task = asyncio.create_task(fetcher.run())
+        await asyncio.sleep(1.5)
+        fetcher.stop()
+        await task
+        await server.stop()
+        sequences = [seg.sequence for seg, data in received]
+        assert len(sequences) > 10
+        assert sequences == list(range(sequences[0], sequences[0] + len(sequences)))
+        for seg, data in received:
+            assert data == server.segmentData(seg.sequence, 10)
+        assert fetcher.stats['errors'] == 0
+
+    asyncio.run(run())
+
+
+def test_hls_engine(datadir, monkeypatch):
+    conf = config.Config()
+    monkeypatch.setattr(conf, 'INGEST_ENGINE', 'hls')
+    monkeypatch.setattr(ingest, 'SEGMENT_DURATION', 10)
+    monkeypatch.chdir(datadir)
+
+    async def run():
+        server = HLSStandInServer()
+        await server.start()
+        monkeypatch.setattr(conf, 'INGEST_YOUTUBE_STREAM_URL', f'{server.url}/live/index.m3u8')
+        service = ingest.IngestService(http_service=http.HTTPService())
+        await service.start()
+        await asyncio.sleep(2.5)
+        await service.stop()
+        await server.stop()
+
+    asyncio.run(run())
+    segments = list(timeline.IngestIndex.open().getSegments().values())
+    assert len(segments) >= 3
+    for prev, seg in zip(segments, segments[1:]):
+        assert seg.begin == prev.end
+    for seg in segments[:-1]:
+        assert seg.duration == timedelta(seconds=10)
+        assert os.path.getsize(seg.filename) == 5 * 10 * 188
+    assert os.listdir(f'{datadir}/tmp') == []
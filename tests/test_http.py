@@ -0,0 +1,98 @@
+import os
+import gzip
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from cablewatch import http
+
+
+def run_client(rootdir, scenario, **kwargs):
+    async def run():
+        http_service = http.HTTPService()
+        server = http_service.addFileRoute('/files', rootdir, **kwargs)
+        client = TestClient(TestServer(http_service._app))
+        await client.start_server()
+        try:
+            await scenario(client, server)
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_file_route(tmp_path):
+    os.makedirs(f'{tmp_path}/root/results')
+    with open(f'{tmp_path}/root/results/freeze.csv', 'w') as f:
+        f.write('begin,end\n' * 1000)
+    with open(f'{tmp_path}/secret.txt', 'w') as f:
+        f.write('secret')
+    http.FileServer.precompress(f'{tmp_path}/root/results/freeze.csv')
+
+    async def scenario(client, server):
+        response = await client.get('/files/results/freeze.csv', headers={'Accept-Encoding': 'identity'})
+        assert response.status == 200
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert await response.text() == 'begin,end\n' * 1000
+        etag = response.headers['ETag']
+
+        response = await client.get('/files/results/freeze.csv', headers={'If-None-Match': etag,
+            'Accept-Encoding': 'identity'})
+        assert response.status == 304
+
+        response = await client.get('/files/results/freeze.csv', headers={'Range': 'bytes=10-19',
+            'Accept-Encoding': 'identity'})
+        assert response.status == 206
+        assert await response.text() == 'begin,end\n'
+
+        response = await client.get('/files/results/freeze.csv', headers={'Accept-Encoding': 'gzip'},
+            auto_decompress=False)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(await response.read()) == b'begin,end\n' * 1000
+
+        # the file is rewritten after its .gz sibling, the stale sibling is not served
+        with open(f'{tmp_path}/root/results/freeze.csv', 'w') as f:
+            f.write('begin,end\n' * 10)
+        st = os.stat(f'{tmp_path}/root/results/freeze.csv.gz')
+        os.utime(f'{tmp_path}/root/results/freeze.csv.gz', ns=(st.st_atime_ns, st.st_mtime_ns - 10**9))
+        response = await client.get('/files/results/freeze.csv', headers={'Accept-Encoding': 'gzip'},
+            auto_decompress=False)
+        assert 'Content-Encoding' not in response.headers
+        assert await response.text() == 'begin,end\n' * 10
+        assert not os.path.exists(f'{tmp_path}/root/results/freeze.csv.gz')
+
+        for path in '/files/..%2Fsecret.txt', '/files/results/missing.csv', '/files/results':
+            response = await client.get(path)
+            assert response.status == 404
+        assert server.stats == dict(requests=5, rejected=0)
+
+    run_client(f'{tmp_path}/root', scenario, cache_control='no-cache', max_requests_per_client=1)
+
+
+def test_requests_per_client(tmp_path):
+    with open(f'{tmp_path}/segment.ts', 'wb') as f:
+        f.write(bytes(188 * 1000))
+
+    async def scenario(client, server):
+        response = await client.get('/files/segment.ts')
+        assert response.status == 429
+        assert response.headers['Retry-After'] == '1'
+        assert server.stats == dict(requests=0, rejected=1)
+
+    run_client(str(tmp_path), scenario, max_requests_per_client=0)
+
+
+def test_concurrent_requests_per_client(tmp_path):
+    with open(f'{tmp_path}/segment.ts', 'wb') as f:
+        f.truncate(64 << 20)
+
+    async def scenario(client, server):
+        # the first download is not read, it stays active while the socket buffers are full
+        first = await client.get('/files/segment.ts')
+        assert first.status == 200
+        responses = await asyncio.gather(*[client.get('/files/segment.ts') for i in range(3)])
+        assert [response.status for response in responses] == [429] * 3
+        assert len(await first.read()) == 64 << 20
+        response = await client.get('/files/segment.ts', headers={'Range': 'bytes=0-187'})
+        assert response.status == 206
+        assert server.stats == dict(requests=2, rejected=3)
+
+    run_client(str(tmp_path), scenario, max_requests_per_client=1)
@@ -0,0 +1,98 @@
+import os
+import re
+import subprocess
+import sys
+import tomllib
+import pytest
+from cablewatch import config
+
+
+HEAVY_MODULES = ('aiohttp', 'psutil', 'requests', 'bs4', 'loguru', 'asyncio')
+
+# modules imported by an entry point when it is called, in addition to cablewatch.cli
+LAZY_IMPORTS = {
+    'main_ingest': ['asyncio', 'cablewatch.http', 'cablewatch.ingest', 'cablewatch.loghlp'],
+    'main_download_roadmap': ['requests', 'bs4'],
+    'main_bench_ingest': ['asyncio', 'cablewatch.replay'],
+    'tlex_extract_skeleton_worker': ['cablewatch.jobs', 'cablewatch.scheduler'],
+    'main_fingerprint': ['cablewatch.fingerprint'],
+    'main_phash': ['cablewatch.phash'],
+    'main_search': ['cablewatch.search'],
+}
+
+# import time budgets in seconds
+BUDGETS = {
+    'main_ingest': 1.0,
+    'main_download_roadmap': 0.6,
+    'main_bench_ingest': 1.0,
+    'main_fingerprint': 1.0,
+    'main_phash': 1.0,
+}
+DEFAULT_BUDGET = 0.25
+
+
+def load_entry_points():
+    conf = config.Config()
+    with open(f'{conf.PROJECT_DIR}/pyproject.toml', 'rb') as f:
+        scripts = tomllib.load(f)['project']['scripts']
+    entry_points = {}
+    for name, target in scripts.items():
+        module, func = target.split(':')
+        entry_points[name] = (module, func)
+    return entry_points
+
+
+ENTRY_POINTS = load_entry_points()
+
+
+def run_python(code, *args):
+    env = dict(os.environ)
+    conf = config.Config()
+    env['PYTHONPATH'] = f'{conf.PROJECT_DIR}/src'
+    proc = subprocess.run([sys.executable, *args, '-c', code], env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, check=True)
+    return proc
+
+
+def entry_point_code(name):
+    module, func = ENTRY_POINTS[name]
+    code = f'from {module} import {func}\n'
+    for m in LAZY_IMPORTS.get(func, []):
+        code += f'import {m}\n'
+    return code
+
+
+def measure_import_time(code):
+    baseline = set()
+    for ln in run_python('pass', '-X', 'importtime').stderr.decode().splitlines():
+        m = re.match(r'^import time:\s+\d+ \|\s+\d+ \| (\S.*)$', ln)
+        if m:
+            baseline.add(m.group(1))
+    total = 0
+    for ln in run_python(code, '-X', 'importtime').stderr.decode().splitlines():
+        m = re.match(r'^import time:\s+\d+ \|\s+(\d+) \| (\S.*)$', ln)
+        if m and m.group(2) not in baseline:
+            total += int(m.group(1))
+    return total / 1e6
+
+
+@pytest.mark.parametrize('name', [name for name, (module, func) in ENTRY_POINTS.items() if func not in LAZY_IMPORTS])
+def test_light_entry_point(name):
+    code = entry_point_code(name)
+    code += 'import sys\n'
+    code += 'print(" ".join(sorted(set(m.split(".")[0] for m in sys.modules))))\n'
+    modules = run_python(code).stdout.decode().split()
+    assert set(HEAVY_MODULES) & set(modules) == set()
+
+
+@pytest.mark.bench
+@pytest.mark.parametrize('name', ENTRY_POINTS)
+def test_import_time(name, benchmark):
+    code = entry_point_code(name)
+    times = []
+
+    def measure():
+        times.append(measure_import_time(code))
+    benchmark(measure)
+    budget = BUDGETS.get(ENTRY_POINTS[name][1], DEFAULT_BUDGET)
+    assert min(times) < budget
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta, timezone
+from cablewatch import config, hls, ingest, timeline
+
+
+def seconds(value):
+    return timedelta(seconds=value)
+
+
+def test_ewma(datadir):
+    est = ingest.IngestDriftEstimator(alpha=0.5, outlier=5)
+    assert est.value == seconds(0)
+    for value in 10, 12, 12, 12, 12, 12, 12, 12:
+        est.update(seconds(value))
+    assert abs(est.value - seconds(12)) < seconds(0.05)
+
+
+def test_outliers(datadir):
+    est = ingest.IngestDriftEstimator(alpha=0.5, outlier=5)
+    for value in 10, 10, 60, 10, 61, 10:
+        est.update(seconds(value))
+    assert est.value == seconds(10)
+    for value in 30, 31, 32:
+        est.update(seconds(value))
+    assert est.value == seconds(31)
+
+
+def test_persistence(datadir):
+    est = ingest.IngestDriftEstimator(alpha=0.5, outlier=5)
+    est.update(seconds(7.25))
+    est.save()
+    est = ingest.IngestDriftEstimator(alpha=0.5, outlier=5)
+    est.load()
+    assert est.value == seconds(7.25)
+    est.update(seconds(30))
+    assert est.value == seconds(30)
+
+
+def test_hls_latency_is_not_persisted(datadir):
+    est = ingest.IngestDriftEstimator(alpha=0.5, outlier=5)
+    est.update(seconds(7.25))
+    est.save()
+    conf = config.Config()
+    tmpdir = f'{conf.INGEST_DATADIR}/tmp/hls'
+    os.makedirs(tmpdir)
+    pipeline = ingest.IngestHLSPipeline(url='http://localhost/live.m3u8', service=None, name='hls', command='',
+        tmpdir=tmpdir)
+    assert pipeline.drift == seconds(0)
+    pdt = datetime.now(timezone.utc) - seconds(30)
+    pipeline.processSourceSegment(hls.HLSSegment(sequence=1, uri='1.ts', duration=6, program_date_time=pdt), b'')
+    assert pipeline.drift >= seconds(30)
+    pipeline.cleanup()
+    # the relay pipeline still loads its own drift
+    est = ingest.IngestDriftEstimator()
+    est.load()
+    assert est.value == seconds(7.25)
+
+
+def test_segment_datetime():
+    dt = datetime(2025, 12, 26, 6, 30, 5, 123456)
+    s = timeline.formatSegmentDatetime(dt)
+    assert s == '2025-12-26T06h30m05.123'
+    assert timeline.parseSegmentDatetime(s) == datetime(2025, 12, 26, 6, 30, 5, 123000)
+    assert timeline.parseSegmentDatetime('2025-12-26T06h30m05') == datetime(2025, 12, 26, 6, 30, 5)
+    seg = timeline.IngestSegment.fromFileName(f'/data/segment_{s}_30.03s.ts.hole')
+    assert seg.begin == datetime(2025, 12, 26, 6, 30, 5, 123000)
+    assert seg.duration == timedelta(seconds=30.03)
+    assert seg.hole
+    assert seg.basename == f'segment_{s}_30.03s.ts'
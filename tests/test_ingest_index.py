@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from cablewatch import timeline
+
+
+T0 = datetime(2025, 12, 26, 6, 30)
+
+
+def make_segment(datadir, begin, duration=30, hole=False):
+    basename = timeline.SEGMENT_FORMAT.format(datetime=begin.strftime(timeline.SEGMENT_DATETIME_FORMAT), duration=duration)
+    with open(f'{datadir}/{basename}', 'w') as f:
+        f.write('')
+    if hole:
+        with open(f'{datadir}/{basename}.hole', 'w') as f:
+            f.write('')
+    return timeline.IngestSegment.fromFileName(f'{datadir}/{basename}')
+
+
+def populate(datadir):
+    segs = []
+    segs.append(make_segment(datadir, T0))
+    segs.append(make_segment(datadir, T0 + timedelta(seconds=30), hole=True))
+    segs.append(make_segment(datadir, T0 + timedelta(seconds=65)))
+    segs.append(make_segment(datadir, T0 + timedelta(seconds=95)))
+    segs.append(make_segment(datadir, T0 + timedelta(seconds=185)))
+    return segs
+
+
+def test_rebuild(datadir):
+    populate(datadir)
+    index = timeline.IngestIndex()
+    index.rebuild()
+    index = timeline.IngestIndex()
+    index.load()
+    gaps = index.getGaps(T0, T0 + timedelta(hours=1))
+    assert [(g.begin - T0, g.duration, g.hole) for g in gaps] == [
+        (timedelta(seconds=60), timedelta(seconds=5), True),
+        (timedelta(seconds=125), timedelta(seconds=60), False),
+    ]
+    assert len(index.getHoles(T0, T0 + timedelta(hours=1))) == 1
+    assert index.getCoverage(T0, T0 + timedelta(seconds=215)) == 150 / 215
+    assert index.getCoverage(T0 + timedelta(seconds=10), T0 + timedelta(seconds=20)) == 1.0
+
+
+def test_incremental(datadir):
+    segs = populate(datadir)
+    ref = timeline.IngestIndex()
+    ref.scan()
+    index = timeline.IngestIndex()
+    for seg in segs:
+        seg.hole = False
+        index.addSegment(seg)
+        if seg.begin == T0 + timedelta(seconds=30):
+            index.markHole(seg.filename)
+    with open(index.filename) as f:
+        lines = f.readlines()
+    index.rebuild()
+    with open(index.filename) as f:
+        assert f.readlines() == lines
+    reloaded = timeline.IngestIndex()
+    reloaded.load()
+    assert list(reloaded.getSegments()) == list(ref.getSegments())
+
+
+def test_timeline(datadir):
+    populate(datadir)
+    timeline.IngestIndex().rebuild()
+    tl = timeline.IngestTimeLine(name='glob')
+    assert tl.begin == T0
+    assert tl.end == T0 + timedelta(seconds=215)
+    assert tl.getNumberOfHoles() == 1
+    assert len(tl.getGaps()) == 2
+    assert len(list(tl.slices())) == 2
+    tl = timeline.IngestTimeLine(name='glob', begin=T0, duration=timedelta(seconds=60))
+    assert tl.getCoverage() == 1.0
+    assert tl.getGaps() == []
@@ -0,0 +1,23 @@
+import asyncio
+import glob
+from datetime import timedelta
+from cablewatch import config, loghlp, replay, timeline
+
+
+def test_replay(datadir, monkeypatch):
+    monkeypatch.chdir(datadir)
+    bench = replay.IngestReplayBenchmark(hours=0.5, speed=1200)
+    report = asyncio.run(bench.run(timeout=60))
+    print(report)
+    assert report['segments'] == report['expected_segments'] == 60
+    assert report['rename_latency_max'] < 1.0
+    assert report['loop_lag_max'] < 0.5
+    segments = list(timeline.IngestIndex.open().getSegments().values())
+    assert len(segments) == 60
+    for prev, seg in zip(segments, segments[1:]):
+        assert abs(seg.begin - prev.end) < timeline.GAP_TOLERANCE
+    assert abs(segments[-1].end - segments[0].begin - timedelta(minutes=30)) < timeline.GAP_TOLERANCE
+    filenames = glob.glob(f'{config.Config().INGEST_CAPTURE_DIR}/*_pipeline1.jsonl')
+    assert len(filenames) == 1
+    header, lines, footer = loghlp.IngestCommandCapture.read(filenames[0])
+    assert sum(1 for _, line in lines if line.startswith('frame=')) == 60 * replay.IngestReplaySource.PROGRESS_LINES_PER_SEGMENT
@@ -0,0 +1,70 @@
+import os
+from datetime import datetime, timedelta
+from cablewatch import config, http, ingest, timeline
+
+
+T0 = datetime(2025, 12, 26, 6, 30)
+
+
+def make_tmp_segment(pipeline, begin, duration=30):
+    os.makedirs(pipeline._tmpdir, exist_ok=True)
+    tmp_filename = f'{pipeline._tmpdir}/segment_{int(begin.timestamp())}.ts'
+    with open(tmp_filename, 'w') as f:
+        f.write('')
+    segment_filename = timeline.SEGMENT_FORMAT.format(datetime=timeline.formatSegmentDatetime(begin), duration=duration)
+    return tmp_filename, segment_filename
+
+
+def test_planned_handover(datadir, monkeypatch):
+    conf = config.Config()
+    monkeypatch.setattr(conf, 'INGEST_STANDBY_MODE', 'planned')
+    monkeypatch.chdir(datadir)
+    service = ingest.IngestService(http_service=http.HTTPService())
+    service._index = timeline.IngestIndex()
+    primary = service.createPipeline()
+    service._pipeline = primary
+    standby = service.createPipeline(standby=True)
+    service._standby = standby
+    for offset in 0, 30:
+        service.onPipelineSegment(primary, *make_tmp_segment(primary, T0 + timedelta(seconds=offset)))
+    service.onPipelineSegment(standby, *make_tmp_segment(standby, T0 + timedelta(seconds=25)))
+    assert not primary.handover_requested
+    service.onPipelineSegment(standby, *make_tmp_segment(standby, T0 + timedelta(seconds=55)))
+    assert primary.handover_requested
+    service.promotePipeline(standby, planned=True)
+    service.onPipelineSegment(standby, *make_tmp_segment(standby, T0 + timedelta(seconds=85)))
+    assert sorted(os.listdir(f'{datadir}/{standby._tmpdir}')) == []
+    assert len(service._handovers) == 1
+    assert service._handovers[0]['gap'] == 0
+    assert service._handovers[0]['overlap'] == 5
+    tl = timeline.IngestTimeLine(name='glob')
+    assert tl.begin == T0
+    assert tl.getGaps() == []
+    slices = list(tl.slices())
+    assert len(slices) == 1
+    assert slices[0].effective_duration == timedelta(seconds=115)
+
+
+def test_continuous_standby_keeps_last_segments(datadir, monkeypatch):
+    conf = config.Config()
+    monkeypatch.setattr(conf, 'INGEST_STANDBY_MODE', 'continuous')
+    monkeypatch.chdir(datadir)
+    service = ingest.IngestService(http_service=http.HTTPService())
+    service._index = timeline.IngestIndex()
+    primary = service.createPipeline()
+    service._pipeline = primary
+    standby = service.createPipeline(standby=True)
+    for offset in 0, 30, 60:
+        service.onPipelineSegment(primary, *make_tmp_segment(primary, T0 + timedelta(seconds=offset)))
+    for offset in 2, 32, 62, 92:
+        service.onPipelineSegment(standby, *make_tmp_segment(standby, T0 + timedelta(seconds=offset)))
+    assert not primary.handover_requested
+    assert len(standby.pending) == 2
+    service.promotePipeline(standby, planned=False)
+    assert service._handovers[0]['gap'] == 0
+    assert service._handovers[0]['overlap'] == 28
+    assert service._handovers[0]['planned'] is False
+    assert len(service._index.getSegments()) == 5
+    slices = list(timeline.IngestTimeLine(name='glob').slices())
+    assert len(slices) == 1
+    assert slices[0].effective_duration == timedelta(seconds=122)
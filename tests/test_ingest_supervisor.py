@@ -0,0 +1,75 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+import psutil
+from cablewatch import config, http, ingest
+
+
+def make_supervisor(**kwargs):
+    kwargs.setdefault('delay_min', 1.0)
+    kwargs.setdefault('delay_max', 60.0)
+    kwargs.setdefault('jitter', 0.5)
+    kwargs.setdefault('breaker_threshold', 5)
+    kwargs.setdefault('breaker_cooldown', 600.0)
+    return ingest.IngestSupervisor(rng=random.Random(0), **kwargs)
+
+
+def test_backoff():
+    spv = make_supervisor()
+    now = datetime(2025, 12, 26, 6, 30)
+    for i in range(4):
+        delay = spv.onRecordFailed(now)
+        nominal = 2 ** i
+        assert nominal * 0.5 <= delay <= nominal
+        assert spv.state == spv.CLOSED
+        spv.onRecordRestarting()
+    spv.onSegmentFinalized(now + timedelta(seconds=42))
+    assert spv.last_time_to_recover == 42
+    assert spv.consecutive_failures == 0
+    assert spv.restart_delay is None
+
+
+def test_backoff_max():
+    spv = make_supervisor(jitter=0, breaker_threshold=100)
+    now = datetime(2025, 12, 26, 6, 30)
+    for i in range(20):
+        delay = spv.onRecordFailed(now)
+    assert delay == 60.0
+
+
+def test_circuit_breaker():
+    spv = make_supervisor()
+    now = datetime(2025, 12, 26, 6, 30)
+    for i in range(5):
+        delay = spv.onRecordFailed(now)
+        spv.onRecordRestarting()
+    assert delay == 600.0
+    assert spv.state == spv.HALF_OPEN
+    assert spv.onRecordFailed(now) == 600.0
+    assert spv.state == spv.OPEN
+    spv.onRecordRestarting()
+    spv.onSegmentFinalized(now)
+    assert spv.state == spv.CLOSED
+
+
+def test_halt_escalation(monkeypatch):
+    conf = config.Config()
+    monkeypatch.setattr(conf, 'INGEST_HALT_TIMEOUT', 0.5)
+
+    async def run():
+        service = ingest.IngestService(http_service=http.HTTPService())
+        pipeline = service.createPipeline()
+        proc = await asyncio.create_subprocess_shell("trap '' TERM; sleep 30; true")
+        await asyncio.sleep(0.2)
+        children = psutil.Process(proc.pid).children(recursive=True)
+        pipeline._proc = proc
+        service._pipeline = pipeline
+        t0 = time.monotonic()
+        await service.haltCommand()
+        await proc.wait()
+        assert time.monotonic() - t0 < 5
+        gone, alive = psutil.wait_procs(children, timeout=2)
+        assert alive == []
+
+    asyncio.run(run())
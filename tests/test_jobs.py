@@ -0,0 +1,108 @@
+import time
+import multiprocessing
+from datetime import timedelta
+import pytest
+from cablewatch import jobs, timeline
+from test_ingest_index import T0, make_segment, populate
+
+
+def create_queue(datadir, **kwargs):
+    populate(datadir)
+    timeline.IngestIndex().rebuild()
+    timeline.IngestTimeLine(name='worker', begin=T0, duration=timedelta(seconds=30), load=False).save()
+    return jobs.IngestJobQueue(**kwargs)
+
+
+def test_enqueue_available(datadir):
+    queue = create_queue(datadir)
+    windows = queue.enqueueAvailable('worker')
+    assert [begin - T0 for begin, duration in windows] == [timedelta(seconds=30 * i) for i in range(7)]
+    assert timeline.IngestTimeLine.loadState('worker')[0] == T0 + timedelta(seconds=210)
+    assert queue.enqueueAvailable('worker') == []
+    index = timeline.IngestIndex.open()
+    index.addSegment(make_segment(datadir, T0 + timedelta(seconds=215)))
+    windows = queue.enqueueAvailable('worker', index)
+    assert [begin - T0 for begin, duration in windows] == [timedelta(seconds=210)]
+    assert queue.getStats('worker') == dict(pending=8, leased=0, done=0, failed=0)
+
+
+def test_lease_complete(datadir):
+    queue = create_queue(datadir)
+    queue.enqueueAvailable('worker')
+    job1 = queue.lease('worker', 'w1')
+    job2 = queue.lease('worker', 'w2')
+    assert (job1.begin, job2.begin) == (T0, T0 + timedelta(seconds=30))
+    assert len(job1.getTimeLine().segments) == 1
+    queue.heartbeat(job1)
+    queue.complete(job1)
+    with pytest.raises(jobs.IngestJobLostError):
+        queue.complete(job1)
+    assert queue.getStats('worker') == dict(pending=5, leased=1, done=1, failed=0)
+
+
+def test_lease_expiry_and_retries(datadir):
+    queue = create_queue(datadir, lease_timeout=0.2, max_attempts=3)
+    timeline.IngestTimeLine(name='worker', begin=T0, duration=timedelta(seconds=200), load=False).save()
+    queue.enqueueAvailable('worker')
+    job = queue.lease('worker', 'w1')
+    assert queue.lease('worker', 'w2') is None
+    time.sleep(0.3)
+    lost_job = job
+    job = queue.lease('worker', 'w2')
+    assert (job.worker, job.attempts) == ('w2', 2)
+    with pytest.raises(jobs.IngestJobLostError):
+        queue.heartbeat(lost_job)
+    assert queue.fail(job, 'boom') == queue.PENDING
+    job = queue.lease('worker', 'w3')
+    assert job.attempts == 3
+    time.sleep(0.3)
+    assert queue.lease('worker', 'w4') is None
+    [job] = queue.getJobs('worker')
+    assert (job.state, job.error) == (queue.FAILED, 'lease expired')
+
+
+def process_windows(worker, queue):
+    def process(job):
+        if job.begin == T0 + timedelta(seconds=60) and job.attempts == 1:
+            raise RuntimeError('transient')
+        time.sleep(0.05)
+        with open(f'{timeline.IngestTimeLine.getFileName("worker")}.done', 'a') as f:
+            f.write(f'{job.begin.isoformat()}\n')
+    queue.work('worker', process, worker=worker, heartbeat_period=0.01)
+
+
+def test_work_enqueues_finalized_windows(datadir, monkeypatch):
+    queue = create_queue(datadir)
+    ingest_index = timeline.IngestIndex.open()
+    opened = []
+    open_index = timeline.IngestIndex.open
+    monkeypatch.setattr(timeline.IngestIndex, 'open', lambda: opened.append(1) or open_index())
+    begins = []
+
+    def process(job):
+        if len(begins) == 0:
+            # finalized by the ingest while the first window is processed
+            ingest_index.addSegment(make_segment(datadir, T0 + timedelta(seconds=215)))
+        begins.append(job.begin - T0)
+    assert queue.work('worker', process, heartbeat_period=0.01) == 8
+    # the index is loaded once, then refreshed between leases
+    assert len(opened) == 1
+    assert begins == [timedelta(seconds=30 * i) for i in range(8)]
+    assert queue.getStats('worker') == dict(pending=0, leased=0, done=8, failed=0)
+
+
+def test_concurrent_workers(datadir):
+    queue = create_queue(datadir)
+    timeline.IngestTimeLine(name='worker', begin=T0, duration=timedelta(seconds=1), load=False).save()
+    queue.enqueueAvailable('worker')
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=process_windows, args=(f'w{i}', queue)) for i in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+        assert w.exitcode == 0
+    with open(f'{timeline.IngestTimeLine.getFileName("worker")}.done') as f:
+        begins = sorted(f.read().splitlines())
+    assert begins == [(T0 + timedelta(seconds=i)).isoformat() for i in range(215)]
+    assert queue.getStats('worker') == dict(pending=0, leased=0, done=215, failed=0)
@@ -0,0 +1,88 @@
+import os
+from datetime import datetime
+from cablewatch import loghlp
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sampler():
+    clock = FakeClock()
+    sampler = loghlp.IngestLogSampler(period=10, burst=2, clock=clock)
+    warning = 'WARNING: [youtube] Z-Nwo-ypKtM: fragment {} not found, retrying ({}/10)'
+    logged = []
+    for i in range(5):
+        logged += sampler.sample(warning.format(i, i))
+    logged += sampler.sample('[hls @ 0x55d0c0a0f2c0] Opening segment for writing')
+    assert logged == [warning.format(0, 0), warning.format(1, 1), '[hls @ 0x55d0c0a0f2c0] Opening segment for writing']
+    assert sampler.number_of_suppressed_lines == 3
+
+    clock.now = 11
+    assert sampler.sample(warning.format(5, 5)) == [
+        f'suppressed 3 similar line(s) in 10s, last: {warning.format(4, 4)}',
+        warning.format(5, 5),
+    ]
+    for i in range(6, 9):
+        sampler.sample(warning.format(i, i))
+    assert sampler.flush() == [f'suppressed 2 similar line(s) in 10s, last: {warning.format(8, 8)}']
+    assert sampler.flush() == []
+
+
+def test_sampler_expires_quiet_keys():
+    clock = FakeClock()
+    sampler = loghlp.IngestLogSampler(period=10, burst=1, clock=clock)
+    sampler.sample('error 1')
+    sampler.sample('error 2')
+    clock.now = 25
+    assert sampler.sample('another line') == ['suppressed 1 similar line(s) in 10s, last: error 2', 'another line']
+
+
+def test_command_capture(tmp_path):
+    dirname = f'{tmp_path}/capture'
+    filenames = []
+    for i in range(4):
+        capture = loghlp.IngestCommandCapture(name=f'pipeline{i}', command='yt-dlp | ffmpeg', dirname=dirname,
+            retention=3)
+        capture.write('frame=  250 fps=25')
+        capture.write('Opening « segment »')
+        capture.close(returncode=1)
+        filenames.append(capture.filename)
+    assert sorted(os.listdir(dirname)) == [os.path.basename(filename) for filename in filenames[1:]]
+    header, lines, footer = loghlp.IngestCommandCapture.read(filenames[-1])
+    assert header['name'] == 'pipeline3' and header['command'] == 'yt-dlp | ffmpeg'
+    assert [line for _, line in lines] == ['frame=  250 fps=25', 'Opening « segment »']
+    assert footer['returncode'] == 1
+
+
+def test_log_writer(tmp_path):
+    log_file = loghlp.IngestLogFile(f'{tmp_path}/logs')
+    writer = loghlp.IngestLogWriter(log_file.write, log_file.flush)
+    for i in range(1000):
+        writer(f'line {i}\n')
+    writer.stop()
+    log_file.close()
+    filenames = os.listdir(f'{tmp_path}/logs')
+    assert len(filenames) == 1 and filenames[0].startswith('ingest_')
+    with open(f'{tmp_path}/logs/{filenames[0]}') as f:
+        assert f.read().splitlines() == [f'line {i}' for i in range(1000)]
+
+
+def test_log_file_rotation(tmp_path):
+    dirname = f'{tmp_path}/logs'
+    os.makedirs(dirname)
+    old = f'{dirname}/ingest_2025-01-01_07h00.log'
+    open(old, 'w').close()
+    os.utime(old, (0, 0))
+    log_file = loghlp.IngestLogFile(dirname, rotation_hour=7)
+    log_file.open(datetime(2026, 10, 19, 6, 30))
+    assert not os.path.exists(old)
+    assert log_file.filename == f'{dirname}/ingest_2026-10-19_06h30.log'
+    assert log_file._next_rotation == datetime(2026, 10, 19, 7, 0)
+    log_file.open(datetime(2026, 10, 19, 7, 0))
+    assert log_file._next_rotation == datetime(2026, 10, 20, 7, 0)
+    log_file.close()
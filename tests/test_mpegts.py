@@ -0,0 +1,171 @@
+import heapq
+from datetime import timedelta
+import pytest
+from cablewatch import mpegts, timeline
+from test_ingest_index import T0, make_segment
+
+
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+VIDEO_FRAME = 3600
+AUDIO_FRAME = 1920
+
+
+def encode_timestamp(prefix, ts):
+    return bytes([
+        prefix << 4 | (ts >> 29) & 0x0e | 1,
+        (ts >> 22) & 0xff,
+        (ts >> 14) & 0xfe | 1,
+        (ts >> 7) & 0xff,
+        (ts << 1) & 0xfe | 1,
+    ])
+
+
+def packetize(pid, payload, counters):
+    packets = []
+    pusi = 0x40
+    while True:
+        chunk = payload[:184]
+        payload = payload[184:]
+        header = bytes([0x47, pusi | pid >> 8, pid & 0xff])
+        cc = counters.get(pid, 0)
+        counters[pid] = (cc + 1) % 16
+        if len(chunk) == 184:
+            packets.append(header + bytes([0x10 | cc]) + chunk)
+        else:
+            stuffing = 183 - len(chunk)
+            adaptation = bytes([stuffing]) + (bytes([0x00]) + b'\xff' * (stuffing - 1) if stuffing > 0 else b'')
+            packets.append(header + bytes([0x30 | cc]) + adaptation + chunk)
+        pusi = 0
+        if len(payload) == 0:
+            return packets
+
+
+def make_section(table_id, table_id_extension, body):
+    length = 5 + len(body) + 4
+    return bytes([table_id, 0xb0 | length >> 8, length & 0xff, table_id_extension >> 8, table_id_extension & 0xff,
+        0xc1, 0, 0]) + body + b'\x00' * 4
+
+
+def make_pes(stream_id, pts, dts, payload):
+    if dts is None or dts == pts:
+        header = bytes([0x80, 0x80, 5]) + encode_timestamp(2, pts)
+    else:
+        header = bytes([0x80, 0xc0, 10]) + encode_timestamp(3, pts) + encode_timestamp(1, dts)
+    length = len(header) + len(payload)
+    if length > 0xffff or stream_id & 0xf0 == 0xe0:
+        length = 0
+    return bytes([0, 0, 1, stream_id, length >> 8, length & 0xff]) + header + payload
+
+
+def video_frame(i, size=600):
+    return bytes([i & 0xff]) * (size if i % 25 else 10 * size)
+
+
+def audio_frame(i):
+    return bytes([(i * 7) & 0xff]) * 300
+
+
+def make_ts(filename, *, seconds, pts0=126000, garbage=b'', video_frame_size=600):
+    counters = {}
+    pat = make_section(0x00, 1, bytes([0, 1, 0xe0 | 0x1000 >> 8, 0x1000 & 0xff]))
+    streams = bytes([0x1b, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0x00])
+    streams += bytes([0x0f, 0xe0 | AUDIO_PID >> 8, AUDIO_PID & 0xff, 0xf0, 0x00])
+    pmt = make_section(0x02, 1, bytes([0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0x00]) + streams)
+    packets = packetize(0, b'\x00' + pat, counters) + packetize(0x1000, b'\x00' + pmt, counters)
+    pes = []
+    num_video = round(seconds * mpegts.PTS_CLOCK / VIDEO_FRAME)
+    for i in range(num_video):
+        # B-frames: presentation order swaps every other pair of frames
+        j = i + 1 if i % 2 == 1 and i + 1 < num_video else i - 1 if i % 2 == 0 and i > 0 else i
+        pts = (pts0 + VIDEO_FRAME + j * VIDEO_FRAME) % mpegts.PTS_MODULO
+        dts = (pts0 + i * VIDEO_FRAME) % mpegts.PTS_MODULO
+        pes.append((i * VIDEO_FRAME, 0, VIDEO_PID, make_pes(0xe0, pts, dts, video_frame(i, video_frame_size))))
+    num_audio = round(seconds * mpegts.PTS_CLOCK / AUDIO_FRAME)
+    for i in range(num_audio):
+        pts = (pts0 + i * AUDIO_FRAME) % mpegts.PTS_MODULO
+        pes.append((i * AUDIO_FRAME, 1, AUDIO_PID, make_pes(0xc0, pts, None, audio_frame(i))))
+    for _, _, pid, data in heapq.merge(*[sorted(p for p in pes if p[2] == pid) for pid in (VIDEO_PID, AUDIO_PID)]):
+        packets += packetize(pid, data, counters)
+    with open(filename, 'wb') as f:
+        f.write(garbage)
+        f.write(b''.join(packets))
+    return num_video, num_audio
+
+
+def test_streams_and_durations(tmp_path):
+    filename = f'{tmp_path}/segment.ts'
+    num_video, num_audio = make_ts(filename, seconds=4)
+    with mpegts.IngestTSDemuxer(filename) as demuxer:
+        assert demuxer.getStreams() == {VIDEO_PID: 0x1b, AUDIO_PID: 0x0f}
+        assert demuxer.getAudioPIDs() == [AUDIO_PID]
+        assert demuxer.getVideoPIDs() == [VIDEO_PID]
+        assert demuxer.getFirstPTS() == 126000
+        assert demuxer.getLastPTS() == 126000 + (num_audio - 1) * AUDIO_FRAME
+        assert demuxer.getDuration() == timedelta(seconds=num_audio * AUDIO_FRAME / mpegts.PTS_CLOCK)
+        assert demuxer.getDuration(VIDEO_PID) == timedelta(seconds=4)
+        assert demuxer.getOrigin() == 126000
+
+
+def test_pes_payloads(datadir):
+    seg = make_segment(datadir, T0, duration=4)
+    num_video, num_audio = make_ts(seg.filename, seconds=4, garbage=b'\x00' * 100)
+    with mpegts.IngestTSDemuxer.fromSegment(seg) as demuxer:
+        packets = list(demuxer.iterPES(AUDIO_PID))
+        assert len(packets) == num_audio
+        assert all(pes.stream_id == 0xc0 for pes in packets)
+        assert [pes.data for pes in packets] == [audio_frame(i) for i in range(num_audio)]
+        assert packets[10].timestamp == T0 + timedelta(seconds=10 * AUDIO_FRAME / mpegts.PTS_CLOCK)
+        video = list(demuxer.iterPES(VIDEO_PID))
+        assert [pes.data for pes in video] == [video_frame(i) for i in range(num_video)]
+        assert video[2].dts == 126000 + 2 * VIDEO_FRAME and video[2].pts == 126000 + 2 * VIDEO_FRAME
+        assert video[3].pts == 126000 + 5 * VIDEO_FRAME
+
+        begin = T0 + timedelta(seconds=1)
+        end = T0 + timedelta(seconds=2)
+        packets = list(demuxer.iterPES(begin=begin, end=end))
+        assert len(packets) == 47
+        assert all(begin <= pes.timestamp < end for pes in packets)
+        del packets, video
+
+
+def test_pts_wrap(tmp_path):
+    filename = f'{tmp_path}/segment.ts'
+    pts0 = mpegts.PTS_MODULO - 90000
+    num_video, num_audio = make_ts(filename, seconds=3, pts0=pts0)
+    seg = timeline.IngestSegment.fromFileName(f'{tmp_path}/' + timeline.SEGMENT_FORMAT.format(
+        datetime=T0.strftime(timeline.SEGMENT_DATETIME_FORMAT), duration=3))
+    seg.filename = filename
+    with mpegts.IngestTSDemuxer.fromSegment(seg) as demuxer:
+        assert demuxer.getDuration() == timedelta(seconds=num_audio * AUDIO_FRAME / mpegts.PTS_CLOCK)
+        timestamps = [pes.timestamp for pes in demuxer.iterPES()]
+        assert timestamps == sorted(timestamps)
+        assert timestamps[-1] - timestamps[0] > timedelta(seconds=2.9)
+
+
+def test_invalid_files(tmp_path):
+    filename = f'{tmp_path}/empty.ts'
+    open(filename, 'wb').close()
+    with mpegts.IngestTSDemuxer(filename) as demuxer:
+        assert demuxer.number_of_packets == 0
+        assert demuxer.getStreams() == {}
+        with pytest.raises(LookupError):
+            demuxer.getDuration()
+    with open(filename, 'wb') as f:
+        f.write(b'not a transport stream' * 100)
+    with pytest.raises(AssertionError):
+        mpegts.IngestTSDemuxer(filename)
+
+
+def test_verify_tool(datadir, capsys):
+    make_ts(make_segment(datadir, T0, duration=4).filename, seconds=4)
+    make_ts(make_segment(datadir, T0 + timedelta(seconds=4), duration=4).filename, seconds=3)
+    # tables but no PES: the segment is reported as unmeasurable, the others are still verified
+    make_ts(make_segment(datadir, T0 + timedelta(seconds=8), duration=4).filename, seconds=0)
+    make_ts(make_segment(datadir, T0 + timedelta(seconds=12), duration=4).filename, seconds=2)
+    timeline.IngestIndex().rebuild()
+    timeline.IngestTimeLineTool(['cablewatch-timeline', 'verify', 'glob'])()
+    out = capsys.readouterr().out
+    assert '-0.992s' in out and '-1.995s' in out
+    assert 'no PTS' in out
+    assert out.count('segment_') == 3
@@ -0,0 +1,109 @@
+import os
+from datetime import timedelta
+import numpy as np
+from cablewatch import config, phash, search, timeline
+from test_ingest_index import T0, make_segment
+
+
+def write_frames(seg, frames):
+    # the frame decoder is replaced by 'cat', segment files hold the 9x8 gray frames
+    with open(seg.filename, 'wb') as f:
+        f.write(np.clip(frames, 0, 255).astype(np.uint8).tobytes())
+
+
+def populate(datadir, monkeypatch):
+    monkeypatch.setattr(phash.IngestFrameHashIndex, 'COMMAND', 'cat {input}')
+    rng = np.random.default_rng(0)
+    show = rng.integers(0, 256, (60, 8, 9))
+    segs = []
+    # a 60s show at T0, some other content, then a rerun of the show starting 7s into a segment
+    contents = [show[:30], show[30:], rng.integers(0, 256, (30, 8, 9)),
+        np.concatenate([rng.integers(0, 256, (7, 8, 9)), show[:23]]), show[23:53], show[53:]]
+    for i, frames in enumerate(contents):
+        # the end of the rerun is the last segment before a restart, it holds valid frames
+        seg = make_segment(datadir, T0 + timedelta(hours=i // 3 * 10, seconds=30 * (i % 3)), duration=len(frames),
+            hole=(i == 5))
+        noise = rng.integers(-2, 3, frames.shape) if i >= 3 else 0
+        write_frames(seg, frames + noise)
+        segs.append(seg)
+    segs.append(make_segment(datadir, T0 + timedelta(hours=20), hole=True))
+    index = timeline.IngestIndex()
+    index.rebuild()
+    return index
+
+
+def test_dhash():
+    frames = np.tile(np.arange(9, dtype=np.uint8), (2, 8, 1))
+    frames[1] = frames[1][:, ::-1]
+    assert phash.computeDHash(frames).tolist() == [(1 << 64) - 1, 0]
+
+
+def test_lookup_distance():
+    rng = np.random.default_rng(1)
+    hash_index = phash.IngestFrameHashIndex()
+    hashes = rng.integers(0, 1 << 63, 1000, dtype=np.int64).astype(np.uint64)
+    hash_index._hashes = hashes
+    hash_index._times = np.arange(1000, dtype=np.int64)
+    band_bits = 64 // hash_index.BANDS
+    hash_index._bands = []
+    for b in range(hash_index.BANDS):
+        values = (hashes >> np.uint64(b * band_bits)) & np.uint64((1 << band_bits) - 1)
+        order = np.argsort(values, kind='stable')
+        hash_index._bands.append((values[order], order))
+    # two flipped bits in each band, no band matches exactly
+    flipped = sum(1 << (b * band_bits + k) for b in range(hash_index.BANDS) for k in (1, 5))
+    times, distances = hash_index.lookup(int(hashes[42]) ^ flipped)
+    assert times.tolist() == [42] and distances.tolist() == [8]
+    times, distances = hash_index.lookup(int(hashes[42]) ^ flipped ^ 1)
+    assert times.tolist() == []
+
+
+def test_find_rebroadcast(datadir, monkeypatch):
+    conf = config.Config()
+    index = populate(datadir, monkeypatch)
+    hash_index = phash.IngestFrameHashIndex()
+    added, failed = hash_index.update(index)
+    assert (len(added), len(failed)) == (7, 0)
+    assert hash_index.update(index) == ([], [])
+    seg = index.getSegment(T0)
+    assert np.load(hash_index.getFileName(seg)).dtype == np.uint64
+    assert os.path.getsize(hash_index.getFileName(seg)) < 30 * 8 + 200
+    assert [fn for fn in os.listdir(conf.INGEST_DERIVATIVES_DIR) if fn.endswith('.tmp')] == []
+
+    hash_index.load(index)
+    assert hash_index.number_of_hashes == 5 * 30 + 7
+    rerun = timeline.IngestTimeLine(name='rerun', begin=T0 + timedelta(hours=10), duration=timedelta(seconds=90),
+        load=False, index=index)
+    slice = next(rerun.slices())
+    match = hash_index.findRebroadcast(slice)
+    assert match is not None
+    assert match.score > 0.6
+    assert match.shift == -timedelta(hours=10, seconds=7)
+    assert match.mapFromSource(T0 + timedelta(seconds=10)) == T0 + timedelta(hours=10, seconds=17)
+
+    search_index = search.IngestSearchIndex()
+    search_index.addRecords([
+        search.IngestSearchRecord(type='topic', begin=T0 + timedelta(seconds=10), end=T0 + timedelta(seconds=20),
+            content='Crise agricole'),
+        search.IngestSearchRecord(type='speech', begin=T0 + timedelta(seconds=50), end=T0 + timedelta(seconds=65),
+            content='bonsoir'),
+        search.IngestSearchRecord(type='topic', begin=T0 + timedelta(hours=1), end=T0 + timedelta(hours=2),
+            content='Autre sujet'),
+    ])
+    assert match.copyResults(search_index) == 2
+    assert match.copyResults(search_index) == 0
+    copies = search_index.getRecords(begin=match.begin, end=match.end)
+    assert [(r.type, r.begin - T0, r.end - T0) for r in copies] == [
+        ('topic', timedelta(hours=10, seconds=17), timedelta(hours=10, seconds=27)),
+        ('speech', timedelta(hours=10, seconds=57), timedelta(hours=10, seconds=67)),
+    ]
+
+    first = timeline.IngestTimeLine(name='first', begin=T0, duration=timedelta(seconds=90), load=False, index=index)
+    assert hash_index.findRebroadcast(next(first.slices())) is None
+
+
+def test_failed_segments(datadir, monkeypatch):
+    index = populate(datadir, monkeypatch)
+    monkeypatch.setattr(phash.IngestFrameHashIndex, 'COMMAND', 'exit 1')
+    added, failed = phash.IngestFrameHashIndex().update(index)
+    assert (len(added), len(failed)) == (0, 7)
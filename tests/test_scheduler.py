@@ -0,0 +1,181 @@
+import os
+import json
+import platform
+import time
+import asyncio
+import threading
+from cablewatch import scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeHealth:
+    def __init__(self):
+        self.state = scheduler.OK
+
+    def getState(self):
+        return self.state
+
+    def asDict(self):
+        return dict(state=self.state)
+
+
+def process_state(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        return f.read().rsplit(')', 1)[1].split()[0]
+
+
+def test_health_monitor(datadir):
+    clock = FakeClock()
+    health = scheduler.IngestHealthMonitor(window=60, max_loop_lag=0.1, max_rename_latency=2, max_drift_growth=2,
+        clock=clock)
+    assert health.getState() == scheduler.OK
+    assert health.getMetrics() == dict(loop_lag=None, rename_latency=None, drift_growth=None)
+    for i in range(10):
+        clock.now = i
+        health.addLoopLag(0.01)
+        health.addDrift(5.0 + i * 0.3)
+    assert round(health.getMetrics()['drift_growth'], 3) == 2.7
+    assert health.getState() == scheduler.DEGRADED
+    health.addRenameLatency(5.0)
+    assert health.getState() == scheduler.CRITICAL
+    clock.now = 100
+    health.addDrift(7.7)
+    health.addLoopLag(0.15)
+    assert health.getMetrics() == dict(loop_lag=0.15, rename_latency=None, drift_growth=0)
+    assert health.getState() == scheduler.DEGRADED
+
+    health.write()
+    assert scheduler.IngestHealthMonitor.read()['state'] == scheduler.DEGRADED
+    d = health.asDict()
+    d['time'] -= 120
+    with open(health.filename, 'w') as f:
+        json.dump(d, f)
+    assert scheduler.IngestHealthMonitor.read() is None
+
+
+def test_health_gate(datadir):
+    clock = FakeClock()
+    health = scheduler.IngestHealthMonitor(max_rename_latency=1, clock=clock)
+    gate = scheduler.IngestHealthGate(poll_period=0.02)
+    assert gate.wait() == 0
+    health.addRenameLatency(10)
+    health.write()
+    assert gate.isPaused()
+
+    def recover():
+        time.sleep(0.2)
+        clock.now = 1000
+        health.write()
+    thread = threading.Thread(target=recover)
+    thread.start()
+    assert gate.wait() >= 0.2
+    thread.join()
+
+
+def test_priorities_and_niceness(datadir):
+    filename = f'{datadir}/order.txt'
+
+    async def run():
+        sched = scheduler.IngestScheduler(max_jobs=1)
+        batch = [sched.submit(f'echo batch{i} >> {filename}; ionice > {filename}.ionice', priority=scheduler.BATCH)
+            for i in range(2)]
+        normal = sched.submit(f'echo normal >> {filename}; nice > {filename}.nice', niceness=3)
+        failed = sched.submit('echo boom >&2; exit 3')
+        sched.start()
+        for job in batch + [normal, failed]:
+            await job.wait()
+        d = sched.asDict()
+        await sched.stop()
+        return normal, failed, d
+
+    normal, failed, d = asyncio.run(run())
+    with open(filename) as f:
+        assert f.read().split() == ['normal', 'batch0', 'batch1']
+    with open(f'{filename}.nice') as f:
+        assert int(f.read()) == os.nice(0) + 3
+    if scheduler.SYS_IOPRIO_SET.get(platform.machine()) is not None:
+        with open(f'{filename}.ionice') as f:
+            assert f.read().strip() == 'idle'
+    assert (normal.state, normal.returncode) == ('done', 0)
+    assert (failed.state, failed.returncode, failed.stderr) == ('failed', 3, 'boom\n')
+    assert (d['submitted'], d['completed'], d['failed'], d['pending'], d['running']) == (4, 3, 1, 0, 0)
+    assert d['wait']['normal']['count'] == 2 and d['wait']['batch']['count'] == 2
+    assert d['run']['batch']['count'] == 2
+    assert d['throughput'] == 3
+
+
+def test_budget_follows_ingest_health(datadir):
+    clock = FakeClock()
+    health = FakeHealth()
+
+    async def run():
+        sched = scheduler.IngestScheduler(max_jobs=4, health=health, clock=clock)
+        jobs = [sched.submit('sleep 30', priority=scheduler.BATCH) for i in range(4)]
+        sched.schedule()
+        assert sched.number_of_running == 4
+        while any(job.pid is None for job in jobs):
+            await asyncio.sleep(0.01)
+
+        health.state = scheduler.DEGRADED
+        sched.adjustBudget()
+        sched.schedule()
+        assert sched.budget == 2
+        assert [job.state for job in jobs] == ['running', 'running', 'suspended', 'suspended']
+        await asyncio.sleep(0.1)
+        assert [process_state(job.pid) for job in jobs] == ['S', 'S', 'T', 'T']
+
+        # the ingest falls behind: every batch job is suspended, normal jobs still run
+        health.state = scheduler.CRITICAL
+        clock.now = 5
+        sched.adjustBudget()
+        sched.schedule()
+        assert sched.budget == 1 and sched.paused
+        assert all(job.state == 'suspended' for job in jobs)
+        normal = sched.submit('true')
+        sched.schedule()
+        assert normal.state == 'running'
+        await normal.wait()
+
+        health.state = scheduler.OK
+        clock.now = 10
+        sched.adjustBudget()
+        sched.schedule()
+        assert sched.budget == 1 and not sched.paused
+        assert [job.state for job in jobs] == ['running', 'suspended', 'suspended', 'suspended']
+        clock.now = 15
+        sched.adjustBudget()
+        sched.schedule()
+        assert sched.budget == 2
+        assert [job.state for job in jobs] == ['running', 'running', 'suspended', 'suspended']
+        await asyncio.sleep(0.1)
+        assert [process_state(job.pid) for job in jobs] == ['S', 'S', 'T', 'T']
+
+        d = sched.asDict()
+        await sched.stop()
+        return jobs, d
+
+    jobs, d = asyncio.run(run())
+    assert all(job.state == 'cancelled' for job in jobs)
+    assert d['paused_time'] == 5 and d['suspended'] == 2 and d['suspensions'] == 4 and d['completed'] == 1
+
+
+def test_cancel_waiting_job(datadir):
+    async def run():
+        sched = scheduler.IngestScheduler(max_jobs=1)
+        sched.start()
+        task = asyncio.create_task(sched.run('sleep 30', priority=scheduler.BATCH))
+        await asyncio.sleep(0.1)
+        job = sched._running[0]
+        task.cancel()
+        await sched.stop()
+        return job
+
+    job = asyncio.run(run())
+    assert job.state == 'cancelled'
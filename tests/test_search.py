@@ -0,0 +1,103 @@
+import asyncio
+import csv
+import gzip
+from datetime import timedelta
+from aiohttp.test_utils import TestClient, TestServer
+from cablewatch import http, ingest, search
+from test_ingest_index import T0
+
+
+def make_records():
+    return [
+        search.IngestSearchRecord(type='show-title', begin=T0, end=T0 + timedelta(minutes=60),
+            content='Tout est politique'),
+        search.IngestSearchRecord(type='topic', begin=T0 + timedelta(minutes=5), end=T0 + timedelta(minutes=20),
+            content='Crise agricole: un virage populiste ?'),
+        search.IngestSearchRecord(type='locutor', begin=T0 + timedelta(minutes=5), end=T0 + timedelta(minutes=10),
+            content='Antoine Bueno, Essayiste'),
+        search.IngestSearchRecord(type=search.SPEECH_TYPE, begin=T0 + timedelta(minutes=6),
+            end=T0 + timedelta(minutes=6, seconds=12), content="la crise agricole, c'est d'abord une crise des prix",
+            locutor='locutor 1'),
+        search.IngestSearchRecord(type='topic', begin=T0 + timedelta(days=7), end=T0 + timedelta(days=7, minutes=15),
+            content='Les agriculteurs bloquent les autoroutes'),
+    ]
+
+
+def test_search(tmp_path):
+    index = search.IngestSearchIndex(f'{tmp_path}/search.sqlite')
+    assert index.addRecords(make_records()) == 5
+    assert index.addRecords(make_records()) == 0
+    assert index.number_of_results == 5
+
+    records = index.search('crise agricole')
+    assert [r.type for r in records] == ['topic', search.SPEECH_TYPE]
+    assert records[0].score > records[1].score > 0
+    assert records[1].locutor == 'locutor 1'
+    assert records[0].snippet == '[Crise] [agricole]: un virage populiste ?'
+
+    assert [r.type for r in index.search('CRISE AGRICOLE', types=['topic'])] == ['topic']
+    assert [r.type for r in index.search('agricole', begin=T0 + timedelta(minutes=7))] == ['topic']
+    assert 'Les agriculteurs bloquent les autoroutes' in [r.content for r in index.search('agri*')]
+    assert [r.type for r in index.search('agri*', begin=T0 + timedelta(days=1))] == ['topic']
+    assert index.search('agri*', end=T0 + timedelta(minutes=5)) == []
+    assert [r.content for r in index.search('ESSAYISTE')] == ['Antoine Bueno, Essayiste']
+    # accents are folded
+    assert len(index.search('politiqué')) == 1
+    # FTS5 syntax is not interpreted
+    assert index.search('content: NOT "crise') == []
+
+
+def test_result_writer(tmp_path):
+    index = search.IngestSearchIndex(f'{tmp_path}/search.sqlite')
+    filename = f'{tmp_path}/banners.csv'
+    with search.IngestResultWriter(filename, search_index=index) as writer:
+        writer.BATCH_SIZE = 2
+        for record in make_records()[:3]:
+            writer.writeRow(dict(timestamp_begin=record.begin, timestamp_end=record.end,
+                banner_type=record.type, banner_content=record.content))
+            if record.type == 'topic':
+                # indexed as the rows are written
+                assert index.number_of_results == 2
+    assert index.number_of_results == 3
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert rows[1] == dict(timestamp_begin=(T0 + timedelta(minutes=5)).isoformat(),
+        timestamp_end=(T0 + timedelta(minutes=20)).isoformat(), banner_type='topic',
+        banner_content='Crise agricole: un virage populiste ?')
+    with open(filename, 'rb') as f, gzip.open(f'{filename}.gz') as gz:
+        assert gz.read() == f.read()
+    # importing the same CSV again is idempotent
+    assert index.importCSV(filename) == 0
+    assert len(index.search('virage')) == 1
+
+
+def test_search_route(tmp_path):
+    index = search.IngestSearchIndex(f'{tmp_path}/search.sqlite')
+    index.addRecords(make_records())
+
+    async def run():
+        http_service = http.HTTPService()
+        ingest.IngestSearchService(http_service=http_service, search_index=index)
+        client = TestClient(TestServer(http_service._app))
+        await client.start_server()
+        try:
+            response = await client.get('/api/search', params={'q': 'crise agricole'})
+            assert response.status == 200
+            assert [d['type'] for d in await response.json()] == ['topic', 'speech']
+
+            params = [('q', 'agri*'), ('type', 'topic'), ('type', 'locutor'), ('begin', T0.isoformat()),
+                ('end', (T0 + timedelta(days=1)).isoformat())]
+            response = await client.get('/api/search', params=params)
+            d = await response.json()
+            assert [r['content'] for r in d] == ['Crise agricole: un virage populiste ?']
+            assert d[0]['begin'] == (T0 + timedelta(minutes=5)).isoformat()
+
+            response = await client.get('/api/search', params={'q': 'crise', 'limit': '1'})
+            assert len(await response.json()) == 1
+            for params in ({'q': ''}, {'q': 'crise', 'begin': 'yesterday'}, {'q': 'crise', 'limit': '0'}):
+                response = await client.get('/api/search', params=params)
+                assert response.status == 400
+        finally:
+            await client.close()
+
+    asyncio.run(run())
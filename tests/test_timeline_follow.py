@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from cablewatch import timeline
+from test_ingest_index import T0, make_segment
+
+
+def ingest_later(datadir, delays):
+    index = timeline.IngestIndex.open()
+    for delay, offset, hole in delays:
+        time.sleep(delay)
+        seg = make_segment(datadir, T0 + timedelta(seconds=offset))
+        index.addSegment(seg)
+        if hole:
+            index.markHole(seg.filename)
+
+
+def start_ingest(datadir, delays):
+    thread = threading.Thread(target=ingest_later, args=(datadir, delays))
+    thread.start()
+    return thread
+
+
+def create_timeline(datadir):
+    index = timeline.IngestIndex()
+    index.addSegment(make_segment(datadir, T0))
+    index.addSegment(make_segment(datadir, T0 + timedelta(seconds=30)))
+    return timeline.IngestTimeLine(name='live', begin=T0 + timedelta(seconds=10), duration=timedelta(seconds=30),
+        index=timeline.IngestIndex.open())
+
+
+def test_follow_segments(datadir):
+    tl = create_timeline(datadir)
+    thread = start_ingest(datadir, [(0.1, 60, False), (0.1, 90, False), (0.1, 125, False)])
+    segments = []
+    t0 = time.monotonic()
+    for seg in tl.follow(end=T0 + timedelta(seconds=140), poll_period=0.02):
+        segments.append((seg.begin - T0, seg.inpoint, seg.outpoint, time.monotonic() - t0))
+    thread.join()
+    assert [s[:3] for s in segments] == [
+        (timedelta(seconds=0), timedelta(seconds=10), None),
+        (timedelta(seconds=30), None, None),
+        (timedelta(seconds=60), None, None),
+        (timedelta(seconds=90), None, None),
+        (timedelta(seconds=125), None, timedelta(seconds=15)),
+    ]
+    assert segments[-1][3] < 1.0
+
+
+def test_follow_slices(datadir):
+    tl = create_timeline(datadir)
+    thread = start_ingest(datadir, [(0.05, 60, True), (0.05, 95, False), (0.05, 125, False)])
+    slices = []
+    for slice in tl.follow(slices=True, poll_period=0.02, timeout=0.3):
+        slices.append([seg.begin - T0 for seg in slice.segments])
+    thread.join()
+    assert slices == [
+        [timedelta(seconds=0), timedelta(seconds=30), timedelta(seconds=60)],
+        [timedelta(seconds=95), timedelta(seconds=125)],
+    ]
+
+
+def test_follow_async(datadir):
+    tl = create_timeline(datadir)
+
+    async def run():
+        begins = []
+        async for seg in tl.follow(poll_period=0.02, timeout=0.3):
+            begins.append(seg.begin - T0)
+            if len(begins) == 2:
+                await asyncio.to_thread(ingest_later, datadir, [(0, 60, False)])
+        return begins
+
+    assert asyncio.run(run()) == [timedelta(seconds=0), timedelta(seconds=30), timedelta(seconds=60)]
+
+
+def test_follow_survives_reindex(datadir):
+    tl = create_timeline(datadir)
+    follower = tl.follow(poll_period=0.02)
+    assert len(follower.poll()) == 2
+    make_segment(datadir, T0 + timedelta(seconds=60))
+    timeline.IngestIndex().rebuild()
+    assert [seg.begin - T0 for seg in follower.poll()] == [timedelta(seconds=60)]
+    assert follower.poll() == []
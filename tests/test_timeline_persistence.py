@@ -0,0 +1,62 @@
+import os
+import multiprocessing
+from datetime import timedelta
+import pytest
+from cablewatch import timeline
+from test_ingest_index import T0, populate
+
+
+def create_timeline(datadir, duration=30):
+    populate(datadir)
+    timeline.IngestIndex().rebuild()
+    tl = timeline.IngestTimeLine(name='worker', begin=T0, duration=timedelta(seconds=duration))
+    tl.save()
+    return tl
+
+
+def test_save_is_atomic(datadir):
+    create_timeline(datadir)
+    assert sorted(os.listdir(f'{datadir}/timelines')) == ['.worker.lock', 'worker.json']
+    assert timeline.IngestTimeLine.loadState('worker') == (T0, timedelta(seconds=30))
+
+
+def test_compare_and_advance(datadir):
+    create_timeline(datadir)
+    tl1 = timeline.IngestTimeLine(name='worker')
+    tl2 = timeline.IngestTimeLine(name='worker')
+    tl1.compareAndAdvance()
+    assert tl1.begin == T0 + timedelta(seconds=30)
+    with pytest.raises(timeline.IngestTimeLineConflictError):
+        tl2.compareAndAdvance()
+    assert tl2.begin == T0
+    assert timeline.IngestTimeLine.loadState('worker')[0] == T0 + timedelta(seconds=30)
+
+
+def claim_windows(n, queue):
+    begins = []
+    for i in range(n):
+        tl = timeline.IngestTimeLine.claim('worker')
+        begins.append(tl.begin)
+    queue.put(begins)
+
+
+def test_concurrent_claims(datadir):
+    create_timeline(datadir, duration=5)
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    workers = [ctx.Process(target=claim_windows, args=(25, queue)) for i in range(4)]
+    for w in workers:
+        w.start()
+    begins = []
+    for w in workers:
+        begins += queue.get(timeout=30)
+    for w in workers:
+        w.join()
+        assert w.exitcode == 0
+    assert sorted(begins) == [T0 + timedelta(seconds=5 * i) for i in range(100)]
+    assert timeline.IngestTimeLine.loadState('worker')[0] == T0 + timedelta(seconds=500)
+
+
+def test_claim_protected(datadir):
+    with pytest.raises(AssertionError):
+        timeline.IngestTimeLine.claim('glob')
@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+import types
+from datetime import timedelta
+from aiohttp.test_utils import TestClient, TestServer
+from cablewatch import http, ingest, timeline
+from test_ingest_index import T0, make_segment, populate
+
+
+def run_client(index, scenario):
+    async def run():
+        http_service = http.HTTPService()
+        ingest_service = types.SimpleNamespace(index=index)
+        ingest.IngestTimeLineService(http_service=http_service, ingest_service=ingest_service)
+        client = TestClient(TestServer(http_service._app))
+        await client.start_server()
+        try:
+            await scenario(client)
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+
+def test_timeline_routes(datadir):
+    populate(datadir)
+    index = timeline.IngestIndex()
+    index.rebuild()
+    tl = timeline.IngestTimeLine(name='skeleton', begin=T0, duration=timedelta(seconds=60), index=index)
+    tl.save()
+
+    async def scenario(client):
+        response = await client.get('/api/timelines')
+        assert response.status == 200
+        assert [d['name'] for d in await response.json()] == ['glob', 'skeleton']
+
+        response = await client.get('/api/timelines/skeleton')
+        d = await response.json()
+        assert d['number_of_segments'] == 2
+        assert d['number_of_holes'] == 1
+        assert d['duration'] == 60
+
+        response = await client.get('/api/timelines/glob/slices')
+        slices = await response.json()
+        assert [len(s['segments']) for s in slices] == [2, 3]
+
+        timestamp = (T0 + timedelta(seconds=70)).isoformat()
+        response = await client.get('/api/timelines/glob/lookup', params={'timestamp': timestamp})
+        d = await response.json()
+        assert d['begin'] == (T0 + timedelta(seconds=65)).isoformat()
+        assert d['offset'] == 5
+        response = await client.get('/api/timelines/glob/lookup', params={'timestamp': (T0 + timedelta(seconds=150)).isoformat()})
+        assert response.status == 404
+        response = await client.get('/api/timelines/glob/lookup', params={'timestamp': 'yesterday'})
+        assert response.status == 400
+
+        response = await client.post('/api/timelines/skeleton/advance')
+        d = await response.json()
+        assert d['begin'] == (T0 + timedelta(seconds=60)).isoformat()
+        assert d['number_of_segments'] == 3
+        assert timeline.IngestTimeLine(name='skeleton', index=index).begin == T0 + timedelta(seconds=60)
+
+        response = await client.post('/api/timelines/skeleton/claim')
+        d = await response.json()
+        assert d['begin'] == (T0 + timedelta(seconds=60)).isoformat()
+        assert [len(s['segments']) for s in d['slices']] == [1, 2]
+        response = await client.get('/api/timelines/skeleton')
+        assert (await response.json())['begin'] == (T0 + timedelta(seconds=120)).isoformat()
+
+        response = await client.post('/api/timelines/glob/advance')
+        assert response.status == 400
+        response = await client.get('/api/timelines/missing')
+        assert response.status == 404
+
+    run_client(index, scenario)
+
+
+def test_claim_waits_for_the_lock_off_the_event_loop(datadir):
+    populate(datadir)
+    index = timeline.IngestIndex()
+    index.rebuild()
+    timeline.IngestTimeLine(name='skeleton', begin=T0, duration=timedelta(seconds=60), index=index).save()
+    locked = threading.Event()
+
+    def hold_lock():
+        # a worker enqueueing windows holds the timeline lock
+        with timeline.IngestTimeLine.locked('skeleton'):
+            locked.set()
+            time.sleep(0.3)
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait()
+
+    async def scenario(client):
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        task = asyncio.create_task(tick())
+        response = await client.post('/api/timelines/skeleton/claim')
+        task.cancel()
+        assert response.status == 200
+        assert (await response.json())['begin'] == T0.isoformat()
+        assert ticks >= 10
+
+    run_client(index, scenario)
+    thread.join()
+
+
+def test_timeline_cache_follows_index(datadir):
+    populate(datadir)
+    index = timeline.IngestIndex()
+    index.rebuild()
+
+    async def scenario(client):
+        response = await client.get('/api/timelines/glob')
+        assert (await response.json())['number_of_segments'] == 5
+        response = await client.get('/api/timelines/glob')
+        assert (await response.json())['number_of_segments'] == 5
+        index.addSegment(make_segment(datadir, T0 + timedelta(seconds=215)))
+        response = await client.get('/api/timelines/glob')
+        d = await response.json()
+        assert d['number_of_segments'] == 6
+        assert d['end'] == (T0 + timedelta(seconds=245)).isoformat()
+
+    run_client(index, scenario)
+
+
+def test_playlist_and_segments(datadir):
+    segs = populate(datadir)
+    for seg in segs:
+        with open(seg.filename, 'wb') as f:
+            f.write(bytes(range(188)) * 100)
+    index = timeline.IngestIndex()
+    index.rebuild()
+
+    async def scenario(client):
+        begin = (T0 + timedelta(seconds=10)).isoformat()
+        end = (T0 + timedelta(seconds=110)).isoformat()
+        response = await client.get('/api/timelines/glob/playlist.m3u8', params={'begin': begin, 'end': end})
+        assert response.status == 200
+        assert response.headers['Cache-Control'] == 'public, max-age=3600'
+        lines = (await response.text()).splitlines()
+        assert lines[-1] == '#EXT-X-ENDLIST'
+        assert '#EXT-X-START:TIME-OFFSET=10.000,PRECISE=YES' in lines
+        assert lines.count('#EXT-X-DISCONTINUITY') == 1
+        uris = [ln for ln in lines if not ln.startswith('#')]
+        assert uris == [f'/api/segments/{seg.basename}' for seg in segs[:4]]
+        extinfs = [ln for ln in lines if ln.startswith('#EXTINF:')]
+        assert extinfs == ['#EXTINF:30.000,'] * 3 + ['#EXTINF:15.000,']
+        assert '#EXT-X-BYTERANGE:9400@0' in lines
+
+        etag = response.headers['ETag']
+        response = await client.get('/api/timelines/glob/playlist.m3u8', params={'begin': begin, 'end': end},
+            headers={'If-None-Match': etag})
+        assert response.status == 304
+
+        response = await client.get('/api/timelines/glob/playlist.m3u8', params={'slice': '1'})
+        uris = [ln for ln in (await response.text()).splitlines() if not ln.startswith('#')]
+        assert uris == [f'/api/segments/{seg.basename}' for seg in segs[2:]]
+        response = await client.get('/api/timelines/glob/playlist.m3u8', params={'slice': '2'})
+        assert response.status == 404
+
+        response = await client.get(f'/api/segments/{segs[0].basename}', headers={'Range': 'bytes=188-375'})
+        assert response.status == 206
+        assert await response.read() == bytes(range(188))
+        assert 'immutable' in response.headers['Cache-Control']
+        response = await client.get(f'/api/segments/{segs[0].basename}.hole')
+        assert response.status == 404
+        response = await client.get('/api/segments/..%2Findex.jsonl')
+        assert response.status == 404
+
+    run_client(index, scenario)
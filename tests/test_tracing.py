@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from cablewatch import http, ingest, timeline, tracing
+from test_ingest_index import populate
+
+
+@pytest.fixture
+def tracer():
+    tracing.TRACER.reset()
+    tracing.TRACER.enable()
+    yield tracing.TRACER
+    tracing.TRACER.disable()
+    tracing.TRACER.reset()
+
+
+def test_disabled_tracer():
+    tracer = tracing.IngestTracer()
+    assert tracer.span('stage') is tracing.NULL_SPAN
+    with tracer.span('stage'):
+        pass
+    assert tracer.getStats() == {}
+    assert tracer.number_of_events == 0
+
+
+def test_stats_and_chrome_trace(tmp_path):
+    tracer = tracing.IngestTracer(enabled=True, max_events=3)
+    for i in range(4):
+        tracer.record('ingest.line', 0, 2000 * (i + 1), track='pipeline1')
+    tracer.record('timeline.build', 0, 5_000_000, args={'name': 'glob', 'segments': 3})
+    stats = tracer.getStats()
+    assert list(stats) == ['ingest.line', 'timeline.build']
+    d = stats['ingest.line']
+    assert d['count'] == 4
+    assert d['min'] == 0.002 and d['max'] == 0.008 and d['mean'] == 0.005
+    assert d['p50'] <= d['p90'] <= d['p99'] == d['max']
+    assert sum(d['buckets'].values()) == 4
+
+    filename = tracer.exportChromeTrace(f'{tmp_path}/traces/trace.json')
+    with open(filename) as f:
+        events = json.load(f)['traceEvents']
+    spans = [e for e in events if e['ph'] == 'X']
+    # only the most recent events are kept
+    assert [e['name'] for e in spans] == ['ingest.line', 'ingest.line', 'timeline.build']
+    assert spans[-1]['dur'] == 5000 and spans[-1]['cat'] == 'timeline'
+    assert spans[-1]['args'] == {'name': 'glob', 'segments': 3}
+    names = {e['tid']: e['args']['name'] for e in events if e['ph'] == 'M'}
+    assert names[spans[0]['tid']] == 'pipeline1'
+
+
+def test_traced(tracer, datadir):
+    @tracing.traced('test.sync')
+    def f(x):
+        return x + 1
+
+    @tracing.traced('test.async')
+    async def g(x):
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    assert f(1) == 2
+    assert asyncio.run(g(2)) == 4
+    populate(datadir)
+    index = timeline.IngestIndex()
+    index.rebuild()
+    timeline.IngestTimeLine(name='glob', index=index)
+    stats = tracer.getStats()
+    assert stats['test.sync']['count'] == 1
+    assert stats['test.async']['min'] >= 10
+    assert stats['timeline.build']['count'] == 1
+    tracer.disable()
+    f(1)
+    assert tracer.getStats()['test.sync']['count'] == 1
+
+
+def busy_loop(duration):
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < duration:
+        pass
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = tracing.IngestSamplingProfiler(interval=0.001)
+    profiler.start()
+    with pytest.raises(AssertionError):
+        profiler.start()
+    busy_loop(0.2)
+    profiler.stop()
+    assert profiler.number_of_samples > 20
+    assert profiler.getTopFunctions(1)[0][0] == 'test_tracing.py:busy_loop'
+    filename = profiler.exportFolded(f'{tmp_path}/profile.folded')
+    with open(filename) as f:
+        stack, count = f.readline().rsplit(' ', 1)
+    assert stack.endswith('test_tracing.py:test_sampling_profiler;test_tracing.py:busy_loop')
+
+
+def test_ingest_routes(tracer, datadir):
+    async def run():
+        http_service = http.HTTPService()
+        ingest.IngestService(http_service=http_service, recording_requested=False)
+        client = TestClient(TestServer(http_service._app))
+        await client.start_server()
+        try:
+            async with client.ws_connect('/api/ingest') as ws:
+                status = await ws.receive_json()
+                assert status['tracing'] is True and status['profiling'] is False
+                await ws.send_str('profile-start')
+                assert (await ws.receive_json())['profiling'] is True
+                assert (await ws.receive_json())['message'] == 'ok'
+                await ws.send_str('profile-start')
+                assert (await ws.receive_json())['message'] == 'state error: profiler is running'
+                await asyncio.sleep(0.1)
+                await ws.send_str('profile-stop')
+                assert (await ws.receive_json())['profiling'] is False
+                message = (await ws.receive_json())['message']
+                assert message.startswith('ok: ') and os.path.exists(message[4:])
+                assert message[4:].startswith(f'{datadir}/logs/profiles/profile_')
+
+            response = await client.get('/api/ingest/tracing')
+            d = await response.json()
+            assert d['enabled'] is True
+            assert d['stages']['ingest.push_status']['count'] >= 2
+            response = await client.get('/api/ingest/tracing/trace.json')
+            events = (await response.json())['traceEvents']
+            assert 'ingest.push_status' in [e['name'] for e in events]
+            response = await client.post('/api/ingest/tracing/reset')
+            assert (await response.json())['stages'] == {}
+        finally:
+            await client.close()
+
+    asyncio.run(run())